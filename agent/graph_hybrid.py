@@ -1,62 +1,264 @@
 import json
 import os
-import urllib.request
 import re
+import threading
+import time
 from typing import TypedDict, List, Dict, Any
-from langgraph.graph import StateGraph, END
-from agent.tools.sqlite_tool import SQLiteTool
-from agent.rag.retrieval import Retriever
+from agent.tools.llm_client import get_client
+from agent.tools.json_stream import JSONObjectScanner
+from agent.tools.sqlite_tool import render_result
+from agent.router_rules import RuleRouter
+from agent.tracing import traced, record, current_spans, detached_span, merge_llm_calls
+from agent.snapshot import SNAPSHOT_PATH, file_fingerprint, docs_fingerprint, load_snapshot, update_snapshot
 
-import dspy
-from agent.dspy_signatures import GenerateSQL
+# NOTE: importing this module has no side effects. DSPy, LangGraph, the DB tool, the
+# schema and the BM25 index are loaded lazily by build_app() / Resources on first use.
 
 MODEL = "phi3.5:3.8b-mini-instruct-q4_K_M"
 
-lm = dspy.LM(
-    model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M", 
-    api_base="http://localhost:11434", 
-    api_key="",
-    temperature=0.0,
-    num_ctx=6144
-)
-dspy.configure(lm=lm)
-
-# Load the optimized SQL module
-OPTIMIZED_SQL_PATH = "agent/sql_optimized.json"
-if os.path.exists(OPTIMIZED_SQL_PATH):
-    compiled_sql_module = dspy.Predict(GenerateSQL)
-    compiled_sql_module.load(OPTIMIZED_SQL_PATH)
-    USE_DSPY_SQL = True
-else:
-    compiled_sql_module = dspy.Predict(GenerateSQL)  
-    USE_DSPY_SQL = True  
-
-# Initialize DB Tool
-db_tool = SQLiteTool()
-schema_info = db_tool.get_schema()
+# Stream the synthesizer and stop decoding once a complete answer object has been emitted
+SYNTH_STREAM = os.environ.get("SYNTH_STREAM", "1") not in ("0", "false")
+
+# Compile templated plans straight to SQL and only ask the LLM for the rest (agent/plan_compiler.py)
+PLAN_COMPILER = os.environ.get("PLAN_COMPILER", "1") not in ("0", "false")
+
+# Try rule-based fixes for mechanical SQL errors before asking the LLM to repair (agent/tools/sql_repair.py)
+SQL_AUTO_REPAIR = os.environ.get("SQL_AUTO_REPAIR", "1") not in ("0", "false")
+
+# SQL candidates generated per nl2sql attempt. With more than one, the candidates are
+# generated, validated and executed in parallel and one successful result is chosen:
+# "first" takes the lowest-numbered candidate that ran (without waiting for slower ones),
+# "majority" the result most candidates agree on. Candidate 0 is the usual greedy call with the optimized demos;
+# the others reorder the demos, and once the orderings run out sample at SQL_CANDIDATE_TEMPERATURE.
+SQL_CANDIDATES = int(os.environ.get("SQL_CANDIDATES", "1"))
+SQL_CANDIDATE_SELECTION = os.environ.get("SQL_CANDIDATE_SELECTION", "first")
+SQL_CANDIDATE_TEMPERATURE = float(os.environ.get("SQL_CANDIDATE_TEMPERATURE", "0.5"))
+
+# Answer questions about a registered KPI (docs/kpi_definitions.md) with NumPy instead of SQL (agent/kpi.py)
+KPI_ENGINE = os.environ.get("KPI_ENGINE", "1") not in ("0", "false")
+
+# Reuse the plan and SQL of an earlier, similar question (agent/tools/question_cache.py)
+QUESTION_CACHE = os.environ.get("QUESTION_CACHE", "1") not in ("0", "false")
+
+# Defaults for build_app(); any key can be overridden per call
+DEFAULT_CONFIG = {
+    "model": MODEL,
+    "num_ctx": 6144,
+    "optimized_sql_path": "agent/sql_optimized.json",
+    "docs_path": "docs",
+    "snapshot_path": SNAPSHOT_PATH,
+    "use_snapshot": True,
+    "bm25_index_dir": None,  # None: BM25_INDEX_DIR or .cache/bm25_index (agent/rag/bm25_index.py)
+    "validate_sql": True,
+    "question_cache": QUESTION_CACHE,
+    "compile_plans": PLAN_COMPILER,
+    "kpi_engine": KPI_ENGINE,
+    "repair_sql": SQL_AUTO_REPAIR,
+    "sql_candidates": SQL_CANDIDATES,
+    "candidate_selection": SQL_CANDIDATE_SELECTION,
+}
+
+# Deterministic fast path in front of the LLM router
+RULE_ROUTER = RuleRouter()
+
+_MISSING = object()
+
+
+class Resources:
+    """
+    Heavy per-process resources, each created on first use and then cached:
+    the DSPy LM and optimized SQL module, the DB tool, the schema text and the retriever.
+
+    With use_snapshot, the schema text is read from a warm snapshot on disk as long as the
+    DB file is unchanged, and the BM25 index is memory-mapped from bm25_index_dir, rebuilt
+    only for docs whose content changed, so a new process skips the Orders scan, the
+    PRAGMAs and the tokenization.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self._lock = threading.RLock()
+        self._cache = {}
+
+    def _get(self, name, loader):
+        value = self._cache.get(name, _MISSING)
+        if value is _MISSING:
+            with self._lock:
+                if name not in self._cache:
+                    self._cache[name] = loader()
+                value = self._cache[name]
+        return value
+
+    @property
+    def lm(self):
+        return self._get("lm", self._load_lm)
+
+    @property
+    def sql_module(self):
+        return self._get("sql_module", self._load_sql_module)
+
+    @property
+    def db_tool(self):
+        return self._get("db_tool", self._load_db_tool)
+
+    @property
+    def schema_info(self) -> str:
+        return self._get("schema_info", self._load_schema_info)
+
+    @property
+    def retriever(self):
+        return self._get("retriever", self._load_retriever)
+
+    @property
+    def validator(self):
+        return self._get("validator", self._load_validator)
+
+    @property
+    def sql_repairer(self):
+        return self._get("sql_repairer", self._load_sql_repairer)
+
+    @property
+    def question_cache(self):
+        return self._get("question_cache", self._load_question_cache)
+
+    @property
+    def plan_compiler(self):
+        return self._get("plan_compiler", self._load_plan_compiler)
+
+    @property
+    def kpi_engine(self):
+        return self._get("kpi_engine", self._load_kpi_engine)
+
+    def warm(self):
+        """Loads everything up front (e.g. before forking workers)."""
+        self.lm, self.sql_module, self.schema_info, self.retriever, self.question_cache, self.plan_compiler
+        self.kpi_engine
+
+    def _load_lm(self):
+        # DSPy shares the pooled keep-alive client with query_ollama
+        from agent.tools.dspy_lm import OllamaLM
+        return OllamaLM(model=self.config["model"], temperature=0.0, num_ctx=self.config["num_ctx"])
+
+    def _load_sql_module(self):
+        import dspy
+        from agent.dspy_signatures import GenerateSQL
+
+        # Load the optimized SQL module
+        module = dspy.Predict(GenerateSQL)
+        if os.path.exists(self.config["optimized_sql_path"]):
+            module.load(self.config["optimized_sql_path"])
+        return module
+
+    def _load_db_tool(self):
+        from agent.tools.sqlite_tool import SQLiteTool
+        return SQLiteTool()
+
+    def _load_validator(self):
+        from agent.tools.sql_validator import SQLValidator
+        return SQLValidator(self.db_tool, self.schema_info)
+
+    def _load_sql_repairer(self):
+        if not self.config["repair_sql"]:
+            return None
+        from agent.tools.sql_repair import SQLRepairer
+        validator = self.validator if self.config["validate_sql"] else None
+        return SQLRepairer(self.db_tool, self.schema_info, validator)
+
+    def _load_question_cache(self):
+        if not self.config["question_cache"]:
+            return None
+        from agent.tools.question_cache import QuestionCache, entity_names
+
+        # Plans depend on the docs (campaign dates, KPI formulas) and the model that wrote them
+        version = f"{self.config['model']}:{docs_fingerprint(self.config['docs_path'])}"
+        return QuestionCache(version=version, names=entity_names(self.db_tool.db_path))
+
+    def _load_plan_compiler(self):
+        if not self.config["compile_plans"]:
+            return None
+        from agent.plan_compiler import PlanCompiler, load_known_values
+        return PlanCompiler(known_values=load_known_values(self.db_tool.db_path))
+
+    def _load_kpi_engine(self):
+        if not self.config["kpi_engine"]:
+            return None
+        from agent.kpi import KPIEngine
+        try:
+            return KPIEngine(self.db_tool.db_path, kpi_path=os.path.join(self.config["docs_path"], "kpi_definitions.md"))
+        except (OSError, ValueError) as e:
+            print(f"Warning: KPI engine failed to load: {e}")
+            return None
+
+    def _load_schema_info(self) -> str:
+        from agent.tools.analytics_db import resolve_db_path
+        from agent.tools.sqlite_tool import DB_PATH
+
+        path = self.config["snapshot_path"]
+        if self.config["use_snapshot"]:
+            cached = load_snapshot(path).get("schema", {})
+            db_path = resolve_db_path(DB_PATH)
+            if cached.get("db_path") == db_path and cached.get("fingerprint") == file_fingerprint(db_path):
+                return cached["text"]
+
+        text = self.db_tool.get_schema()
+        if self.config["use_snapshot"]:
+            # Fingerprint after the tool has created its views, which may touch the file
+            db_path = self.db_tool.db_path
+            update_snapshot("schema", {"db_path": db_path, "fingerprint": file_fingerprint(db_path), "text": text}, path)
+        return text
+
+    def _load_retriever(self):
+        from agent.rag.retrieval import Retriever
+        from agent.rag.bm25_index import INDEX_DIR
+
+        docs_path = self.config["docs_path"]
+        try:
+            if self.config["use_snapshot"]:
+                retriever = Retriever(docs_path=docs_path, index_dir=self.config["bm25_index_dir"] or INDEX_DIR)
+                if retriever.index_stats.get("built"):
+                    print(f"   [Retriever]: BM25 index rebuilt ({retriever.index_stats['tokenized']} docs tokenized, "
+                          f"{retriever.index_stats['reused']} reused)")
+                return retriever
+            return Retriever(docs_path=docs_path)
+        except Exception as e:
+            print(f"Warning: Retriever failed to load (check docs/ folder): {e}")
+            return None
+
+
+# One active configuration per process; set by build_app()
+_RESOURCES = None
+_RESOURCES_LOCK = threading.Lock()
+
+
+def get_resources() -> Resources:
+    global _RESOURCES
+    with _RESOURCES_LOCK:
+        if _RESOURCES is None:
+            _RESOURCES = Resources(dict(DEFAULT_CONFIG))
+        return _RESOURCES
 
 
 #  Minimal Ollama Client 
 def query_ollama(messages: List[Dict[str, str]], model: str = "phi3.5:3.8b-mini-instruct-q4_K_M", temperature: float = 0.0) -> str:
     """
-    Sends a raw request to the local Ollama instance.
+    Sends a chat request to the local Ollama instance over the shared keep-alive pool.
     """
-    url = "http://localhost:11434/api/chat"
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": False,
-        "options": {
-            "temperature": temperature
-        }
-    }
-    
     try:
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode("utf-8"))
-            return result["message"]["content"]
+        result = get_client().chat(messages, model=model, options={"temperature": temperature})
+        return result["message"]["content"]
+    except Exception as e:
+        return f"Error communicating with Ollama: {str(e)}"
+
+def query_ollama_until_json(messages: List[Dict[str, str]], required_key: str, model: str = MODEL, temperature: float = 0.0) -> str:
+    """
+    Streams a chat completion and aborts generation as soon as a complete JSON object
+    containing `required_key` has been produced. Returns the text received so far.
+    """
+    scanner = JSONObjectScanner(required_key=required_key)
+    try:
+        result = get_client().chat_stream(messages, model=model, options={"temperature": temperature},
+                                          stop_when=scanner.feed)
+        return result["message"]["content"]
     except Exception as e:
         return f"Error communicating with Ollama: {str(e)}"
 
@@ -70,24 +272,16 @@ class AgentState(TypedDict):
     sql_query: str
     sql_result: str
     sql_valid: bool
+    validation_errors: List[Dict[str, str]]
     attempt_count: int
     final_answer: Any
     explanation: str
     citations: List[str]
+    question_cache_id: int
+    sql_candidates: List[Dict[str, Any]]
+    candidates_executed: bool
 
 
-def retriever_node(state: AgentState):
-    print("--- Node: Retriever ---")
-    question = state["question"]
-    
-    if Retriever:
-        # Get top 3 chunks
-        results = Retriever.search(question, top_k=3)
-    else:
-        results = []
-        
-    return {"retrieved_docs": results}
-
 def classify_question_standard(question: str) -> str:
     """
     Classifies the user question into: 'rag' or 'hybrid'.
@@ -124,16 +318,32 @@ Return a JSON object: {"classification": "..."}
         data = json.loads(clean)
         return data.get("classification", "hybrid").lower()
     except:
-        q = question.lower()
-        if "how many" in q or "sum" in q or "count" in q or "total" in q or "1997" in q:
-            return "hybrid"
-        return "rag"
+        # Unparseable LLM output: take the rules' best guess, however weak
+        label, _ = RULE_ROUTER.score(question)
+        return label
 
+@traced("router")
 def router_node(state: AgentState):
     print("--- Node: Router ---")
     question = state["question"]
+
+    # 0. A near-duplicate of an answered question reuses its plan and SQL (straight to the executor)
+    cache = get_resources().question_cache
+    if cache is not None:
+        entry, similarity = cache.lookup(question, state.get("format_hint", ""))
+        record(question_cache="hit" if entry else "miss", question_cache_similarity=similarity)
+        if entry:
+            print(f"   [Question Cache]: hit (similarity {similarity:.2f}): {entry['question'][:60]}")
+            return {"classification": "hybrid", "sql_plan": entry["sql_plan"], "sql_query": entry["sql_query"],
+                    "question_cache_id": entry["id"]}
+
+    # 1. Clear-cut questions never reach the LLM
+    label, confidence, confident = RULE_ROUTER.classify(question)
+    if confident:
+        print(f"   [Decision]: {label} (rules, confidence {confidence:.2f})")
+        return {"classification": label}
     
-    # 1. Select Strategy (Toggle for DSPy later)
+    # 2. Select Strategy (Toggle for DSPy later)
     use_dspy = False
     
     if use_dspy:
@@ -142,7 +352,7 @@ def router_node(state: AgentState):
     else:
         classification = classify_question_standard(question)
         
-    print(f"   [Decision]: {classification}")
+    print(f"   [Decision]: {classification} (LLM, rules confidence {confidence:.2f})")
     
     return {"classification": classification}
 
@@ -162,6 +372,7 @@ def _apply_time_shift(text: str) -> str:
     # Regex for 4-digit years
     return re.sub(r'\b(199\d)\b', replace_year, text)
 
+@traced("planner")
 def planner_node(state: AgentState):
     print("--- Node: Planner ---")
     question = state["question"]
@@ -192,12 +403,18 @@ def planner_node(state: AgentState):
    - **Do NOT Default to Customer:** If asked for "Top Category", set intent to "Top 1 Category".
    - **Aggregates (Force NONE):** If the question asks for "Total Revenue", "AOV", or "How much..." (even if filtered by a specific Category like Beverages), YOU MUST set RANKING_INTENT: "None".
 
+4. **Filters:**
+   - If the question is restricted to a specific Category, Product or Customer, write it as `Category = 'Beverages'` (several: `Category IN ('Beverages', 'Condiments')`).
+   - A marketing campaign name (e.g. 'Summer Beverages 1997') only sets the dates; it is NOT a filter.
+   - Otherwise set FILTERS: None.
+
 ### FORMAT (Strict ONLY YAML) (DO NOT RETURN ANYTHING ELSE)
 TIME_SCOPE: <'RANGE' or 'ALL_TIME'>
 START_DATE: <YYYY-MM-DD or None>
 END_DATE: <YYYY-MM-DD or None>
 RANKING_INTENT: <e.g. "Top 1 Category", "Top 3 Products", "Top 1 Customer", or "None">
 METRIC_FORMULA: <Math Only>
+FILTERS: <e.g. Category = 'Beverages', or None>
 """
     
     user_message = f"""
@@ -218,6 +435,56 @@ OUTPUT:
     return {"sql_plan": corrected_plan}
 
 
+@traced("kpi")
+def kpi_node(state: AgentState):
+    """
+    Evaluates the plan with the KPI engine when the question is about exactly one
+    registered KPI and the plan parses; otherwise leaves the state alone for nl2sql.
+    """
+    print("--- Node: KPI ---")
+    engine = get_resources().kpi_engine
+    if engine is None:
+        return {}
+    from agent.kpi import ENTITY_COLUMNS, stated_cost_ratio
+    from agent.plan_compiler import parse_plan
+    from agent.tools.sqlite_tool import QueryResult
+
+    question = state["question"]
+    kpis = engine.find(question)
+    try:
+        if len(kpis) != 1:
+            raise ValueError(f"{len(kpis)} registered KPIs in the question")
+        plan = parse_plan(state["sql_plan"], require_metric=False)
+        unknown = engine.unknown_values(plan.filters)
+        if unknown:
+            raise ValueError(f"unknown filter value {unknown[0]!r}")
+        kpi = kpis[0]
+        cost_ratio = stated_cost_ratio(question) if kpi.uses_cost else None
+        value = engine.evaluate(kpi, plan.start_date, plan.end_date, plan.filters, group_by=plan.rank_entity,
+                                top_n=plan.top_n, descending=plan.descending, cost_ratio_of_price=cost_ratio)
+    except ValueError as e:
+        record(kpi_evaluated=False, kpi_fallback=str(e))
+        print(f"   [KPI]: {e}, generating SQL")
+        return {}
+
+    label = kpi.aliases[-1]
+    if plan.rank_entity:
+        result = QueryResult(columns=[{"name": ENTITY_COLUMNS[plan.rank_entity], "type": "TEXT"},
+                                      {"name": label, "type": "REAL"}], rows=value)
+    else:
+        result = QueryResult(columns=[{"name": label, "type": "REAL"}], rows=[(value,)])
+
+    # No SQL ran; the sql field records how the number was computed
+    scope = f"{plan.start_date or 'all time'} to {plan.end_date or 'all time'}"
+    filters = "; ".join(f"{e} in {v}" for e, v in plan.filters.items()) or "no filters"
+    description = f"-- KPI {engine.describe(kpi, cost_ratio)}\n-- {scope}; {filters}"
+    if plan.rank_entity:
+        description += f"; {'top' if plan.descending else 'bottom'} {plan.top_n} by {plan.rank_entity}"
+    record(kpi_evaluated=True, kpi=kpi.name)
+    print(f"   [KPI]: {kpi.name} evaluated, SQL skipped")
+    return {"sql_query": description, "sql_result": render_result(result), "sql_valid": True}
+
+
 def clean_sql(text: str) -> str:
     """Removes markdown fencing and whitespace."""
     pattern = r"```sql\s*(.*?)\s*```"
@@ -228,6 +495,7 @@ def clean_sql(text: str) -> str:
 
 
 
+@traced("nl2sql")
 def nl2sql_node(state: AgentState):
     """
     NL2SQL Node - Now using DSPy Optimized Module
@@ -256,13 +524,54 @@ ERROR: {prev_error}
 
 HINT: Check Joins and Column Names."""
     
+    resources = get_resources()
+
+    # Templated plans compile straight to SQL; repairs and everything else go to the LLM
+    compiler = resources.plan_compiler
+    if compiler is not None and not prev_error:
+        sql_query, reason = compiler.compile(plan)
+        record(plan_compiled=sql_query is not None, compiler_fallback=reason)
+        if sql_query:
+            print("   [Compiler]: plan compiled, LLM skipped")
+            print(f"DEBUG [NL2SQL]: \n{sql_query}")
+            return {"sql_query": sql_query, "candidates_executed": False}
+        print(f"   [Compiler]: {reason}, using the LLM")
+
+    if resources.config["sql_candidates"] > 1:
+        return run_sql_candidates(state, plan_with_context, resources.config["sql_candidates"])
+
+    sql_query = generate_sql(question, plan_with_context)
+    print(f"DEBUG [NL2SQL]: \n{sql_query}")
+    
+    return {"sql_query": sql_query, "candidates_executed": False}
+
+
+def generate_sql(question: str, plan_with_context: str, variant: int = 0) -> str:
+    """
+    One SQL query from the optimized DSPy module (raw prompt if DSPy fails).
+    Variant 0 is the greedy call with the optimized demos; see SQL_CANDIDATES for the others.
+    """
+    resources = get_resources()
     try:
+        import dspy
+
+        module, lm = resources.sql_module, resources.lm
+        if variant:
+            demos = list(module.demos)
+            module = module.deepcopy()
+            if variant < max(len(demos), 1):
+                # A different demo order is a different (still deterministic, cacheable) prompt
+                module.demos = demos[variant:] + demos[:variant]
+            else:
+                lm = lm.copy(temperature=SQL_CANDIDATE_TEMPERATURE)
+
         # Use DSPy module
-        result = compiled_sql_module(
-            question=question,
-            schema_context=schema_info,
-            plan_constraints=plan_with_context
-        )
+        with dspy.context(lm=lm):
+            result = module(
+                question=question,
+                schema_context=resources.schema_info,
+                plan_constraints=plan_with_context
+            )
         
         raw_response = result.sql_query
         
@@ -272,10 +581,133 @@ HINT: Check Joins and Column Names."""
         # Fallback to raw generation if DSPy fails
         raw_response = generate_sql_fallback(plan_with_context)
     
-    sql_query = clean_sql(raw_response)
-    print(f"DEBUG [NL2SQL]: \n{sql_query}")
-    
-    return {"sql_query": sql_query}
+    return clean_sql(raw_response)
+
+
+def _try_candidate(state: AgentState, index: int, plan_with_context: str, done: threading.Event) -> Dict[str, Any]:
+    """
+    Generates, validates and executes one candidate; returns its attempt record, with the
+    LLM calls it made (collected apart from the nl2sql span until the node keeps them).
+    Once `done` is set the wave has its answer and the remaining steps are skipped.
+    """
+    resources = get_resources()
+    with detached_span() as span:
+        start = time.perf_counter()
+        sql_query = generate_sql(state["question"], plan_with_context, variant=index)
+        attempt = {"index": index, "sql": sql_query, "llm_ms": (time.perf_counter() - start) * 1000,
+                   "llm_calls": span["llm_calls"]}
+        if done.is_set():
+            attempt.update(status="abandoned", result="")
+            return attempt
+
+        if resources.config["validate_sql"]:
+            validation = resources.validator.validate(sql_query)
+            if not validation.ok:
+                attempt.update(status="rejected", result=validation.render(), validation_errors=validation.errors)
+                return _repair_candidate(attempt)
+
+        start = time.perf_counter()
+        query_result = resources.db_tool.execute(sql_query)
+        attempt.update(sql_ms=(time.perf_counter() - start) * 1000, result=render_result(query_result),
+                       status="ok" if query_result.ok else "error", rows=len(query_result.rows))
+        return attempt if query_result.ok else _repair_candidate(attempt)
+
+
+def _repair_candidate(attempt: Dict[str, Any]) -> Dict[str, Any]:
+    """Rule-based repair of a failed candidate; a fixed candidate counts as one that ran."""
+    repaired = rule_repair(attempt["sql"], attempt["result"])
+    if repaired is None:
+        return attempt
+    fixed, query_result, rules = repaired
+    attempt.update(auto_repair_rules=rules, auto_repaired=query_result is not None)
+    if query_result is not None:
+        attempt.update(status="ok", sql=fixed, result=render_result(query_result),
+                       validation_errors=[], repaired_from=attempt["sql"])
+    return attempt
+
+
+def _choose_candidate(attempts: List[Dict[str, Any]], selection: str) -> Dict[str, Any]:
+    """The successful attempt `selection` picks ("first" or "majority"), or None."""
+    succeeded = [a for a in attempts if a["status"] == "ok"]
+    if not succeeded:
+        return None
+    if selection == "majority":
+        votes = {}
+        for attempt in succeeded:
+            votes[attempt["result"]] = votes.get(attempt["result"], 0) + 1
+        # Ties go to the lowest-numbered candidate
+        return max(succeeded, key=lambda a: (votes[a["result"]], -a["index"]))
+    return succeeded[0]
+
+
+def run_sql_candidates(state: AgentState, plan_with_context: str, count: int) -> Dict[str, Any]:
+    """
+    One wave of `count` candidates generated, validated and executed concurrently. On
+    success the chosen query is already executed, so the graph skips the validator
+    and executor; if every candidate fails, the wave counts as one attempt.
+    """
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    resources = get_resources()
+    first_valid = resources.config["candidate_selection"] != "majority"
+    done = threading.Event()
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=count)
+    # Each thread runs in a copy of this context (trace, resources); see _try_candidate
+    futures = [executor.submit(contextvars.copy_context().run, _try_candidate, state, i, plan_with_context, done)
+               for i in range(count)]
+    finished = {}
+    for future in as_completed(futures):
+        attempt = future.result()
+        finished[attempt["index"]] = attempt
+        if first_valid:
+            # The lowest-numbered candidate still in play decides: done once it has succeeded
+            leader = next((i for i in range(count) if i not in finished or finished[i]["status"] == "ok"), None)
+            if leader is not None and leader in finished:
+                break
+    # Stragglers finish in the background; their results and LLM calls are not recorded
+    done.set()
+    executor.shutdown(wait=False, cancel_futures=True)
+    wave_ms = (time.perf_counter() - start) * 1000
+    attempts = [finished[i] for i in sorted(finished)]
+
+    chosen = _choose_candidate(attempts, resources.config["candidate_selection"])
+    for attempt in attempts:
+        mark = "*" if attempt is chosen else " "
+        print(f"   [Candidate {attempt['index']}]{mark} {attempt['status']}: {attempt['sql'][:100]}")
+    for attempt in attempts:
+        merge_llm_calls(attempt.pop("llm_calls"))
+    record(candidates=count, candidates_ok=sum(a["status"] == "ok" for a in attempts),
+           candidate_chosen=chosen["index"] if chosen else None, candidates_ms=wave_ms,
+           candidates_finished=len(attempts), candidate_statuses=[a["status"] for a in attempts],
+           auto_repair_rules=[r for a in attempts for r in a.get("auto_repair_rules", [])],
+           auto_repaired=any(a.get("auto_repaired") for a in attempts))
+    history = state.get("sql_candidates") or []
+
+    if chosen is None:
+        # Repair from candidate 0, the greedy one
+        first = attempts[0]
+        return {
+            "sql_query": first["sql"],
+            "sql_result": first["result"],
+            "sql_valid": False,
+            "validation_errors": first.get("validation_errors", []),
+            "attempt_count": state["attempt_count"] + 1,
+            "sql_candidates": history + attempts,
+            "candidates_executed": True,
+        }
+
+    print(f"DEBUG [NL2SQL]: \n{chosen['sql']}")
+    remember_question(state, chosen["sql"], extra_ms=wave_ms, extra_llm_calls=count)
+    return {
+        "sql_query": chosen["sql"],
+        "sql_result": chosen["result"],
+        "sql_valid": True,
+        "validation_errors": [],
+        "sql_candidates": history + attempts,
+        "candidates_executed": True,
+    }
 
 
 def generate_sql_fallback(plan: str) -> str:
@@ -319,24 +751,129 @@ Return raw SQL only.
 
 
 
+@traced("validator")
+def validator_node(state: AgentState):
+    """
+    Prepares the SQL (EXPLAIN QUERY PLAN) and checks it against the schema without running it.
+    A rejected query goes straight back to nl2sql with structured errors, saving an execution.
+    """
+    print("--- Node: Validator ---")
+    resources = get_resources()
+    if not resources.config["validate_sql"]:
+        return {"validation_errors": []}
+
+    start = time.perf_counter()
+    validation = resources.validator.validate(state["sql_query"])
+    record(validation_ms=(time.perf_counter() - start) * 1000,
+           validation_errors=[e["code"] for e in validation.errors],
+           validation_warnings=[w["message"] for w in validation.warnings])
+
+    if validation.ok:
+        for warning in validation.warnings:
+            print(f"   [Plan]: {warning['message']}")
+        return {"validation_errors": []}
+
+    message = validation.render()
+    print(f"   [Rejected]: {message}")
+    repaired = auto_repair(state, state["sql_query"], message)
+    if repaired is not None:
+        return repaired
+    return {
+        "sql_result": message,
+        "sql_valid": False,
+        "validation_errors": validation.errors,
+        "attempt_count": state["attempt_count"] + 1
+    }
+
+
+def auto_repair(state: AgentState, sql_query: str, error: str):
+    """
+    State update for a query that rule-based rewrites made work (already executed), or
+    None when no rule applies and the LLM has to repair it.
+    """
+    repaired = rule_repair(sql_query, error)
+    if repaired is None:
+        return None
+    fixed, query_result, rules = repaired
+    record(auto_repair_rules=rules, auto_repaired=query_result is not None)
+    if query_result is None:
+        return None
+    remember_question(state, fixed)
+    return {"sql_query": fixed, "sql_result": render_result(query_result), "sql_valid": True, "validation_errors": []}
+
+
+def rule_repair(sql_query: str, error: str):
+    """(fixed SQL, its QueryResult or None, rules used) from the SQLRepairer, or None when it is off."""
+    repairer = get_resources().sql_repairer
+    if repairer is None:
+        return None
+    fixed, query_result, rules = repairer.fix(sql_query, error)
+    if query_result is None:
+        if rules:
+            print(f"   [Auto-Repair]: {', '.join(rules)} did not fix it, asking the LLM")
+    else:
+        print(f"   [Auto-Repair]: fixed by {', '.join(rules)}, LLM repair skipped")
+        print(f"DEBUG [Auto-Repair]: \n{fixed}")
+    return fixed, query_result, rules
+
+
+def remember_question(state: AgentState, query: str, extra_ms: float = 0.0, extra_llm_calls: int = 0):
+    """
+    Stores a working plan and query in the question cache. `extra_ms`/`extra_llm_calls`
+    cover work in the still-running node, which current_spans() does not include yet.
+    """
+    cache = get_resources().question_cache
+    # States built outside the graph (e.g. benchmarks/bench_executor.py) have no question
+    if cache is None or not state.get("question"):
+        return
+    # What a later hit skips: the router's LLM call, planning, generation and validation
+    skipped = [s for s in current_spans() if s["node"] in ("router", "planner", "nl2sql", "validator")]
+    cache.store(state["question"], state.get("format_hint", ""), state.get("sql_plan", ""), query,
+                cost_ms=sum(s["wall_ms"] for s in skipped) + extra_ms,
+                llm_calls=sum(len(s["llm_calls"]) for s in skipped) + extra_llm_calls)
+
+
+@traced("executor")
 def executor_node(state: AgentState):
     print("--- Node: Executor ---")
     query = state["sql_query"]
-    tool = SQLiteTool()
+    # One pooled tool per process; views and connections are set up once
+    tool = get_resources().db_tool
     
-    result = tool.query(query)
+    start = time.perf_counter()
+    query_result = tool.execute(query)
+    sql_ms = (time.perf_counter() - start) * 1000
+    # Rendering is separate from execution; only the bounded rows are turned into text
+    result = render_result(query_result)
+    record(sql_ms=sql_ms, result_bytes=len(result), result_rows=len(query_result.rows),
+           truncated=query_result.truncated, sql_cached=query_result.cached,
+           sql_vm_steps=query_result.vm_steps, sql_over_budget=query_result.over_budget,
+           sql_rollup=query_result.rollup,
+           sql_budget_ms=tool.timeout_ms, sql_budget_vm_steps=tool.max_vm_steps)
     
-    is_error = result.lower().startswith("sql error") or result.lower().startswith("error")
+    is_error = not query_result.ok
+    cache = get_resources().question_cache
+    from_cache = state.get("question_cache_id") is not None
     
     if is_error:
         print(f"   [Error]: {result}")
-        return {
+        repaired = auto_repair(state, query, result) if not from_cache else None
+        if repaired is not None:
+            return repaired
+        update = {
             "sql_result": result,
             "sql_valid": False,
             "attempt_count": state["attempt_count"] + 1
         }
+        if from_cache and cache is not None:
+            # The cached SQL no longer works here; drop it and repair as usual
+            cache.discard(state["question_cache_id"])
+            update["question_cache_id"] = None
+        return update
     else:
         print("   [Success]: Query executed.")
+        if not from_cache:
+            remember_question(state, query)
         return {
             "sql_result": result,
             "sql_valid": True,
@@ -368,9 +905,12 @@ Output: {{"final_answer": 14, "explanation": "Policy says 14 days.", "citations"
         {"role": "user", "content": "JSON:"}
     ]
     
+    if SYNTH_STREAM:
+        return query_ollama_until_json(messages, required_key="final_answer", model=MODEL, temperature=0.0)
     return query_ollama(messages, model=MODEL, temperature=0.0)
 
 
+@traced("synthesizer")
 def synthesizer_node(state: AgentState):
     print("--- Node: Synthesizer ---")
     
@@ -417,85 +957,181 @@ def synthesizer_node(state: AgentState):
             "citations": []
         }
     
-try:
-    RETRIEVER = Retriever(docs_path="docs")
-except Exception as e:
-    print(f"Warning: Retriever failed to load (check docs/ folder): {e}")
-    RETRIEVER = None
-
-
+@traced("retriever")
 def retriever_node(state: AgentState):
     print("--- Node: Retriever ---")
     question = state["question"]
-    if RETRIEVER:
-        results = RETRIEVER.search(question, top_k=3)
+    retriever = get_resources().retriever
+    if retriever:
+        results = retriever.search(question, top_k=3)
     else:
         results = []
     return {"retrieved_docs": results}
 
 
-workflow = StateGraph(AgentState)
+def join_node(state: AgentState):
+    """Fan-in point: runs once both the router and the retriever have finished."""
+    return {}
 
-# 1. Add Nodes
-workflow.add_node("router", router_node)
-workflow.add_node("retriever", retriever_node)
-workflow.add_node("planner", planner_node)
-workflow.add_node("nl2sql", nl2sql_node)
-workflow.add_node("executor", executor_node)
-workflow.add_node("synthesizer", synthesizer_node)
 
-# 2. Set Entry Point
-workflow.set_entry_point("router")
+def build_workflow(parallel_retrieval: bool = True):
+    """
+    Wires the (uncompiled) LangGraph StateGraph. `parallel_retrieval=False` runs the
+    retriever after the router instead (the original shape; see benchmarks/bench_graph_shapes.py).
+    """
+    from langgraph.graph import StateGraph, START, END
 
-# 3. Router Logic
-# Always get context first (both paths need it)
-workflow.add_edge("router", "retriever")
+    workflow = StateGraph(AgentState)
 
-# 4. Conditional Edge: Retriever -> (Planner OR Synthesizer)
-def decide_post_retrieval(state):
-    # If hybrid, we need to Plan and Generate SQL
-    if state["classification"] == "hybrid":
-        return "planner"
-    # If RAG-only, skip straight to answering
-    else:
-        return "synthesizer"
-
-workflow.add_conditional_edges(
-    "retriever",
-    decide_post_retrieval,
-    {
-        "planner": "planner",
-        "synthesizer": "synthesizer"
-    }
-)
-
-# 5. SQL Pipeline (Linear)
-workflow.add_edge("planner", "nl2sql")
-workflow.add_edge("nl2sql", "executor")
-
-# 6. Repair Loop Logic
-def check_execution_status(state):
-    if state["sql_valid"]:
-        # Success -> Go to Answer
-        return "synthesizer"
-    elif state["attempt_count"] < 2: # Limit: 2 retries (Total 3 attempts)
-        # Failure -> Retry SQL Generation
-        return "nl2sql"
+    # 1. Add Nodes
+    workflow.add_node("router", router_node)
+    workflow.add_node("retriever", retriever_node)
+    workflow.add_node("join", join_node)
+    workflow.add_node("planner", planner_node)
+    workflow.add_node("kpi", kpi_node)
+    workflow.add_node("nl2sql", nl2sql_node)
+    workflow.add_node("validator", validator_node)
+    workflow.add_node("executor", executor_node)
+    workflow.add_node("synthesizer", synthesizer_node)
+
+    # 2. Fan-out: Router and Retriever run in parallel
+    # Retrieval does not depend on the classification (both paths need the same chunks),
+    # so it overlaps with the router's LLM call instead of following it.
+    workflow.add_edge(START, "router")
+    if parallel_retrieval:
+        workflow.add_edge(START, "retriever")
+        # 3. Fan-in: wait for both branches before branching on the classification
+        workflow.add_edge(["router", "retriever"], "join")
     else:
-        # Failure + Max Retries -> Give up and Synthesize Error
-        return "synthesizer"
-
-workflow.add_conditional_edges(
-    "executor",
-    check_execution_status,
-    {
-        "synthesizer": "synthesizer",
-        "nl2sql": "nl2sql"
-    }
-)
+        workflow.add_edge("router", "retriever")
+        workflow.add_edge("retriever", "join")
+
+    # 4. Conditional Edge: Join -> (Planner OR Synthesizer, or Executor for a question cache hit)
+    def decide_post_retrieval(state):
+        if state.get("question_cache_id") is not None:
+            return "executor"
+        # If hybrid, we need to Plan and Generate SQL
+        if state["classification"] == "hybrid":
+            return "planner"
+        # If RAG-only, skip straight to answering
+        else:
+            return "synthesizer"
+
+    workflow.add_conditional_edges(
+        "join",
+        decide_post_retrieval,
+        {
+            "planner": "planner",
+            "executor": "executor",
+            "synthesizer": "synthesizer"
+        }
+    )
+
+    # 5. SQL Pipeline (Linear), with a validation gate before execution; plans for a
+    # registered KPI are evaluated directly and skip it
+    workflow.add_edge("planner", "kpi")
+    workflow.add_conditional_edges(
+        "kpi",
+        lambda state: "synthesizer" if state.get("sql_valid") else "nl2sql",
+        {
+            "synthesizer": "synthesizer",
+            "nl2sql": "nl2sql"
+        }
+    )
+
+    # 6. Repair Loop Logic
+    def check_execution_status(state):
+        if state["sql_valid"]:
+            # Success -> Go to Answer
+            return "synthesizer"
+        elif state["attempt_count"] < 2: # Limit: 2 retries (Total 3 attempts)
+            # Failure -> Retry SQL Generation
+            return "nl2sql"
+        else:
+            # Failure + Max Retries -> Give up and Synthesize Error
+            return "synthesizer"
+
+    workflow.add_conditional_edges(
+        "executor",
+        check_execution_status,
+        {
+            "synthesizer": "synthesizer",
+            "nl2sql": "nl2sql"
+        }
+    )
+
+    # A wave of parallel candidates was already validated and executed
+    def check_generation_status(state):
+        if state.get("candidates_executed"):
+            return check_execution_status(state)
+        return "validator"
+
+    workflow.add_conditional_edges(
+        "nl2sql",
+        check_generation_status,
+        {
+            "validator": "validator",
+            "synthesizer": "synthesizer",
+            "nl2sql": "nl2sql"
+        }
+    )
+
+    # Rejected queries share the same retry budget as failed executions
+    def check_validation_status(state):
+        if state.get("sql_valid"):
+            # Rejected, then fixed and executed by the auto-repair rules
+            return "synthesizer"
+        if not state.get("validation_errors"):
+            return "executor"
+        return check_execution_status(state)
+
+    workflow.add_conditional_edges(
+        "validator",
+        check_validation_status,
+        {
+            "executor": "executor",
+            "synthesizer": "synthesizer",
+            "nl2sql": "nl2sql"
+        }
+    )
+
+    # 7. Final Edge
+    workflow.add_edge("synthesizer", END)
+
+    return workflow
+
+
+_APPS = {}
+
+
+def build_app(config: Dict[str, Any] = None, checkpointer=None):
+    """
+    Returns the compiled graph for `config` (merged over DEFAULT_CONFIG) and makes its
+    Resources the active ones. Compiled apps without a checkpointer are cached per config.
+    """
+    global _RESOURCES
+    merged = {**DEFAULT_CONFIG, **(config or {})}
+    key = json.dumps(merged, sort_keys=True)
+
+    with _RESOURCES_LOCK:
+        if _RESOURCES is None or _RESOURCES.config != merged:
+            _RESOURCES = Resources(merged)
+
+    if checkpointer is not None:
+        return build_workflow().compile(checkpointer=checkpointer)
+    if key not in _APPS:
+        _APPS[key] = build_workflow().compile()
+    return _APPS[key]
 
-# 7. Final Edge
-workflow.add_edge("synthesizer", END)
 
-# 8. Compile
-app = workflow.compile()
\ No newline at end of file
+def __getattr__(name):
+    # Backwards-compatible module attributes, resolved lazily
+    if name == "app":
+        return build_app()
+    if name == "workflow":
+        return build_workflow()
+    legacy = {"lm": "lm", "compiled_sql_module": "sql_module", "db_tool": "db_tool",
+              "schema_info": "schema_info", "RETRIEVER": "retriever"}
+    if name in legacy:
+        return getattr(get_resources(), legacy[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
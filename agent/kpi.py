@@ -0,0 +1,463 @@
+"""
+KPI registry and evaluator.
+
+The registry is read from docs/kpi_definitions.md: each "## Name (ABBR)" section with a
+"- ABBR = <formula>" bullet becomes one KPI. Formulas are evaluated with NumPy over one
+array per order-line column (order id, day, price, quantity, discount, product, category,
+customer, cost), extracted from the DB once per DB version into .npy files and
+memory-mapped by every process that uses them.
+
+CostOfGoods comes from a cost column on Products when the DB has one. Products without a
+cost get their category's average cost. Without any costs (stock Northwind), a product's
+cost is KPI_COST_RATIO (default 0.7) x the average list price of its category, so every
+product in a category carries the same estimated cost.
+
+    python -m agent.kpi --kpi AOV --start 2017-12-01 --end 2017-12-31 [--category Beverages] [--top 3 --by customer]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from typing import List, Dict, Optional, Tuple, Union
+from urllib.request import pathname2url
+
+import numpy as np
+
+from agent.snapshot import file_fingerprint
+
+KPI_DOC_PATH = "docs/kpi_definitions.md"
+ARRAY_DIR = os.environ.get("KPI_ARRAY_DIR", ".cache/kpi_arrays")
+COST_RATIO = float(os.environ.get("KPI_COST_RATIO", "0.7"))
+# Products columns that hold a unit cost, in order of preference
+COST_COLUMNS = ["CostOfGoods", "UnitCost", "StandardCost"]
+
+# Line-level columns a formula may use -> array name
+COLUMNS = {"unitprice": "unit_price", "quantity": "quantity", "discount": "discount",
+           "orderid": "order_id", "costofgoods": "cost"}
+AGGREGATES = {"sum", "avg", "count", "min", "max"}
+ENTITIES = ["category", "product", "customer"]
+# Column header for a grouped result, as the equivalent SQL would name it
+ENTITY_COLUMNS = {"category": "CategoryName", "product": "ProductName", "customer": "CompanyName"}
+
+HEADING = re.compile(r"^##\s+(.+?)\s*(?:\(([^)]+)\))?\s*$")
+DEFINITION = re.compile(r"^[-*]\s*([A-Za-z][\w ]*?)\s*=\s*(.+)$")
+TOKEN = re.compile(r"[A-Za-z_]\w*|\d+(?:\.\d+)?|\S")
+# A cost assumption stated in the question: "CostOfGoods is approximated by 70% of UnitPrice"
+STATED_COST = re.compile(r"(\d+(?:\.\d+)?)\s*%\s*of\s+(?:the\s+)?(?:unit\s*price|list\s+price|price)\b", re.IGNORECASE)
+
+LINES_SQL = """
+SELECT od.OrderID, substr(o.OrderDate, 1, 10), od.UnitPrice, od.Quantity, od.Discount,
+       p.ProductName, c.CategoryName, cu.CompanyName, od.ProductID
+FROM "Order Details" od
+JOIN Orders o ON o.OrderID = od.OrderID
+LEFT JOIN Products p ON p.ProductID = od.ProductID
+LEFT JOIN Categories c ON c.CategoryID = p.CategoryID
+LEFT JOIN Customers cu ON cu.CustomerID = o.CustomerID
+ORDER BY od.OrderID
+"""
+
+
+class KPI:
+    """One registered KPI: its name, the names it can be asked for by, and its parsed formula."""
+
+    def __init__(self, name: str, aliases: List[str], formula: str, notes: List[str]):
+        self.name = name
+        self.aliases = aliases
+        self.formula = formula
+        self.notes = notes
+        self.tree = _Parser(formula).parse()
+
+    @property
+    def uses_cost(self) -> bool:
+        return "costofgoods" in self.formula.lower()
+
+
+class _Parser:
+    """Recursive-descent parser for KPI formulas: + - * / over aggregates of line columns."""
+
+    def __init__(self, formula: str):
+        self.formula = formula
+        self.tokens = TOKEN.findall(formula)
+        self.i = 0
+
+    def _peek(self) -> str:
+        return self.tokens[self.i].lower() if self.i < len(self.tokens) else ""
+
+    def _take(self, expected: Optional[str] = None) -> str:
+        token = self._peek()
+        if expected is not None and token != expected:
+            raise ValueError(f"expected {expected!r} at {token or 'end'!r} in {self.formula!r}")
+        self.i += 1
+        return token
+
+    def parse(self):
+        tree, level = self._expression(aggregated=False)
+        if self.i != len(self.tokens):
+            raise ValueError(f"unexpected {self._peek()!r} in {self.formula!r}")
+        if level == "line":
+            raise ValueError(f"formula has no aggregate: {self.formula!r}")
+        return tree
+
+    # Each method returns (node, level); level is "line" (per order line), "agg" or "const"
+    def _expression(self, aggregated: bool):
+        node, level = self._term(aggregated)
+        while self._peek() in ("+", "-"):
+            op = self._take()
+            right, right_level = self._term(aggregated)
+            node, level = (op, node, right), self._combine(level, right_level)
+        return node, level
+
+    def _term(self, aggregated: bool):
+        node, level = self._factor(aggregated)
+        while self._peek() in ("*", "/"):
+            op = self._take()
+            right, right_level = self._factor(aggregated)
+            node, level = (op, node, right), self._combine(level, right_level)
+        return node, level
+
+    def _combine(self, left: str, right: str) -> str:
+        if {left, right} == {"line", "agg"}:
+            raise ValueError(f"column outside an aggregate in {self.formula!r}")
+        return "const" if left == right == "const" else (left if left != "const" else right)
+
+    def _factor(self, aggregated: bool):
+        token = self._take()
+        if token == "-":
+            node, level = self._factor(aggregated)
+            return ("neg", node), level
+        if token == "(":
+            node, level = self._expression(aggregated)
+            self._take(")")
+            return node, level
+        if re.match(r"^\d", token):
+            return ("const", float(token)), "const"
+        if token in AGGREGATES and self._peek() == "(":
+            if aggregated:
+                raise ValueError(f"nested aggregate in {self.formula!r}")
+            self._take("(")
+            distinct = self._peek() == "distinct"
+            if distinct:
+                self._take()
+            argument, _ = self._expression(aggregated=True)
+            self._take(")")
+            if distinct and token != "count":
+                raise ValueError(f"DISTINCT is only supported in COUNT: {self.formula!r}")
+            return ("agg", token, distinct, argument), "agg"
+        if token == "coalesce" and self._peek() == "(":
+            self._take("(")
+            value, level = self._expression(aggregated)
+            self._take(",")
+            default, _ = self._expression(aggregated)
+            self._take(")")
+            return ("coalesce", value, default), level
+        if token in COLUMNS:
+            return ("column", COLUMNS[token]), "line"
+        raise ValueError(f"unknown name {token!r} in {self.formula!r}")
+
+
+def load_registry(path: str = KPI_DOC_PATH) -> Dict[str, KPI]:
+    """Lowercased name/alias -> KPI, from the markdown KPI definitions."""
+    registry = {}
+    name, abbreviation, formula, notes = None, None, None, []
+
+    def flush():
+        if name and formula:
+            aliases = [a for a in (name, abbreviation, formula[0]) if a]
+            kpi = KPI(name, list(dict.fromkeys(aliases)), formula[1], notes)
+            for alias in kpi.aliases:
+                registry[alias.lower()] = kpi
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            heading = HEADING.match(line)
+            if heading:
+                flush()
+                name, abbreviation, formula, notes = heading.group(1), heading.group(2), None, []
+                continue
+            definition = DEFINITION.match(line)
+            if name and definition and formula is None and "(" in definition.group(2):
+                formula = (definition.group(1), definition.group(2).strip())
+            elif name and line and line[0] in "-*":
+                notes.append(line.lstrip("-* "))
+            elif name and line and notes:
+                # Wrapped continuation of the previous bullet
+                notes[-1] += " " + line
+    flush()
+    return registry
+
+
+def stated_cost_ratio(text: str) -> Optional[float]:
+    """0.7 for "... 70% of UnitPrice ..." in `text`, else None."""
+    match = STATED_COST.search(text)
+    return float(match.group(1)) / 100 if match else None
+
+
+def _array_dir(db_path: str, base_dir: str) -> str:
+    key = f"{os.path.abspath(db_path)}:{file_fingerprint(db_path)}:{COST_RATIO}"
+    return os.path.join(base_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+
+def _product_costs(conn: sqlite3.Connection) -> Dict[int, float]:
+    """ProductID -> unit cost: own cost, else category average cost, else COST_RATIO x category average price."""
+    columns = {row[1].lower(): row[1] for row in conn.execute("PRAGMA table_info(Products)")}
+    cost_column = next((columns[c.lower()] for c in COST_COLUMNS if c.lower() in columns), None)
+    rows = conn.execute(
+        f'SELECT ProductID, CategoryID, UnitPrice, {f"{cost_column}" if cost_column else "NULL"} FROM Products'
+    ).fetchall()
+
+    by_category_cost, by_category_price = {}, {}
+    for _, category, price, cost in rows:
+        if cost is not None:
+            by_category_cost.setdefault(category, []).append(cost)
+        if price is not None:
+            by_category_price.setdefault(category, []).append(price)
+    all_prices = [p for _, _, p, _ in rows if p is not None]
+
+    costs = {}
+    for product, category, _, cost in rows:
+        if cost is not None:
+            costs[product] = float(cost)
+        elif by_category_cost.get(category):
+            costs[product] = float(np.mean(by_category_cost[category]))
+        elif by_category_price.get(category):
+            costs[product] = COST_RATIO * float(np.mean(by_category_price[category]))
+        elif all_prices:
+            costs[product] = COST_RATIO * float(np.mean(all_prices))
+    return costs
+
+
+def build_arrays(db_path: str, base_dir: str = ARRAY_DIR) -> str:
+    """Extracts the order-line arrays of `db_path` into a directory of .npy files (atomically). Returns it."""
+    target = _array_dir(db_path, base_dir)
+    if os.path.exists(os.path.join(target, "names.json")):
+        return target
+
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(LINES_SQL).fetchall()
+        costs = _product_costs(conn)
+    finally:
+        conn.close()
+
+    names = {entity: {} for entity in ENTITIES}
+
+    def index(entity, value):
+        if value is None:
+            return -1
+        return names[entity].setdefault(value, len(names[entity]))
+
+    n = len(rows)
+    arrays = {
+        "order_id": np.fromiter((r[0] for r in rows), dtype=np.int64, count=n),
+        # Days since 1970-01-01; missing or malformed dates never fall inside a range
+        "day": np.array([r[1] if r[1] and len(r[1]) == 10 else "NaT" for r in rows],
+                        dtype="datetime64[D]").astype(np.int64),
+        "unit_price": np.array([r[2] for r in rows], dtype=np.float64),
+        "quantity": np.array([r[3] for r in rows], dtype=np.float64),
+        "discount": np.array([r[4] for r in rows], dtype=np.float64),
+        "product": np.fromiter((index("product", r[5]) for r in rows), dtype=np.int32, count=n),
+        "category": np.fromiter((index("category", r[6]) for r in rows), dtype=np.int32, count=n),
+        "customer": np.fromiter((index("customer", r[7]) for r in rows), dtype=np.int32, count=n),
+        "cost": np.array([costs.get(r[8], np.nan) for r in rows], dtype=np.float64),
+    }
+
+    tmp_dir = f"{target}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, "names.json"), "w", encoding="utf-8") as f:
+        json.dump({entity: list(values) for entity, values in names.items()}, f)
+    try:
+        os.rename(tmp_dir, target)
+    except OSError:
+        # Another process built the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return target
+
+
+def _day(date: str) -> int:
+    return int(np.datetime64(date[:10], "D").astype(np.int64))
+
+
+class KPIEngine:
+    """
+    Evaluates registered KPIs over the memory-mapped order-line arrays of one DB.
+
+    evaluate() takes an inclusive date range, optional category/product/customer filters
+    (lists of names) and an optional grouping entity with top-N; it returns a float (or
+    None when undefined, e.g. no orders) or a list of (name, value) pairs.
+    """
+
+    def __init__(self, db_path: str, registry: Optional[Dict[str, KPI]] = None,
+                 kpi_path: str = KPI_DOC_PATH, base_dir: str = ARRAY_DIR):
+        self.registry = registry if registry is not None else load_registry(kpi_path)
+        self.path = build_arrays(db_path, base_dir)
+        self.arrays = {name[:-4]: np.load(os.path.join(self.path, name), mmap_mode="r")
+                       for name in os.listdir(self.path) if name.endswith(".npy")}
+        with open(os.path.join(self.path, "names.json"), "r", encoding="utf-8") as f:
+            self.names = json.load(f)
+        self._ids = {entity: {v.lower(): i for i, v in enumerate(values)} for entity, values in self.names.items()}
+        self._lock = threading.Lock()
+        self.stats = {"evaluations": 0}
+
+    def find(self, text: str) -> List[KPI]:
+        """Registered KPIs named in `text` (by name or alias, whole words)."""
+        found = []
+        for alias, kpi in self.registry.items():
+            if kpi not in found and re.search(rf"\b{re.escape(alias)}\b", text, re.IGNORECASE):
+                found.append(kpi)
+        return found
+
+    def unknown_values(self, filters: Dict[str, List[str]]) -> List[str]:
+        """Filter values that name no category/product/customer in the DB."""
+        return [v for entity, values in filters.items() for v in values
+                if entity not in self._ids or v.lower() not in self._ids[entity]]
+
+    def _mask(self, start: Optional[str], end: Optional[str], filters: Dict[str, List[str]]) -> np.ndarray:
+        mask = np.ones(len(self.arrays["order_id"]), dtype=bool)
+        if start:
+            mask &= self.arrays["day"] >= _day(start)
+        if end:
+            mask &= self.arrays["day"] <= _day(end)
+        for entity, values in (filters or {}).items():
+            ids = [self._ids[entity].get(v.lower(), -2) for v in values]
+            mask &= np.isin(self.arrays[entity], ids)
+        return mask
+
+    def evaluate(self, kpi: Union[str, KPI], start: Optional[str] = None, end: Optional[str] = None,
+                 filters: Optional[Dict[str, List[str]]] = None, group_by: Optional[str] = None,
+                 top_n: Optional[int] = None, descending: bool = True,
+                 cost_ratio_of_price: Optional[float] = None) -> Union[Optional[float], List[Tuple[str, float]]]:
+        """
+        `cost_ratio_of_price` overrides the CostOfGoods fallback with ratio x the line's
+        own UnitPrice (for questions that state their own cost assumption).
+        """
+        if isinstance(kpi, str):
+            kpi = self.registry[kpi.lower()]
+        mask = self._mask(start, end, filters)
+        if group_by:
+            mask &= self.arrays[group_by] >= 0
+
+        columns = {}
+
+        def column(name):
+            if name not in columns:
+                if name == "cost" and cost_ratio_of_price is not None:
+                    columns[name] = cost_ratio_of_price * np.asarray(self.arrays["unit_price"][mask])
+                else:
+                    columns[name] = np.asarray(self.arrays[name][mask])
+            return columns[name]
+
+        groups = None
+        if group_by:
+            group_ids = np.asarray(self.arrays[group_by][mask])
+            groups = (group_ids, len(self.names[group_by]))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = _evaluate(kpi.tree, column, groups, int(mask.sum()))
+        with self._lock:
+            self.stats["evaluations"] += 1
+
+        if groups is None:
+            value = float(value)
+            return None if np.isnan(value) else value
+        present = np.bincount(groups[0], minlength=groups[1]) > 0
+        order = [i for i in np.argsort(-value if descending else value, kind="stable")
+                 if present[i] and not np.isnan(value[i])]
+        ranked = [(self.names[group_by][i], float(value[i])) for i in order]
+        return ranked[:top_n] if top_n else ranked
+
+    def summary(self) -> str:
+        kpis = sorted({kpi.name for kpi in self.registry.values()})
+        return (f"{self.stats['evaluations']} evaluations; {len(kpis)} KPIs ({', '.join(kpis)}) over "
+                f"{len(self.arrays['order_id'])} order lines")
+
+    def describe(self, kpi: KPI, cost_ratio_of_price: Optional[float] = None) -> str:
+        """One line on how `kpi` is computed, for the output's sql field and the logs."""
+        text = f"{kpi.name}: {kpi.formula}"
+        if kpi.uses_cost:
+            if cost_ratio_of_price is not None:
+                text += f"; CostOfGoods = {cost_ratio_of_price:g} x UnitPrice (as stated in the question)"
+            else:
+                text += f"; CostOfGoods = product cost, else category average ({COST_RATIO:g} x category average list price without costs)"
+        return text
+
+
+def _evaluate(node, column, groups, length: int):
+    """
+    Evaluates a parsed formula over `length` selected lines; line-level nodes give
+    arrays, aggregates give scalars or per-group arrays.
+    """
+    kind = node[0]
+    if kind == "const":
+        return node[1]
+    if kind == "column":
+        return column(node[1])
+    if kind == "neg":
+        return -_evaluate(node[1], column, groups, length)
+    if kind == "coalesce":
+        value = _evaluate(node[1], column, groups, length)
+        default = _evaluate(node[2], column, groups, length)
+        return np.where(np.isnan(value), default, value)
+    if kind == "agg":
+        return _aggregate(node[1], node[2], _evaluate(node[3], column, groups, length), groups, length)
+    left, right = _evaluate(node[1], column, groups, length), _evaluate(node[2], column, groups, length)
+    return {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.true_divide}[kind](left, right)
+
+
+def _aggregate(function: str, distinct: bool, values, groups, length: int):
+    """SQL aggregate semantics: NULLs (NaN) are skipped; an aggregate over no values is NULL (COUNT: 0)."""
+    values = np.broadcast_to(np.asarray(values, dtype=np.float64), (length,))
+    valid = ~np.isnan(values)
+    if groups is None:
+        kept = values[valid]
+        if function == "count":
+            return float(len(np.unique(kept)) if distinct else len(kept))
+        if not len(kept):
+            return np.nan
+        return float({"sum": np.sum, "avg": np.mean, "min": np.min, "max": np.max}[function](kept))
+
+    group_ids, size = groups
+    ids, kept = group_ids[valid], values[valid]
+    if function == "count":
+        if distinct:
+            # One (group, value) pair per distinct value within each group
+            codes = np.unique(kept, return_inverse=True)[1].ravel()
+            pairs = np.unique(ids.astype(np.int64) * (codes.max(initial=0) + 1) + codes)
+            return np.bincount(pairs // (codes.max(initial=0) + 1), minlength=size).astype(np.float64)
+        return np.bincount(ids, minlength=size).astype(np.float64)
+    counts = np.bincount(ids, minlength=size)
+    if function in ("sum", "avg"):
+        totals = np.bincount(ids, weights=kept, minlength=size)
+        result = totals / counts if function == "avg" else totals
+    else:
+        result = np.full(size, np.inf if function == "min" else -np.inf)
+        (np.minimum if function == "min" else np.maximum).at(result, ids, kept)
+    return np.where(counts > 0, result, np.nan)
+
+
+if __name__ == "__main__":
+    from agent.tools.analytics_db import resolve_db_path
+    from agent.tools.sqlite_tool import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Evaluate a KPI from docs/kpi_definitions.md without SQL or the LLM")
+    parser.add_argument("--kpi", required=True, help="KPI name or abbreviation, e.g. AOV")
+    parser.add_argument("--db", default=None)
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    for entity in ENTITIES:
+        parser.add_argument(f"--{entity}", action="append", help=f"Only these {entity} names (repeatable)")
+    parser.add_argument("--by", choices=ENTITIES, help="Group by this entity")
+    parser.add_argument("--top", type=int)
+    args = parser.parse_args()
+
+    engine = KPIEngine(args.db or resolve_db_path(DB_PATH))
+    kpi = engine.registry[args.kpi.lower()]
+    filters = {e: getattr(args, e) for e in ENTITIES if getattr(args, e)}
+    print(engine.describe(kpi))
+    print(engine.evaluate(kpi, args.start, args.end, filters, group_by=args.by, top_n=args.top))
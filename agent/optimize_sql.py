@@ -8,14 +8,13 @@ import json
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from agent.tools.sqlite_tool import SQLiteTool
+from agent.tools.dspy_lm import OllamaLM
 from agent.dspy_signatures import GenerateSQL
 from dspy_dataset import train_data
 
 # --- 1. CONFIGURATION ---
-lm = dspy.LM(
-    model="ollama/phi3.5:3.8b-mini-instruct-q4_K_M", 
-    api_base="http://localhost:11434", 
-    api_key="",
+lm = OllamaLM(
+    model="phi3.5:3.8b-mini-instruct-q4_K_M",
     temperature=0.0,
     num_ctx=4096  # Increased context for more examples
 )
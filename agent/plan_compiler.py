@@ -0,0 +1,350 @@
+import calendar
+import datetime
+import os
+import re
+import sqlite3
+import threading
+from typing import List, Dict, Optional, Tuple
+from urllib.request import pathname2url
+
+PLAN_KEY = re.compile(r"\b(TIME_SCOPE|START_DATE|END_DATE|RANKING_INTENT|METRIC_FORMULA|FILTERS)\s*:\s*")
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# TIME_SCOPE shorthands used in agent/dspy_dataset.py: 2017, 2017-06, 2017-Q1, 2017-06-01, 2017-06 to 2017-08
+SCOPE_PART = re.compile(r"^(\d{4})(?:-(\d{2})(?:-(\d{2}))?|-Q([1-4]))?$", re.IGNORECASE)
+RANKING = re.compile(r"^(top|bottom)\s*(\d+)?\s+([a-z]+)$", re.IGNORECASE)
+FILTER_KEY = re.compile(r"\b(categor(?:y|ies)|products?|customers?)\s*(?:=|\bin\b)\s*", re.IGNORECASE)
+QUOTED = re.compile(r"'((?:[^']|'')*)'|\"([^\"]*)\"")
+FORMULA_TOKEN = re.compile(r"[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?|\d+(?:\.\d+)?|\S")
+
+ENTITIES = {
+    "customer": "customer", "customers": "customer",
+    "product": "product", "products": "product",
+    "category": "category", "categories": "category",
+}
+# Entity -> (column shown and grouped on, table that has it)
+ENTITY_COLUMNS = {"customer": ("cust.CompanyName", "cust"), "product": ("p.ProductName", "p"),
+                  "category": ("c.CategoryName", "c")}
+JOINS = {
+    "cust": "JOIN customers cust ON o.CustomerID = cust.CustomerID",
+    "p": "JOIN products p ON oi.ProductID = p.ProductID",
+    "c": "JOIN categories c ON p.CategoryID = c.CategoryID",
+}
+# Metric columns the formula may use, by the alias of the table they live in
+COLUMNS = {"unitprice": ("oi", "UnitPrice"), "quantity": ("oi", "Quantity"), "discount": ("oi", "Discount"),
+           "orderid": ("o", "OrderID"), "freight": ("o", "Freight")}
+AGGREGATES = {"sum", "avg", "count", "min", "max"}
+FUNCTIONS = AGGREGATES | {"coalesce", "round", "abs", "nullif"}
+OPERATORS = {"+", "-", "*", "/"}
+# Values that can be checked against the DB: entity -> (table, column)
+VALUE_COLUMNS = {"category": ("Categories", "CategoryName"), "product": ("Products", "ProductName"),
+                 "customer": ("Customers", "CompanyName")}
+
+
+class _Unsupported(ValueError):
+    """The plan is outside the shapes the compiler handles; the caller falls back to the LLM."""
+
+
+class Plan:
+    """
+    Typed form of the planner's contract. `start_date`/`end_date` are inclusive ISO dates
+    (both None for all time), `top_n`/`rank_entity`/`descending` describe a ranking (or
+    are None), `filters` maps entity -> allowed values ({} for none) and `metric` is the
+    raw METRIC_FORMULA text.
+    """
+
+    def __init__(self, start_date: Optional[str], end_date: Optional[str], top_n: Optional[int],
+                 rank_entity: Optional[str], descending: bool, filters: Dict[str, List[str]], metric: str):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.top_n = top_n
+        self.rank_entity = rank_entity
+        self.descending = descending
+        self.filters = filters
+        self.metric = metric
+
+
+def _plan_fields(text: str) -> Dict[str, str]:
+    """KEY -> value for both the one-key-per-line contract and the 'KEY: v, KEY: v' form."""
+    matches = list(PLAN_KEY.finditer(text))
+    fields = {}
+    for match, following in zip(matches, matches[1:] + [None]):
+        value = text[match.end():following.start() if following else len(text)]
+        value = value.split("\n")[0].strip().rstrip(",").strip()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'`":
+            value = value[1:-1].strip()
+        fields.setdefault(match.group(1), value)
+    return fields
+
+
+def _is_none(value: Optional[str]) -> bool:
+    return value is None or value.strip().lower() in ("", "none", "null", "n/a")
+
+
+def _scope_bounds(part: str) -> Tuple[str, str]:
+    match = SCOPE_PART.match(part.strip())
+    if not match:
+        raise _Unsupported(f"time scope {part!r}")
+    year, month, day, quarter = match.groups()
+    y = int(year)
+    if day:
+        return f"{year}-{month}-{day}", f"{year}-{month}-{day}"
+    if month:
+        m = int(month)
+        return f"{year}-{m:02d}-01", f"{year}-{m:02d}-{calendar.monthrange(y, m)[1]:02d}"
+    if quarter:
+        first, last = 3 * int(quarter) - 2, 3 * int(quarter)
+        return f"{year}-{first:02d}-01", f"{year}-{last:02d}-{calendar.monthrange(y, last)[1]:02d}"
+    return f"{year}-01-01", f"{year}-12-31"
+
+
+def _real_dates(start: str, end: str) -> Tuple[str, str]:
+    for value in (start, end):
+        try:
+            datetime.date.fromisoformat(value)
+        except ValueError:
+            raise _Unsupported(f"no such date {value!r}")
+    return start, end
+
+
+def _dates(fields: Dict[str, str]) -> Tuple[Optional[str], Optional[str]]:
+    scope = fields.get("TIME_SCOPE", "").strip()
+    if scope.upper().replace(" ", "_") == "ALL_TIME":
+        return None, None
+    start, end = fields.get("START_DATE"), fields.get("END_DATE")
+    if not _is_none(start) or not _is_none(end):
+        if _is_none(start) or _is_none(end) or not ISO_DATE.match(start) or not ISO_DATE.match(end):
+            raise _Unsupported("open or malformed date range")
+        return _real_dates(start, end)
+    if _is_none(scope) or scope.upper() == "RANGE":
+        raise _Unsupported("no dates")
+    parts = re.split(r"\s+to\s+", scope, flags=re.IGNORECASE)
+    if len(parts) > 2:
+        raise _Unsupported(f"time scope {scope!r}")
+    return _real_dates(_scope_bounds(parts[0])[0], _scope_bounds(parts[-1])[1])
+
+
+def _filters(value: Optional[str]) -> Dict[str, List[str]]:
+    if value is None:
+        # Older plans have no FILTERS line; without it a category or product filter could be missed
+        raise _Unsupported("no FILTERS in plan")
+    if _is_none(value):
+        return {}
+    filters = {}
+    matches = list(FILTER_KEY.finditer(value))
+    covered = 0
+    for match, following in zip(matches, matches[1:] + [None]):
+        if value[covered:match.start()].strip(" ,;").lower() not in ("", "and"):
+            raise _Unsupported(f"filter {value!r}")
+        part = value[match.end():following.start() if following else len(value)]
+        covered = following.start() if following else len(value)
+        values = [(a.replace("''", "'") if a else b).strip() for a, b in QUOTED.findall(part)]
+        if not values:
+            raise _Unsupported(f"filter {value!r}")
+        key = match.group(1).lower()
+        if key.endswith(("ies", "s")) and len(values) == 1:
+            # Categories = 'Beverages, Condiments'
+            values = [v.strip() for v in values[0].split(",")]
+        filters.setdefault(ENTITIES[key], []).extend(v for v in values if v)
+    if not matches or value[covered:].strip():
+        raise _Unsupported(f"filter {value!r}")
+    return filters
+
+
+def parse_plan(text: str, require_metric: bool = True) -> Plan:
+    """
+    Parses planner output into a Plan; raises _Unsupported (a ValueError) for anything it
+    cannot represent. With require_metric=False a missing METRIC_FORMULA is allowed, for
+    callers that take the metric from elsewhere (the KPI registry).
+    """
+    fields = _plan_fields(text)
+    if require_metric and ("METRIC_FORMULA" not in fields or _is_none(fields["METRIC_FORMULA"])):
+        raise _Unsupported("no metric formula")
+    start, end = _dates(fields)
+
+    top_n, entity, descending = None, None, True
+    intent = fields.get("RANKING_INTENT")
+    if not _is_none(intent):
+        match = RANKING.match(intent.strip())
+        if not match:
+            raise _Unsupported(f"ranking {intent!r}")
+        if match.group(3).lower() not in ENTITIES:
+            raise _Unsupported(f"ranking by {match.group(3).lower()}")
+        top_n = int(match.group(2) or 1)
+        entity = ENTITIES[match.group(3).lower()]
+        descending = match.group(1).lower() == "top"
+
+    return Plan(start, end, top_n, entity, descending, _filters(fields.get("FILTERS")), fields.get("METRIC_FORMULA"))
+
+
+def compile_metric(formula: str) -> Tuple[str, set, bool]:
+    """
+    Qualifies a METRIC_FORMULA (aggregates over order line / order columns) for the
+    standard joins. Returns (SQL expression, table aliases used, whether an order-level
+    column is aggregated other than by COUNT(DISTINCT ...)).
+    """
+    tokens = FORMULA_TOKEN.findall(formula.strip().rstrip(";"))
+    parts, aliases = [], set()
+    opens = []               # per open paren: the function it belongs to, if any
+    order_level = False
+    aggregates = 0
+    for i, token in enumerate(tokens):
+        lower = token.lower()
+        following = tokens[i + 1] if i + 1 < len(tokens) else ""
+        if lower in FUNCTIONS and following == "(":
+            parts.append(token.upper())
+            aggregates += lower in AGGREGATES
+        elif token == "(":
+            opens.append(parts[-1].lower() if parts and parts[-1].lower() in FUNCTIONS else None)
+            parts.append("(")
+        elif token == ")":
+            if not opens:
+                raise _Unsupported("unbalanced parentheses in metric")
+            opens.pop()
+            parts.append(")")
+        elif lower == "distinct" and opens and opens[-1] == "count":
+            parts.append("DISTINCT")
+        elif lower.split(".")[-1] in COLUMNS:
+            enclosing = [f for f in opens if f in AGGREGATES]
+            if not enclosing:
+                raise _Unsupported(f"{token} outside an aggregate")
+            alias, column = COLUMNS[lower.split(".")[-1]]
+            distinct_count = opens[-1] == "count" and parts[-1] == "DISTINCT"
+            if alias == "o" and not distinct_count:
+                order_level = True
+            aliases.add(alias)
+            parts.append(f"{alias}.{column}")
+        elif token == "*" and opens and opens[-1] == "count" and parts[-1] == "(":
+            parts.append("*")
+        elif re.match(r"^\d", token) or token in OPERATORS or token == ",":
+            parts.append(token)
+        else:
+            raise _Unsupported(f"metric token {token!r}")
+    if opens:
+        raise _Unsupported("unbalanced parentheses in metric")
+    if not aggregates:
+        raise _Unsupported("metric without an aggregate")
+
+    text = ""
+    for part in parts:
+        if part in (")", ","):
+            text = text.rstrip() + part + (" " if part == "," else "")
+        elif part in OPERATORS:
+            text = text.rstrip() + f" {part} "
+        elif part == "(":
+            text += "("
+        else:
+            text += (" " if text and (text[-1].isalnum() or text[-1] in "_)") else "") + part
+    return text.strip(), aliases, order_level
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def build_sql(plan: Plan) -> str:
+    """SQL for a parsed plan, in the join/alias style of agent/dspy_dataset.py."""
+    metric, aliases, order_level = compile_metric(plan.metric)
+    needed = set(aliases) | {"o"}
+    if plan.rank_entity:
+        needed.add(ENTITY_COLUMNS[plan.rank_entity][1])
+    for entity in plan.filters:
+        needed.add(ENTITY_COLUMNS[entity][1])
+    if "c" in needed:
+        needed.add("p")
+    if "p" in needed:
+        needed.add("oi")
+    if "oi" in needed and order_level:
+        # SUM(o.Freight) over order lines would count each order once per line
+        raise _Unsupported("order-level metric over order lines")
+
+    sql = ["FROM order_items oi JOIN orders o ON oi.OrderID = o.OrderID" if "oi" in needed else "FROM orders o"]
+    sql.extend(JOINS[alias] for alias in ("cust", "p", "c") if alias in needed)
+
+    conditions = []
+    if plan.start_date:
+        # OrderDate has a time of day, so the inclusive end day is bounded by the next day
+        after_end = (datetime.date.fromisoformat(plan.end_date) + datetime.timedelta(days=1)).isoformat()
+        conditions.append(f"o.OrderDate >= '{plan.start_date}' AND o.OrderDate < '{after_end}'")
+    for entity, values in plan.filters.items():
+        column = ENTITY_COLUMNS[entity][0]
+        if len(values) == 1:
+            conditions.append(f"{column} = {_literal(values[0])}")
+        else:
+            conditions.append(f"{column} IN ({', '.join(_literal(v) for v in values)})")
+    if conditions:
+        sql.append("WHERE " + " AND ".join(conditions))
+
+    if plan.rank_entity:
+        column = ENTITY_COLUMNS[plan.rank_entity][0]
+        sql.append(f"GROUP BY {column} ORDER BY Val {'DESC' if plan.descending else 'ASC'} LIMIT {plan.top_n}")
+        return f"SELECT {column}, {metric} as Val " + " ".join(sql)
+    return f"SELECT {metric} " + " ".join(sql)
+
+
+def load_known_values(db_path: str) -> Dict[str, Dict[str, str]]:
+    """entity -> {lowercased value: value} from the DB (read-only); entities whose table is missing are left out."""
+    known = {}
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
+    try:
+        for entity, (table, column) in VALUE_COLUMNS.items():
+            try:
+                known[entity] = {v.lower(): v for (v,) in conn.execute(f'SELECT DISTINCT "{column}" FROM "{table}"') if v}
+            except sqlite3.OperationalError:
+                continue
+    finally:
+        conn.close()
+    return known
+
+
+class PlanCompiler:
+    """
+    Deterministic plan -> SQL for the common shapes (global totals, top-N by customer,
+    product or category, category/product/customer-filtered aggregates). Anything else
+    returns None so the caller asks the LLM. With `known_values`, filter values must name
+    an existing category/product/customer (matched case-insensitively).
+    """
+
+    def __init__(self, known_values: Optional[Dict[str, Dict[str, str]]] = None):
+        self.known_values = known_values
+        self._lock = threading.Lock()
+        self.stats = {"plans": 0, "compiled": 0, "fallbacks": 0, "reasons": {}}
+
+    def _check_values(self, plan: Plan):
+        if self.known_values is None:
+            return
+        for entity, values in plan.filters.items():
+            known = self.known_values.get(entity)
+            if known is None:
+                continue
+            for i, value in enumerate(values):
+                if value.lower() not in known:
+                    raise _Unsupported(f"unknown {entity} {value!r}")
+                values[i] = known[value.lower()]
+
+    def compile(self, plan_text: str) -> Tuple[Optional[str], str]:
+        """Returns (sql, "") or (None, reason the plan needs the LLM)."""
+        try:
+            plan = parse_plan(plan_text)
+            self._check_values(plan)
+            sql, reason = build_sql(plan), ""
+        except _Unsupported as e:
+            sql, reason = None, str(e)
+        with self._lock:
+            self.stats["plans"] += 1
+            if sql:
+                self.stats["compiled"] += 1
+            else:
+                self.stats["fallbacks"] += 1
+                # Group reasons by kind ("unknown category", "ranking by supplier", ...)
+                kind = reason.split(" '")[0].split(' "')[0]
+                self.stats["reasons"][kind] = self.stats["reasons"].get(kind, 0) + 1
+        return sql, reason
+
+    def hit_rate(self) -> float:
+        return self.stats["compiled"] / self.stats["plans"] if self.stats["plans"] else 0.0
+
+    def summary(self) -> str:
+        s = self.stats
+        reasons = ", ".join(f"{k}={v}" for k, v in sorted(s["reasons"].items(), key=lambda kv: -kv[1])) or "none"
+        return (f"{s['compiled']}/{s['plans']} plans compiled ({self.hit_rate():.0%} nl2sql LLM calls skipped); "
+                f"fallbacks: {reasons}")
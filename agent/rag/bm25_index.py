@@ -0,0 +1,211 @@
+"""
+BM25 index persisted on disk, so a new process memory-maps it instead of re-reading,
+re-tokenizing and re-indexing the docs.
+
+Layout of one index version, <index_dir>/<docs hash>/:
+    meta.json       chunk metadata, vocabulary, per-file content hashes and chunk ranges, avgdl
+    idf.npy         idf per term (BM25Okapi's, epsilon floor included)
+    doc_len.npy     tokens per chunk
+    post_ptr.npy    CSR over terms: postings of term t are post_doc/post_tf[post_ptr[t]:post_ptr[t + 1]]
+    post_doc.npy, post_tf.npy
+    doc_ptr.npy     CSR over chunks (term ids and counts per chunk), used to rebuild without re-tokenizing
+    doc_terms.npy, doc_tfs.npy
+
+<index_dir>/CURRENT names the latest version. When the docs change, files whose content
+hash is unchanged keep their chunks and term counts from the previous version; only the
+changed files are read and tokenized, then the global arrays (idf, postings) are recomputed.
+Scores match rank_bm25.BM25Okapi over the same chunks (up to floating-point rounding).
+"""
+import glob
+import hashlib
+import json
+import math
+import os
+import shutil
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+INDEX_DIR = os.environ.get("BM25_INDEX_DIR", ".cache/bm25_index")
+FORMAT_VERSION = 1
+# BM25Okapi defaults
+K1, B, EPSILON = 1.5, 0.75, 0.25
+ARRAYS = ["idf", "doc_len", "post_ptr", "post_doc", "post_tf", "doc_ptr", "doc_terms", "doc_tfs"]
+
+
+def file_hashes(docs_path: str) -> List[Tuple[str, str, str]]:
+    """(path, name, sha256 of the bytes) per markdown doc, in the order Retriever reads them."""
+    hashes = []
+    for filepath in glob.glob(os.path.join(docs_path, "*.md")):
+        with open(filepath, "rb") as f:
+            hashes.append((filepath, os.path.basename(filepath).replace(".md", ""), hashlib.sha256(f.read()).hexdigest()))
+    return hashes
+
+
+def _version_key(hashes: List[Tuple[str, str, str]]) -> str:
+    key = json.dumps([FORMAT_VERSION, K1, B, EPSILON, [(name, digest) for _, name, digest in hashes]])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+class BM25Index:
+    """A loaded (memory-mapped) index version; get_scores() matches BM25Okapi.get_scores()."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.chunks: List[Dict[str, str]] = self.meta["chunks"]
+        self.vocab = {term: i for i, term in enumerate(self.meta["vocab"])}
+        self.avgdl = self.meta["avgdl"]
+        self.arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+        # Length normalization per chunk, the same for every query term
+        self._norm = K1 * (1 - B + B * np.asarray(self.arrays["doc_len"], dtype=np.float64) / self.avgdl)
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        a = self.arrays
+        scores = np.zeros(len(self.chunks))
+        for token in query_tokens:
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            start, end = a["post_ptr"][term], a["post_ptr"][term + 1]
+            docs, tf = a["post_doc"][start:end], a["post_tf"][start:end]
+            scores[docs] += a["idf"][term] * (tf * (K1 + 1) / (tf + self._norm[docs]))
+        return scores
+
+    def file_counts(self) -> Dict[Tuple[str, str], List[Tuple[Dict[str, str], Dict[str, int], int]]]:
+        """Term counts per chunk of every file in this version, keyed by (name, content hash), for rebuilds."""
+        a, vocab = self.arrays, self.meta["vocab"]
+        files = {}
+        for entry in self.meta["files"]:
+            chunks = []
+            for i in range(entry["first"], entry["first"] + entry["count"]):
+                start, end = a["doc_ptr"][i], a["doc_ptr"][i + 1]
+                counts = {vocab[t]: int(n) for t, n in zip(a["doc_terms"][start:end], a["doc_tfs"][start:end])}
+                chunks.append((self.chunks[i], counts, int(a["doc_len"][i])))
+            files[(entry["name"], entry["sha256"])] = chunks
+        return files
+
+
+def _build(target: str, files: List[Tuple[str, str, List[Tuple[Dict[str, str], Dict[str, int], int]]]]):
+    """Writes one index version from (name, sha256, [(chunk, term counts, length)]) per file."""
+    chunks, counts, lengths, file_entries = [], [], [], []
+    for name, digest, file_chunks in files:
+        file_entries.append({"name": name, "sha256": digest, "first": len(chunks), "count": len(file_chunks)})
+        for chunk, chunk_counts, length in file_chunks:
+            chunks.append(chunk)
+            counts.append(chunk_counts)
+            lengths.append(length)
+
+    vocab = sorted({term for chunk_counts in counts for term in chunk_counts})
+    term_ids = {term: i for i, term in enumerate(vocab)}
+
+    # Chunk-major CSR
+    doc_ptr = np.zeros(len(chunks) + 1, dtype=np.int64)
+    doc_terms, doc_tfs = [], []
+    for i, chunk_counts in enumerate(counts):
+        doc_terms.extend(term_ids[t] for t in chunk_counts)
+        doc_tfs.extend(chunk_counts.values())
+        doc_ptr[i + 1] = len(doc_terms)
+    doc_terms = np.array(doc_terms, dtype=np.int32)
+    doc_tfs = np.array(doc_tfs, dtype=np.float64)
+    doc_ids = np.repeat(np.arange(len(chunks), dtype=np.int32), np.diff(doc_ptr))
+
+    # Term-major CSR (postings), chunk ids ascending within each term
+    order = np.lexsort((doc_ids, doc_terms))
+    df = np.bincount(doc_terms, minlength=len(vocab))
+    post_ptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+
+    # BM25Okapi idf: log(N - df + 0.5) - log(df + 0.5), negatives floored at epsilon x the mean idf
+    n = len(chunks)
+    idf = np.array([math.log(n - d + 0.5) - math.log(d + 0.5) for d in df], dtype=np.float64)
+    if len(idf):
+        idf[idf < 0] = EPSILON * (sum(idf.tolist()) / len(idf))
+
+    arrays = {
+        "idf": idf, "doc_len": np.array(lengths, dtype=np.int32), "post_ptr": post_ptr,
+        "post_doc": doc_ids[order], "post_tf": doc_tfs[order],
+        "doc_ptr": doc_ptr, "doc_terms": doc_terms, "doc_tfs": doc_tfs,
+    }
+    meta = {"format": FORMAT_VERSION, "files": file_entries, "chunks": chunks, "vocab": vocab,
+            "avgdl": sum(lengths) / n if n else 0.0}
+
+    tmp_dir = f"{target}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp_dir, target)
+    except OSError:
+        # Another process built the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _read_current(index_dir: str) -> str:
+    try:
+        with open(os.path.join(index_dir, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _current(index_dir: str) -> Optional[BM25Index]:
+    version = _read_current(index_dir)
+    try:
+        return BM25Index(os.path.join(index_dir, version)) if version else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _set_current(index_dir: str, version: str):
+    tmp_path = os.path.join(index_dir, f"CURRENT.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(index_dir, "CURRENT"))
+    # Older versions are no longer needed (processes that mapped them keep their pages)
+    for name in os.listdir(index_dir):
+        if name != version and not name.startswith("CURRENT") and not name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+
+def open_index(docs_path: str, index_dir: str = INDEX_DIR, tokenize=None, split=None,
+               stats: Optional[Dict[str, int]] = None) -> BM25Index:
+    """
+    Returns the index for the current docs, building it if needed. `tokenize(text)` and
+    `split(text, file_name)` (chunk dicts) define the chunks and tokens; `stats`, if given,
+    receives how many files were reused and re-tokenized.
+    """
+    hashes = file_hashes(docs_path)
+    if not hashes:
+        raise ValueError(f"no *.md docs in {docs_path}")
+    version = _version_key(hashes)
+    target = os.path.join(index_dir, version)
+    if not os.path.exists(os.path.join(target, "meta.json")):
+        previous = _current(index_dir)
+        reusable = previous.file_counts() if previous is not None else {}
+        files, reused = [], 0
+        for filepath, name, digest in hashes:
+            if (name, digest) in reusable:
+                files.append((name, digest, reusable[(name, digest)]))
+                reused += 1
+                continue
+            with open(filepath, "r", encoding="utf-8") as f:
+                file_chunks = []
+                for chunk in split(f.read(), name):
+                    tokens = tokenize(chunk["text"])
+                    chunk_counts = {}
+                    for token in tokens:
+                        chunk_counts[token] = chunk_counts.get(token, 0) + 1
+                    file_chunks.append((chunk, chunk_counts, len(tokens)))
+            files.append((name, digest, file_chunks))
+        os.makedirs(index_dir, exist_ok=True)
+        _build(target, files)
+        if stats is not None:
+            stats.update(reused=reused, tokenized=len(hashes) - reused, built=1)
+    elif stats is not None:
+        stats.update(reused=len(hashes), tokenized=0, built=0)
+    if _read_current(index_dir) != version:
+        _set_current(index_dir, version)
+    return BM25Index(target)
@@ -5,10 +5,26 @@ import numpy as np
 from rank_bm25 import BM25Okapi
 
 class Retriever: 
-    def __init__(self, docs_path="docs"):
+    def __init__(self, docs_path="docs", index_dir=None):
+        """
+        Builds the BM25 index over docs_path/*.md in memory. With `index_dir`, the index
+        is the persisted one in that directory (agent/rag/bm25_index.py), memory-mapped
+        and only rebuilt for docs whose content changed.
+        """
         self.chunks = []
         self.corpus = []
         self.bm25 = None
+        self.index = None
+        self.index_stats = {}
+
+        if index_dir is not None:
+            from agent.rag.bm25_index import open_index
+
+            self.index = open_index(docs_path, index_dir, tokenize=self._tokenize, split=self._split,
+                                    stats=self.index_stats)
+            self.chunks = self.index.chunks
+            self.corpus = [chunk["text"] for chunk in self.chunks]
+            return
 
         filepaths = glob.glob(os.path.join(docs_path, "*.md"))
         
@@ -28,7 +44,9 @@ class Retriever:
         clean_text = re.sub(r'[^a-z0-9\s]', '', text.lower())
         return clean_text.split()
 
-    def _process_text(self, text, split_on="\n## ", file_name="unknown"):
+    def _split(self, text, file_name="unknown", split_on="\n## "):
+        """Chunk dicts (id, text, source) of one doc, one per '## ' section."""
+        chunks = []
         sections = text.split(split_on)
         for i, section in enumerate(sections):
             cleaned_section = section.strip()
@@ -40,17 +58,25 @@ class Retriever:
 
             chunk_id = f"{file_name}::chunk{i}"
             
-            self.chunks.append({
+            chunks.append({
                 "id": chunk_id,
                 "text": cleaned_section,
                 "source": file_name
             })
-            self.corpus.append(cleaned_section)
+        return chunks
+
+    def _process_text(self, text, split_on="\n## ", file_name="unknown"):
+        for chunk in self._split(text, file_name, split_on):
+            self.chunks.append(chunk)
+            self.corpus.append(chunk["text"])
 
     def search(self, query, top_k=3):
         tokenized_query = self._tokenize(query)
         
-        doc_scores = self.bm25.get_scores(tokenized_query)
+        if self.index is not None:
+            doc_scores = self.index.get_scores(tokenized_query)
+        else:
+            doc_scores = self.bm25.get_scores(tokenized_query)
         top_n_indices = np.argsort(doc_scores)[-top_k:][::-1]
 
         results = []
@@ -60,7 +86,7 @@ class Retriever:
                     "id": self.chunks[idx]["id"],
                     "text": self.chunks[idx]["text"],
                     "source": self.chunks[idx]["source"],
-                    "score": doc_scores[idx]
+                    "score": float(doc_scores[idx])
                 })
         return results
     
@@ -0,0 +1,73 @@
+import os
+import re
+import threading
+from typing import Tuple
+
+# Weighted evidence for each route. Each pattern counts once per question.
+HYBRID_PATTERNS = [
+    (r"\bhow (many|much)\b", 2.0),
+    (r"\b(total|sum|count)\b", 1.5),
+    (r"\b(average|avg|aov|mean)\b", 1.5),
+    (r"\b(revenue|sales|sold|quantity|units|margin|profit|freight|discount)\b", 1.5),
+    (r"\b(top\s*\d*|best|highest|lowest|most|least|rank(ed|ing)?)\b", 1.5),
+    (r"\b(19|20)\d\d\b", 1.0),
+    (r"\b(january|february|march|april|may|june|july|august|september|october|november|december)\b", 1.0),
+    (r"\ball[- ]time\b", 1.0),
+    (r"\b(per|by) (customer|product|category|month|year)\b", 1.0),
+]
+
+RAG_PATTERNS = [
+    (r"\bpolic(y|ies)\b", 3.0),
+    (r"\breturn (window|period|policy|days)\b", 3.0),
+    (r"\b(unopened|opened|perishables?|non-perishables?)\b", 1.5),
+    (r"\bdays?\b", 1.0),
+    (r"\b(calendar|campaign) (dates?|notes?)\b", 1.0),
+    (r"\b(define|definition|meaning)\b", 0.5),
+]
+
+# Minimum confidence for the rules to answer without asking the LLM
+CONFIDENCE_THRESHOLD = float(os.environ.get("ROUTER_CONFIDENCE", "0.75"))
+
+
+class RuleRouter:
+    """
+    Deterministic pre-classifier for the router node.
+
+    Sums the weights of matched patterns for each route and turns them into a smoothed
+    probability p(hybrid) = (h + 1) / (h + r + 2). Questions with little or conflicting
+    evidence land near 0.5 and are left to the LLM.
+    """
+
+    def __init__(self, threshold: float = CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        self._hybrid = [(re.compile(p, re.IGNORECASE), w) for p, w in HYBRID_PATTERNS]
+        self._rag = [(re.compile(p, re.IGNORECASE), w) for p, w in RAG_PATTERNS]
+        self._lock = threading.Lock()
+        self.stats = {"questions": 0, "llm_skipped": 0, "llm_called": 0}
+
+    def score(self, question: str) -> Tuple[str, float]:
+        """Returns (label, confidence) where confidence is in [0.5, 1.0]."""
+        h = sum(w for pattern, w in self._hybrid if pattern.search(question))
+        r = sum(w for pattern, w in self._rag if pattern.search(question))
+        p_hybrid = (h + 1.0) / (h + r + 2.0)
+        if p_hybrid > 0.5:
+            return "hybrid", p_hybrid
+        # Ties go to 'rag', matching the old keyword fallback's default
+        return "rag", 1.0 - p_hybrid
+
+    def classify(self, question: str) -> Tuple[str, float, bool]:
+        """
+        Returns (label, confidence, confident). `confident` means the label can be used
+        without an LLM call; the caller is expected to fall through otherwise.
+        """
+        label, confidence = self.score(question)
+        confident = confidence >= self.threshold
+        with self._lock:
+            self.stats["questions"] += 1
+            self.stats["llm_skipped" if confident else "llm_called"] += 1
+        return label, confidence, confident
+
+    def summary(self) -> str:
+        s = self.stats
+        rate = s["llm_skipped"] / s["questions"] if s["questions"] else 0.0
+        return f"{s['llm_skipped']}/{s['questions']} routed by rules ({rate:.0%} LLM calls skipped)"
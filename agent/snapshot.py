@@ -0,0 +1,52 @@
+import glob
+import hashlib
+import json
+import os
+from typing import Dict, Any
+
+SNAPSHOT_PATH = os.environ.get("AGENT_SNAPSHOT_PATH", ".cache/warm_snapshot.json")
+
+
+def file_fingerprint(path: str) -> str:
+    """Cheap change detector for a file: size + mtime (ns). Empty if the file is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def docs_fingerprint(docs_path: str) -> str:
+    """Content hash over every markdown doc (name + bytes), independent of mtimes."""
+    digest = hashlib.sha256()
+    for filepath in sorted(glob.glob(os.path.join(docs_path, "*.md"))):
+        digest.update(os.path.basename(filepath).encode("utf-8"))
+        with open(filepath, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> Dict[str, Any]:
+    """Returns the snapshot dict, or {} if it is missing or unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_snapshot(data: Dict[str, Any], path: str = SNAPSHOT_PATH):
+    """Atomic write (temp file + rename) so concurrent workers never read half a snapshot."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def update_snapshot(section: str, value: Dict[str, Any], path: str = SNAPSHOT_PATH):
+    """Replaces one section (e.g. 'schema') and keeps the others."""
+    data = load_snapshot(path)
+    data[section] = value
+    save_snapshot(data, path)
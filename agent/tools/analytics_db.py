@@ -0,0 +1,247 @@
+"""
+Builds the analytics copy of the Northwind DB that the agent queries.
+
+The copy is a page-level backup of the source with the lowercase views, covering
+indexes for the agent's query shapes (order_items -> orders -> products ->
+categories, filtered on OrderDate ranges), a denormalized `sales_fact` table, the
+month x category/product/customer rollups (agent/tools/sql_rollups.py) and fresh
+ANALYZE statistics. The source file is only read.
+
+Re-running against an existing copy refreshes it incrementally: only orders with
+new OrderIDs are copied and materialized, and the rollup months they touch are
+recomputed. Edits to existing orders or to any other table trigger a full rebuild.
+Per-table fingerprints (definition, row count, max rowid) stored with the copy send a
+changed non-order table straight to the rebuild; otherwise every table is compared
+row by row, which also catches in-place UPDATEs.
+
+    python -m agent.tools.analytics_db [--source data/northwind.sqlite] [--target data/northwind_analytics.sqlite] [--rebuild]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from urllib.request import pathname2url
+
+from agent.snapshot import file_fingerprint
+from agent.tools.sql_rollups import refresh_rollups
+
+SOURCE_PATH = "data/northwind.sqlite"
+ANALYTICS_PATH = os.environ.get("ANALYTICS_DB_PATH", "data/northwind_analytics.sqlite")
+
+# Covering indexes: each one holds every column the common queries read from that table
+INDEXES = {
+    "idx_orders_date": 'Orders (OrderDate, OrderID, CustomerID)',
+    "idx_order_details_order": '"Order Details" (OrderID, ProductID, UnitPrice, Quantity, Discount)',
+    "idx_order_details_product": '"Order Details" (ProductID, OrderID, UnitPrice, Quantity, Discount)',
+    "idx_products_category": 'Products (CategoryID, ProductID)',
+}
+
+
+# One row per order line with everything revenue questions need, so they avoid the
+# order_items -> orders -> products -> categories -> customers joins
+SALES_FACT_DDL = """
+CREATE TABLE IF NOT EXISTS sales_fact (
+    OrderID INTEGER NOT NULL,
+    ProductID INTEGER NOT NULL,
+    OrderDate DATETIME,
+    CustomerID TEXT,
+    CompanyName TEXT,
+    ProductName TEXT,
+    CategoryID INTEGER,
+    CategoryName TEXT,
+    UnitPrice NUMERIC,
+    Quantity INTEGER,
+    Discount REAL,
+    GrossRevenue REAL,
+    NetRevenue REAL,
+    PRIMARY KEY (OrderID, ProductID)
+)
+"""
+SALES_FACT_INDEXES = {
+    "idx_sales_fact_date": "sales_fact (OrderDate)",
+    "idx_sales_fact_category": "sales_fact (CategoryName, OrderDate)",
+}
+SALES_FACT_SELECT = """
+SELECT od.OrderID, od.ProductID, o.OrderDate, o.CustomerID, cu.CompanyName, p.ProductName,
+       p.CategoryID, c.CategoryName, od.UnitPrice, od.Quantity, od.Discount,
+       od.UnitPrice * od.Quantity,
+       od.UnitPrice * od.Quantity * (1 - COALESCE(od.Discount, 0))
+FROM "Order Details" od
+JOIN Orders o ON o.OrderID = od.OrderID
+LEFT JOIN Products p ON p.ProductID = od.ProductID
+LEFT JOIN Categories c ON c.CategoryID = p.CategoryID
+LEFT JOIN Customers cu ON cu.CustomerID = o.CustomerID
+WHERE od.OrderID > ?
+"""
+# Tables refreshed by appending new OrderIDs; a change to any other source table means a full rebuild
+FACT_TABLES = ["Orders", "Order Details"]
+
+
+def refresh_sales_fact(conn: sqlite3.Connection) -> int:
+    """Materializes order lines whose OrderID is newer than anything in sales_fact. Returns rows added."""
+    conn.execute(SALES_FACT_DDL)
+    for index_name, definition in SALES_FACT_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {definition}")
+    last_id = conn.execute("SELECT COALESCE(MAX(OrderID), -1) FROM sales_fact").fetchone()[0]
+    return conn.execute(f"INSERT INTO sales_fact {SALES_FACT_SELECT}", (last_id,)).rowcount
+
+
+def table_fingerprints(conn: sqlite3.Connection, schema: str = "main") -> dict:
+    """
+    Cheap per-table change detector for the source tables of `schema`: definition, row count
+    and max(rowid). Appends and deletes change it; an in-place UPDATE does not, so an
+    unchanged fingerprint never proves unchanged content.
+    """
+    fingerprints = {}
+    for name, sql in conn.execute(
+            f"SELECT name, sql FROM {schema}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+        try:
+            count, max_rowid = conn.execute(f'SELECT COUNT(*), MAX(rowid) FROM {schema}."{name}"').fetchone()
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID table
+            count, max_rowid = conn.execute(f'SELECT COUNT(*), NULL FROM {schema}."{name}"').fetchone()
+        fingerprints[name] = [sql, count, max_rowid]
+    return fingerprints
+
+
+def _uri(path: str, mode: str) -> str:
+    return f"file:{pathname2url(os.path.abspath(path))}?mode={mode}"
+
+
+def _read_meta(path: str) -> dict:
+    try:
+        conn = sqlite3.connect(_uri(path, "ro"), uri=True)
+        try:
+            return dict(conn.execute("SELECT key, value FROM analytics_meta"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+
+def is_current(source: str = SOURCE_PATH, target: str = ANALYTICS_PATH) -> bool:
+    """True if `target` exists and was built from the current version of `source`."""
+    if not os.path.exists(target):
+        return False
+    return _read_meta(target).get("source_fingerprint") == file_fingerprint(source)
+
+
+def resolve_db_path(source: str = SOURCE_PATH, target: str = ANALYTICS_PATH) -> str:
+    """The analytics copy when it is up to date with the source, otherwise the source itself."""
+    return target if is_current(source, target) else source
+
+
+def build_analytics_db(source: str = SOURCE_PATH, target: str = ANALYTICS_PATH) -> str:
+    """Backs up `source` into `target` (atomically replaced) and adds views, indexes and statistics."""
+    from agent.tools.sqlite_tool import VIEWS
+
+    fingerprint = file_fingerprint(source)
+    if not fingerprint:
+        raise FileNotFoundError(source)
+
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    src = sqlite3.connect(_uri(source, "ro"), uri=True)
+    dst = sqlite3.connect(tmp_path)
+    try:
+        src.backup(dst)
+        # Taken from the copy, i.e. exactly the snapshot of the source that was backed up
+        fingerprints = table_fingerprints(dst)
+
+        for view_name, definition in VIEWS.items():
+            if not dst.execute("SELECT 1 FROM sqlite_master WHERE name = ? COLLATE NOCASE", (view_name,)).fetchone():
+                dst.execute(f"CREATE VIEW {view_name} AS {definition}")
+        for index_name, definition in INDEXES.items():
+            dst.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {definition}")
+        refresh_sales_fact(dst)
+        refresh_rollups(dst)
+        dst.execute("ANALYZE")
+
+        dst.execute("CREATE TABLE IF NOT EXISTS analytics_meta (key TEXT PRIMARY KEY, value TEXT)")
+        dst.executemany("INSERT OR REPLACE INTO analytics_meta VALUES (?, ?)", [
+            ("source_path", os.path.abspath(source)),
+            ("source_fingerprint", fingerprint),
+            ("table_fingerprints", json.dumps(fingerprints)),
+            ("built_at", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ])
+        dst.commit()
+    finally:
+        dst.close()
+        src.close()
+
+    os.replace(tmp_path, target)
+    return target
+
+
+def refresh_analytics_db(source: str = SOURCE_PATH, target: str = ANALYTICS_PATH) -> str:
+    """
+    Brings an existing copy up to date with `source`. Appends orders with new OrderIDs
+    and their lines (base tables and sales_fact) when that is all that changed,
+    otherwise rebuilds. Returns "current", "incremental (+N orders, +M lines)" or "rebuilt".
+    """
+    if is_current(source, target):
+        return "current"
+    meta = _read_meta(target)
+    if not os.path.exists(target) or not meta.get("source_fingerprint"):
+        build_analytics_db(source, target)
+        return "rebuilt"
+
+    conn = sqlite3.connect(_uri(target, "rw"), uri=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (_uri(source, "ro"),))
+        last_id = conn.execute("SELECT COALESCE(MAX(OrderID), -1) FROM main.Orders").fetchone()[0]
+        fingerprints = table_fingerprints(conn, "src")
+        previous = json.loads(meta.get("table_fingerprints") or "null")
+
+        # Anything other than appended orders (edits, deletes, other table changes) needs a rebuild.
+        # A non-fact table whose fingerprint moved means a rebuild without diffing; otherwise
+        # every table is diffed (fact tables up to last_id), since in-place updates keep the
+        # fingerprint.
+        changed = [] if previous is None else \
+            [t for t in set(fingerprints) | set(previous) if fingerprints.get(t) != previous.get(t)]
+        unchanged = all(t in FACT_TABLES for t in changed)
+        to_diff = list(fingerprints) if unchanged else []
+        try:
+            unchanged = unchanged and all(
+                conn.execute(f'SELECT NOT EXISTS (SELECT * FROM main."{t}" {where} EXCEPT SELECT * FROM src."{t}" {where}) '
+                             f'AND NOT EXISTS (SELECT * FROM src."{t}" {where} EXCEPT SELECT * FROM main."{t}" {where})',
+                             params * 4).fetchone()[0]
+                for t, where, params in [(t, "WHERE OrderID <= ?", (last_id,)) if t in FACT_TABLES else (t, "", ())
+                                         for t in to_diff]
+            )
+        except sqlite3.OperationalError:
+            # New table or changed columns
+            unchanged = False
+        if not unchanged:
+            conn.close()
+            build_analytics_db(source, target)
+            return "rebuilt"
+
+        orders = conn.execute("INSERT INTO main.Orders SELECT * FROM src.Orders WHERE OrderID > ?", (last_id,)).rowcount
+        conn.execute('INSERT INTO main."Order Details" SELECT * FROM src."Order Details" WHERE OrderID > ?', (last_id,))
+        lines = refresh_sales_fact(conn)
+        refresh_rollups(conn, since_order_id=last_id)
+        conn.execute("PRAGMA main.optimize")
+        conn.execute("INSERT OR REPLACE INTO analytics_meta VALUES ('source_fingerprint', ?)", (file_fingerprint(source),))
+        conn.execute("INSERT OR REPLACE INTO analytics_meta VALUES ('table_fingerprints', ?)", (json.dumps(fingerprints),))
+        conn.execute("INSERT OR REPLACE INTO analytics_meta VALUES ('refreshed_at', ?)", (time.strftime("%Y-%m-%dT%H:%M:%S"),))
+        conn.commit()
+        return f"incremental (+{orders} orders, +{lines} lines)"
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the indexed analytics copy of the Northwind DB")
+    parser.add_argument("--source", default=SOURCE_PATH)
+    parser.add_argument("--target", default=ANALYTICS_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild from scratch instead of refreshing")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.rebuild:
+        build_analytics_db(args.source, args.target)
+        outcome = "rebuilt"
+    else:
+        outcome = refresh_analytics_db(args.source, args.target)
+    print(f"{args.target}: {outcome} from {args.source} in {time.time() - start:.2f}s")
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+from typing import Dict, Any, Optional
+
+import dspy
+
+from agent.tools.llm_client import LLMClient, get_client
+
+
+class OllamaLM(dspy.BaseLM):
+    """
+    DSPy LM that talks to Ollama's /api/chat through the shared pooled LLMClient,
+    instead of opening its own connections via LiteLLM.
+    """
+
+    # DSPy/OpenAI-style kwargs -> Ollama option names
+    OPTION_NAMES = {"max_tokens": "num_predict"}
+
+    def __init__(self, model: str, client: Optional[LLMClient] = None, temperature: float = 0.0, **kwargs):
+        super().__init__(model=model, model_type="chat", temperature=temperature, **kwargs)
+        self._client = client
+
+    @property
+    def client(self) -> LLMClient:
+        return self._client or get_client()
+
+    def _options(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        options = {}
+        for key, value in {**self.kwargs, **kwargs}.items():
+            if value is None or key.startswith("api_") or key in ("n", "rollout_id"):
+                continue
+            options[self.OPTION_NAMES.get(key, key)] = value
+        return options
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        result = self.client.chat(messages, model=self.model, options=self._options(kwargs))
+
+        message = SimpleNamespace(content=result["message"]["content"], tool_calls=None)
+        return SimpleNamespace(
+            model=self.model,
+            choices=[SimpleNamespace(message=message, finish_reason=result.get("done_reason", "stop"))],
+            usage={
+                "prompt_tokens": result.get("prompt_eval_count", 0),
+                "completion_tokens": result.get("eval_count", 0),
+                "total_tokens": result.get("prompt_eval_count", 0) + result.get("eval_count", 0),
+            },
+        )
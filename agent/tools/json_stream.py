@@ -0,0 +1,67 @@
+import json
+from typing import Any, Dict, Optional
+
+
+class JSONObjectScanner:
+    """
+    Incremental brace matcher over streamed LLM text.
+
+    Text outside a top-level {...} (markdown fences, prose) is ignored. Each time a
+    top-level object closes it is parsed; the first one that parses and contains
+    `required_key` is kept in `.result`. String literals and escapes are tracked,
+    so braces inside values do not confuse the depth count.
+    """
+
+    def __init__(self, required_key: Optional[str] = None):
+        self.required_key = required_key
+        self.result: Optional[Dict[str, Any]] = None
+        self._buf = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def complete(self) -> bool:
+        return self.result is not None
+
+    def feed(self, text: str) -> bool:
+        """Consumes the next piece of text. Returns True once a complete object has been found."""
+        if self.complete:
+            return True
+
+        for ch in text:
+            if self._depth == 0:
+                if ch == "{":
+                    self._buf = [ch]
+                    self._depth = 1
+                continue
+
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._accept("".join(self._buf)):
+                    return True
+        return False
+
+    def _accept(self, candidate: str) -> bool:
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(parsed, dict):
+            return False
+        if self.required_key and self.required_key not in parsed:
+            return False
+        self.result = parsed
+        return True
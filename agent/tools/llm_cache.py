@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".cache/llm_cache.sqlite")
+MAX_BYTES = int(float(os.environ.get("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+MAX_AGE = float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", "30")) * 86400
+BYPASS = os.environ.get("LLM_CACHE_BYPASS", "") not in ("", "0", "false")
+
+# Run the (comparatively expensive) eviction sweep once every N stores
+EVICT_EVERY = 50
+
+
+def make_key(model: str, messages: List[Dict[str, str]], options: Optional[Dict[str, Any]] = None) -> str:
+    """Content address of a request: sha256 over the canonical JSON of (model, messages, options)."""
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "options": options or {}},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(options: Optional[Dict[str, Any]]) -> bool:
+    """Only temperature=0 requests are safe to answer from the cache."""
+    return (options or {}).get("temperature") == 0
+
+
+class LLMCache:
+    """
+    Persistent LLM response cache stored in a local SQLite file.
+
+    Entries expire after `max_age` seconds; once the file holds more than `max_bytes`
+    of responses, least-recently-used entries are evicted. With `bypass=True` lookups
+    always miss but fresh responses are still written, which refreshes the cache.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = MAX_BYTES,
+                 max_age: float = MAX_AGE, bypass: bool = BYPASS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.bypass = bypass
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created REAL,
+                accessed REAL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.bypass:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, response: Dict[str, Any]):
+        payload = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, payload, len(payload), now, now)
+            )
+            self._conn.commit()
+            self.stats["stores"] += 1
+            if self.stats["stores"] % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        """Drops expired entries, then LRU entries until the total size fits. Caller holds the lock."""
+        cur = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+        evicted = cur.rowcount
+
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed ASC"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+
+        self._conn.commit()
+        self.stats["evictions"] += evicted
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"hits={s['hits']} misses={s['misses']} hit_rate={self.hit_rate():.1%} "
+                f"stores={s['stores']} evictions={s['evictions']}")
@@ -0,0 +1,259 @@
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Dict, Any, Optional
+from urllib.parse import urlparse
+
+from agent.tools.llm_cache import LLMCache, make_key, is_deterministic
+from agent import tracing
+
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "4"))
+TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "300"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+BACKOFF = float(os.environ.get("LLM_BACKOFF", "0.5"))
+
+# Errors worth retrying: dropped keep-alive sockets, refused connections, timeouts.
+RETRYABLE_ERRORS = (http.client.HTTPException, ConnectionError, TimeoutError, OSError)
+
+
+class LLMClient:
+    """
+    Thread-safe HTTP/1.1 client for the Ollama API with a keep-alive connection pool.
+
+    At most `pool_size` requests are in flight at once; idle connections are kept
+    open and reused, so every LLM round-trip after the first skips TCP setup.
+    With a `cache`, deterministic (temperature=0) chat calls are answered from disk when seen before.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_HOST, pool_size: int = POOL_SIZE,
+                 timeout: float = TIMEOUT, max_retries: int = MAX_RETRIES, backoff: float = BACKOFF,
+                 cache: Optional[LLMCache] = None):
+        parsed = urlparse(base_url if "://" in base_url else f"http://{base_url}")
+        self.base_url = base_url
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 11434
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "connections_opened": 0, "retries": 0, "errors": 0,
+                      "streams": 0, "early_stops": 0, "stream_chunks": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            self._count("connections_opened")
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn: http.client.HTTPConnection, reuse: bool):
+        if reuse:
+            try:
+                self._idle.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        conn.close()
+
+    def post_json(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POSTs a JSON payload and returns the decoded JSON body.
+        Retries connection-level failures and 5xx responses with exponential backoff.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        self._count("requests")
+
+        attempt = 0
+        with self._slots:
+            while True:
+                conn = self._acquire()
+                try:
+                    conn.request("POST", path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    raw = response.read()
+
+                    if response.status >= 500:
+                        raise http.client.HTTPException(f"HTTP {response.status}: {raw[:200]!r}")
+                    self._release(conn, reuse=not response.will_close)
+                    if response.status >= 400:
+                        # Client errors (unknown model, bad payload) will not fix themselves
+                        self._count("errors")
+                        raise ValueError(f"HTTP {response.status}: {raw.decode('utf-8', 'replace')}")
+                    return json.loads(raw.decode("utf-8"))
+                except RETRYABLE_ERRORS as e:
+                    conn.close()
+                    if attempt >= self.max_retries:
+                        self._count("errors")
+                        raise
+                    self._count("retries")
+                    time.sleep(self.backoff * (2 ** attempt))
+                    attempt += 1
+
+    def chat(self, messages: List[Dict[str, str]], model: str,
+             options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Calls /api/chat (non-streaming) and returns the full Ollama response object."""
+        start = time.perf_counter()
+        options = options or {}
+        cacheable = self.cache is not None and is_deterministic(options)
+        if cacheable:
+            key = make_key(model, messages, options)
+            cached = self.cache.get(key)
+            if cached is not None:
+                tracing.record_llm(cached, time.perf_counter() - start, cached=True)
+                return cached
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": False,
+            "options": options
+        }
+        result = self.post_json("/api/chat", payload)
+        tracing.record_llm(result, time.perf_counter() - start)
+
+        if cacheable:
+            self.cache.put(key, model, result)
+        return result
+
+    def chat_stream(self, messages: List[Dict[str, str]], model: str,
+                    options: Optional[Dict[str, Any]] = None,
+                    stop_when: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+        """
+        Calls /api/chat with stream=True and consumes the NDJSON chunks as they arrive.
+
+        `stop_when` is fed each new piece of content; when it returns True the connection
+        is dropped, which makes Ollama abort generation. Returns a response object shaped
+        like chat()'s, with done_reason "early_stop" when generation was cut short.
+        """
+        start = time.perf_counter()
+        options = options or {}
+        cacheable = self.cache is not None and is_deterministic(options)
+        if cacheable:
+            key = make_key(model, messages, options)
+            cached = self.cache.get(key)
+            if cached is not None:
+                tracing.record_llm(cached, time.perf_counter() - start, cached=True)
+                return cached
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "options": options
+        }
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        self._count("requests")
+        self._count("streams")
+
+        attempt = 0
+        with self._slots:
+            while True:
+                conn = self._acquire()
+                try:
+                    conn.request("POST", "/api/chat", body=body, headers=headers)
+                    response = conn.getresponse()
+                    if response.status >= 500:
+                        raise http.client.HTTPException(f"HTTP {response.status}: {response.read()[:200]!r}")
+                    if response.status >= 400:
+                        raw = response.read()
+                        self._release(conn, reuse=not response.will_close)
+                        self._count("errors")
+                        raise ValueError(f"HTTP {response.status}: {raw.decode('utf-8', 'replace')}")
+                    break
+                except RETRYABLE_ERRORS:
+                    conn.close()
+                    if attempt >= self.max_retries:
+                        self._count("errors")
+                        raise
+                    self._count("retries")
+                    time.sleep(self.backoff * (2 ** attempt))
+                    attempt += 1
+
+            # Once tokens are flowing we no longer retry: a partial answer cannot be resumed.
+            content = []
+            result = {"model": model, "message": {"role": "assistant", "content": ""}}
+            try:
+                for line in response:
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    piece = chunk.get("message", {}).get("content", "")
+                    content.append(piece)
+                    self._count("stream_chunks")
+
+                    if chunk.get("done"):
+                        result.update({k: v for k, v in chunk.items() if k != "message"})
+                        response.read()
+                        self._release(conn, reuse=not response.will_close)
+                        break
+                    if stop_when is not None and piece and stop_when(piece):
+                        conn.close()
+                        self._count("early_stops")
+                        result.update({"done": True, "done_reason": "early_stop"})
+                        break
+                else:
+                    conn.close()
+            except Exception:
+                conn.close()
+                self._count("errors")
+                raise
+
+        result["message"]["content"] = "".join(content)
+        if result.get("done_reason") == "early_stop":
+            # Ollama sends token counts only in the final chunk; count what we received
+            result["eval_count"] = len(content)
+        tracing.record_llm(result, time.perf_counter() - start)
+        if cacheable and result.get("done"):
+            self.cache.put(key, model, result)
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> LLMClient:
+    """Returns the process-wide shared client, creating it from env settings on first use."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = LLMClient(cache=LLMCache())
+        return _CLIENT
+
+
+def configure_client(**kwargs) -> LLMClient:
+    """
+    Replaces the shared client (e.g. to change pool size or point at another host).
+    The existing response cache is kept unless `cache` is passed explicitly.
+    """
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is not None:
+            kwargs.setdefault("cache", _CLIENT.cache)
+            _CLIENT.close()
+        else:
+            kwargs.setdefault("cache", LLMCache())
+        _CLIENT = LLMClient(**kwargs)
+        return _CLIENT
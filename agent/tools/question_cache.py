@@ -0,0 +1,264 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from urllib.request import pathname2url
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+CACHE_PATH = os.environ.get("QUESTION_CACHE_PATH", ".cache/question_cache.sqlite")
+THRESHOLD = float(os.environ.get("QUESTION_CACHE_THRESHOLD", "0.7"))
+
+# Wording that does not change the query, mapped to one canonical word. Applied before
+# both the similarity index and the entity signature, so "best three products by sales"
+# and "top 3 products by revenue" become the same text.
+SYNONYMS = {
+    "best": "top", "highest": "top", "largest": "top", "biggest": "top", "leading": "top", "most": "top",
+    "greatest": "top", "worst": "bottom", "lowest": "bottom", "smallest": "bottom", "least": "bottom",
+    "sales": "revenue", "turnover": "revenue", "income": "revenue",
+    "quantity": "quantity", "quantities": "quantity", "units": "quantity", "volume": "quantity", "qty": "quantity",
+    "profit": "margin", "margins": "margin",
+    "customers": "customer", "clients": "customer", "client": "customer", "buyers": "customer", "buyer": "customer",
+    "products": "product", "items": "product", "item": "product",
+    "categories": "category", "orders": "order", "suppliers": "supplier", "employees": "employee",
+    "months": "month", "monthly": "month", "years": "year", "yearly": "year", "annual": "year",
+    "overall": "alltime", "ever": "alltime",
+    "without": "not", "excluding": "not", "except": "not", "no": "not",
+    "maximum": "max", "minimum": "min", "mean": "average", "avg": "average",
+}
+PHRASES = [
+    (r"\baverage order value\b", "aov"),
+    (r"\ball[- ]time\b", "alltime"),
+    (r"\bhow many\b", "count"),
+    (r"\bnumber of\b", "count"),
+    (r"\bgross margin\b", "margin"),
+]
+NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+    "eight": "8", "nine": "9", "ten": "10", "twenty": "20", "single": "1",
+}
+# Concepts that change the SQL; two questions only share a plan if they name the same ones
+TERMS = {
+    "top", "bottom", "revenue", "quantity", "margin", "aov", "freight", "discount", "count", "average",
+    "customer", "product", "category", "supplier", "employee", "order", "month", "year", "alltime",
+    "not", "per", "max", "min", "sum", "total", "first", "last", "late", "early", "before", "after",
+}
+# Words that never change the query; every other canonical word has to match, in order,
+# so a word this module does not know (max/min, late/on time, first/last, ...) makes
+# the lookup miss rather than reuse SQL that ignores it
+FILLER = {
+    "a", "an", "the", "what", "which", "who", "was", "were", "is", "are", "be", "been", "did", "do", "does",
+    "has", "have", "had", "of", "in", "for", "during", "by", "me", "show", "tell", "give", "list", "please",
+    "our", "we", "us", "i", "you", "can", "could", "would", "how", "much", "find", "get", "calculate", "compute",
+}
+MONTHS = {
+    "january", "february", "march", "april", "may", "june", "july", "august", "september",
+    "october", "november", "december", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep",
+    "sept", "oct", "nov", "dec", "q1", "q2", "q3", "q4", "summer", "winter", "spring", "autumn", "fall",
+}
+
+WORD_PATTERN = re.compile(r"\d+(?:[-./:]\d+)*|[a-z][a-z0-9_]*")
+# Quotes must not touch a word on the outside, so apostrophes ("docs' AOV") are not quotes
+QUOTED_PATTERN = re.compile(r"(?<!\w)'([^']+)'(?!\w)|\"([^\"]+)\"")
+
+# Capitalized words that are not names ("the Average Order Value", "per the KPI docs")
+COMMON_WORDS = {
+    "kpi", "kpis", "aov", "average", "order", "value", "total", "gross", "net", "revenue", "margin",
+    "definition", "docs", "doc", "policy", "calendar", "marketing", "category", "product", "customer",
+    "return", "sql", "costofgoods", "cost", "goods", "unitprice", "quantity", "discount", "details",
+    "all", "time", "top", "i",
+}
+# A capitalized word that does not start a sentence, e.g. 'Chai' in "units of Chai sold"
+CAPITALIZED_PATTERN = re.compile(r"(?<![.?!:]\s)(?<!^)\b[A-Z][A-Za-z0-9]*")
+
+# Columns whose values can appear in a question as a name ("Beverages", "Chai", "Nancy")
+NAME_COLUMNS = [
+    ("Categories", "CategoryName"), ("Products", "ProductName"), ("Customers", "CompanyName"),
+    ("Suppliers", "CompanyName"), ("Shippers", "CompanyName"), ("Employees", "FirstName"),
+    ("Employees", "LastName"), ("Customers", "Country"), ("Customers", "City"),
+]
+
+
+def canonical_text(question: str) -> str:
+    """Lowercased question with synonyms, phrases and number words rewritten to one form."""
+    text = question.lower()
+    for pattern, replacement in PHRASES:
+        text = re.sub(pattern, replacement, text)
+    words = [NUMBER_WORDS.get(w, SYNONYMS.get(w, w)) for w in WORD_PATTERN.findall(text)]
+    return " ".join(words)
+
+
+def entity_names(db_path: str) -> List[str]:
+    """Every value of NAME_COLUMNS in the DB (read-only); tables or columns that are missing are skipped."""
+    names = set()
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
+    try:
+        for table, column in NAME_COLUMNS:
+            try:
+                names.update(v for (v,) in conn.execute(f'SELECT DISTINCT "{column}" FROM "{table}"') if v)
+            except sqlite3.OperationalError:
+                continue
+    finally:
+        conn.close()
+    return sorted(names)
+
+
+def question_signature(question: str, names: Iterable[str] = ()) -> Dict[str, List[str]]:
+    """
+    What has to be identical for two questions to share SQL: numbers and dates, month or
+    season words, quoted phrases, the SQL-relevant concepts in TERMS, any of `names`
+    (canonical form) that occur in the question, other capitalized words that look like
+    names, and the sequence of all words outside FILLER.
+    """
+    text = canonical_text(question)
+    words = text.split()
+    padded = f" {text} "
+    found = {name for name in names if f" {name} " in padded}
+    for word in CAPITALIZED_PATTERN.findall(question.strip()):
+        word = canonical_text(word)
+        if word not in COMMON_WORDS and word not in TERMS and word not in MONTHS and not any(word in n.split() for n in found):
+            found.add(word)
+    return {
+        "numbers": sorted({w for w in words if w[0].isdigit()}),
+        "months": sorted({w for w in words if w in MONTHS}),
+        "terms": sorted({w for w in words if w in TERMS}),
+        "quoted": sorted({canonical_text(a or b) for a, b in QUOTED_PATTERN.findall(question)}),
+        "names": sorted(found),
+        "words": [w for w in words if w not in FILLER],
+    }
+
+
+class QuestionCache:
+    """
+    Plans and SQL from successful runs, looked up by question similarity.
+
+    Entries live in a local SQLite file (same layout idea as the LLM cache) and are
+    indexed in memory with a character n-gram TF-IDF model over the canonical question
+    text. A lookup hits when the most similar stored question scores at least
+    `threshold`, has the same format hint and `version` (docs fingerprint and model)
+    and the same entity/date signature; `names` (see entity_names) are the DB values
+    that count as entities. With `bypass=True` lookups always miss but new
+    entries are still stored.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, threshold: float = THRESHOLD, version: str = "",
+                 names: Iterable[str] = (), bypass: bool = False):
+        self.path = path
+        self.names = {canonical_text(name) for name in names} - {""}
+        self.threshold = threshold
+        self.version = version
+        self.bypass = bypass
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "discards": 0, "saved_ms": 0.0, "saved_llm_calls": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                question TEXT,
+                canonical TEXT,
+                key TEXT,
+                sql_plan TEXT,
+                sql_query TEXT,
+                cost_ms REAL,
+                llm_calls INTEGER,
+                hits INTEGER DEFAULT 0,
+                created REAL,
+                UNIQUE (canonical, key)
+            )
+        """)
+        self._conn.commit()
+        self._entries: List[Dict[str, Any]] = []
+        self._vectorizer = None
+        self._matrix = None
+        self._load()
+
+    def _key(self, question: str, format_hint: str) -> str:
+        return json.dumps({"signature": question_signature(question, self.names), "format_hint": format_hint.strip(),
+                           "version": self.version}, sort_keys=True)
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT id, question, canonical, key, sql_plan, sql_query, cost_ms, llm_calls FROM questions").fetchall()
+        names = ["id", "question", "canonical", "key", "sql_plan", "sql_query", "cost_ms", "llm_calls"]
+        self._entries = [dict(zip(names, row)) for row in rows]
+        self._matrix = None
+        self._index()
+
+    def _index(self):
+        """Fits the TF-IDF model on the stored questions if they changed since the last fit."""
+        if self._matrix is None and self._entries:
+            self._vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5), sublinear_tf=True)
+            self._matrix = self._vectorizer.fit_transform([e["canonical"] for e in self._entries])
+        return self._matrix
+
+    def lookup(self, question: str, format_hint: str = "") -> Tuple[Optional[Dict[str, Any]], float]:
+        """Returns (entry, similarity) for a hit, or (None, best similarity among compatible entries)."""
+        if self.bypass:
+            return None, 0.0
+        key = self._key(question, format_hint)
+        with self._lock:
+            candidates = [i for i, e in enumerate(self._entries) if e["key"] == key]
+            best, score = None, 0.0
+            if candidates:
+                matrix = self._index()
+                # Rows are L2-normalized, so the dot product is the cosine similarity
+                scores = (matrix[candidates] @ self._vectorizer.transform([canonical_text(question)]).T).toarray().ravel()
+                position = int(scores.argmax())
+                best, score = self._entries[candidates[position]], float(scores[position])
+            if best is None or score < self.threshold:
+                self.stats["misses"] += 1
+                return None, score
+            self.stats["hits"] += 1
+            self.stats["saved_ms"] += best["cost_ms"] or 0.0
+            self.stats["saved_llm_calls"] += best["llm_calls"] or 0
+            self._conn.execute("UPDATE questions SET hits = hits + 1 WHERE id = ?", (best["id"],))
+            self._conn.commit()
+            return dict(best), score
+
+    def store(self, question: str, format_hint: str, sql_plan: str, sql_query: str,
+              cost_ms: float = 0.0, llm_calls: int = 0) -> int:
+        """Saves the plan and SQL of a successful run; `cost_ms`/`llm_calls` is what a later hit saves."""
+        canonical = canonical_text(question)
+        key = self._key(question, format_hint)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO questions (question, canonical, key, sql_plan, sql_query, cost_ms, llm_calls, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (question, canonical, key, sql_plan, sql_query, cost_ms, llm_calls, time.time())
+            )
+            self._conn.commit()
+            self.stats["stores"] += 1
+            self._load()
+            return next(e["id"] for e in self._entries if e["canonical"] == canonical and e["key"] == key)
+
+    def discard(self, entry_id: int):
+        """Drops an entry whose SQL stopped working (e.g. after a schema change)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM questions WHERE id = ?", (entry_id,))
+            self._conn.commit()
+            self.stats["discards"] += 1
+            self._load()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM questions")
+            self._conn.commit()
+            self._load()
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"hits={s['hits']} misses={s['misses']} hit_rate={self.hit_rate():.1%} "
+                f"stores={s['stores']} discards={s['discards']} entries={len(self._entries)} "
+                f"saved~{s['saved_ms'] / 1000:.1f}s/{s['saved_llm_calls']} LLM calls")
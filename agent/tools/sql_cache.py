@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional
+
+MAX_BYTES = int(float(os.environ.get("SQL_CACHE_MAX_MB", "32")) * 1024 * 1024)
+
+# Strings, quoted identifiers, comments, words, numbers, multi-char operators, anything else
+TOKEN_PATTERN = re.compile(r"""
+    '(?:[^']|'')*'            |
+    "(?:[^"]|"")*"            |
+    `[^`]*`                   |
+    \[[^\]]*\]                |
+    --[^\n]*                  |
+    /\*.*?\*/                 |
+    [A-Za-z_][A-Za-z0-9_$]*   |
+    \d+(?:\.\d*)?(?:[eE][+-]?\d+)? |
+    \.\d+                     |
+    <=|>=|<>|!=|==|\|\|       |
+    \S
+""", re.VERBOSE | re.DOTALL)
+
+# Words that can follow a table name in a FROM clause and therefore are never aliases
+NOT_ALIASES = {
+    "on", "using", "where", "group", "order", "limit", "having", "join", "inner", "left", "right",
+    "full", "outer", "cross", "natural", "union", "except", "intersect", "window", "as", "indexed",
+    "not", "select", "from", "values",
+}
+# Keywords that end a FROM clause at the current nesting level
+END_OF_FROM = {"where", "group", "order", "limit", "having", "union", "except", "intersect", "window"}
+
+
+def _is_word(token: str) -> bool:
+    return token[0].isalpha() or token[0] == "_"
+
+
+def _tokenize(sql: str) -> List[str]:
+    """SQL tokens without comments, words lowercased (string literals untouched)."""
+    tokens = [t for t in TOKEN_PATTERN.findall(sql.strip()) if not t.startswith(("--", "/*"))]
+    tokens = [t.lower() if _is_word(t) else t for t in tokens]
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return tokens
+
+
+def _find_tables(tokens: List[str]) -> List[Tuple[int, Optional[int], Optional[int]]]:
+    """
+    Finds "FROM/JOIN/, <table> [AS] <alias>" inside FROM clauses, tracking paren depth.
+    Returns (table position, alias position or None, AS position or None) per table.
+    """
+    found = []
+    in_from = [False]
+    for i, token in enumerate(tokens):
+        if token == "(":
+            in_from.append(False)
+        elif token == ")":
+            if len(in_from) > 1:
+                in_from.pop()
+        elif token in ("from", "join"):
+            in_from[-1] = True
+        elif token in END_OF_FROM:
+            in_from[-1] = False
+
+        if not in_from[-1] or token not in ("from", "join", ","):
+            continue
+        j = i + 1
+        if j >= len(tokens) or not (_is_word(tokens[j]) or tokens[j][0] in "\"`["):
+            continue
+        table = j
+        j += 1
+        if j < len(tokens) and tokens[j] == ".":
+            # schema.table
+            table = j + 1
+            j += 2
+        as_position = None
+        if j < len(tokens) and tokens[j] == "as":
+            as_position = j
+            j += 1
+        if j < len(tokens) and _is_word(tokens[j]) and tokens[j] not in NOT_ALIASES:
+            found.append((table, j, as_position))
+        else:
+            found.append((table, None, None))
+    return found
+
+
+def _unquote(name: str) -> str:
+    if name[0] in "\"`[":
+        return name[1:-1]
+    return name
+
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """Maps every alias (and every unaliased table name) in FROM clauses to its table, lowercased."""
+    tokens = _tokenize(sql)
+    aliases = {}
+    for table, alias, _ in _find_tables(tokens):
+        name = _unquote(tokens[table]).lower()
+        aliases.setdefault(tokens[alias] if alias is not None else name, name)
+    return aliases
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical form of a query for cache keys: comments dropped, whitespace collapsed,
+    keywords/identifiers lowercased (string literals untouched) and table aliases
+    renamed to #t1, #t2, ... in order of appearance. Column aliases are kept, since
+    they name the output columns.
+    """
+    tokens = _tokenize(sql)
+
+    aliases = {}
+    for _, alias, as_position in _find_tables(tokens):
+        if alias is None or tokens[alias] in aliases:
+            continue
+        # '#' keeps canonical aliases from colliding with real table names
+        aliases[tokens[alias]] = (alias, f"#t{len(aliases) + 1}")
+        if as_position is not None:
+            tokens[as_position] = None
+
+    if aliases:
+        declared = {position for position, _ in aliases.values()}
+        for i, token in enumerate(tokens):
+            if token in aliases and (i in declared or (i + 1 < len(tokens) and tokens[i + 1] == ".")):
+                tokens[i] = aliases[token][1]
+
+    return " ".join(t for t in tokens if t is not None)
+
+
+class ResultCache:
+    """
+    In-memory LRU cache of query results keyed on normalized SQL, bounded by the
+    approximate size of the cached rows. The owner passes the current DB version
+    with every call; any change drops all entries.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.version = version
+
+    def get(self, key, version) -> Optional[dict]:
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key, version, entry: dict, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)["size"]
+            entry["size"] = size
+            self._entries[key] = entry
+            self._bytes += size
+            self.stats["stores"] += 1
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"hits={s['hits']} misses={s['misses']} hit_rate={self.hit_rate():.1%} "
+                f"entries={len(self._entries)} bytes={self._bytes} evictions={s['evictions']} "
+                f"invalidations={s['invalidations']}")
@@ -0,0 +1,310 @@
+import re
+import threading
+from typing import List, Dict, Optional, Tuple, Any
+
+from agent.tools.sql_cache import table_aliases
+from agent.tools.sql_validator import parse_schema, QUALIFIED_COLUMN
+
+# Rule passes per failed query; each pass starts from the error the previous one left
+MAX_ROUNDS = 3
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+# Clauses that end the FROM/JOIN list of a simple query
+FROM_END = re.compile(r"\b(WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT)\b", re.IGNORECASE)
+
+# Table names the model invents -> the view that exists (matched case-insensitively)
+TABLE_NAMES = {
+    "order details": "order_items", "orderdetails": "order_items", "order_details": "order_items",
+    "orderitems": "order_items", "order_item": "order_items", "orderitem": "order_items",
+    "order": "orders", "category": "categories", "product": "products", "customer": "customers",
+}
+# Base tables queried under a view's name in the schema text
+SAME_TABLES = {"order details": "order_items"}
+
+# How to bring a table into a query: (standard alias, table it hangs off, join condition)
+JOIN_PATHS = {
+    "categories": ("c", "products", "{from}.CategoryID = {alias}.CategoryID"),
+    "products": ("p", "order_items", "{from}.ProductID = {alias}.ProductID"),
+    "orders": ("o", "order_items", "{from}.OrderID = {alias}.OrderID"),
+    "customers": ("cust", "orders", "{from}.CustomerID = {alias}.CustomerID"),
+}
+
+# Which table an ambiguous bare column means when several joined tables have it: sale
+# price/quantity/discount are per order line (products.UnitPrice is the list price);
+# join keys are equal across the inner joins of JOIN_PATHS, so any owner will do
+AMBIGUOUS_OWNERS = {"unitprice": "order_items", "quantity": "order_items", "discount": "order_items"}
+JOIN_KEYS = {"orderid", "productid", "categoryid", "customerid"}
+OUTER_JOIN = re.compile(r"\b(LEFT|RIGHT|FULL|CROSS)\b", re.IGNORECASE)
+
+# Functions from other SQL dialects -> SQLite
+FUNCTIONS = [
+    (re.compile(r"\bYEAR\s*\(", re.IGNORECASE), "CAST(strftime('%Y', "),
+    (re.compile(r"\bMONTH\s*\(", re.IGNORECASE), "CAST(strftime('%m', "),
+    (re.compile(r"\bDAY\s*\(", re.IGNORECASE), "CAST(strftime('%d', "),
+]
+RENAMED_FUNCTIONS = {"isnull": "IFNULL", "len": "LENGTH", "getdate": "DATETIME", "now": "DATETIME"}
+
+DATE_LITERAL = re.compile(r"\b(?:DATE|TIMESTAMP)\s+('\d{4}-\d{2}-\d{2}[^']*')|#(\d{4}-\d{2}-\d{2}[^#]*)#", re.IGNORECASE)
+BETWEEN = re.compile(
+    r"([A-Za-z_][\w.]*)\s+BETWEEN\s+('(?:[^']|'')*'|[\d.]+)\s+AND\s+('(?:[^']|'')*'|[\d.]+)", re.IGNORECASE)
+# Errors the date rule answers: a DATE/TIMESTAMP/#...# literal SQLite cannot parse, or BETWEEN
+DATE_ERROR = re.compile(r"BETWEEN|\bDATE\b|TIMESTAMP|#|'\d{4}-\d{2}-\d{2}", re.IGNORECASE)
+TOP_N = re.compile(r"^(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s*\(?\s*(\d+)\s*\)?\s+", re.IGNORECASE)
+
+
+def _masked(sql: str) -> str:
+    """`sql` with string literals blanked (same length), so patterns never match inside them."""
+    return STRING_LITERAL.sub(lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", sql)
+
+
+def _is_simple(sql: str) -> bool:
+    """One SELECT without subqueries: the only shape the join-adding rule edits."""
+    return len(re.findall(r"\bSELECT\b", _masked(sql), re.IGNORECASE)) == 1
+
+
+class SQLRepairer:
+    """
+    Rule-based fixes for mechanical SQL failures, tried before another LLM round-trip.
+
+    repair(sql, error) applies every rule that matches the query and the SQLite or
+    validator error and returns the rewritten query with the names of the rules used.
+    fix() does that, validates (with a `validator`) and executes the result, and
+    repairs again from the new error for up to MAX_ROUNDS. Per-rule fix rates are kept
+    in `stats`: how often a rule was applied, and how often the query then ran.
+    """
+
+    def __init__(self, db_tool, schema_text: str, validator=None):
+        self.db_tool = db_tool
+        self.validator = validator
+        self.schema = parse_schema(schema_text)
+        self._lock = threading.Lock()
+        self.stats = {"failures": 0, "attempted": 0, "repaired": 0, "rules": {}}
+        # (name, rule) in application order; each rule returns the rewritten SQL or None
+        self.rules = [
+            ("markdown", self._markdown),
+            ("table_name", self._table_name),
+            ("functions", self._functions),
+            ("top_n", self._top_n),
+            ("dates", self._dates),
+            ("column_table", self._column_table),
+            ("ambiguous_column", self._ambiguous_column),
+        ]
+
+    def repair(self, sql: str, error: str) -> Tuple[str, List[str]]:
+        """Returns (rewritten SQL, names of the rules that changed it); no rules means no fix."""
+        applied = []
+        for name, rule in self.rules:
+            try:
+                fixed = rule(sql, error)
+            except (IndexError, KeyError, ValueError):
+                fixed = None
+            if fixed and fixed.strip() != sql.strip():
+                sql, applied = fixed.strip(), applied + [name]
+        return sql, applied
+
+    def fix(self, sql: str, error: str) -> Tuple[str, Optional[Any], List[str]]:
+        """
+        Returns (rewritten SQL, its QueryResult, rules used) once a rewrite runs, or
+        (sql, None, rules tried) when no rule applies or the rewrites keep failing.
+        """
+        rules = []
+        for _ in range(MAX_ROUNDS):
+            sql, applied = self.repair(sql, error)
+            if not applied:
+                break
+            rules.extend(r for r in applied if r not in rules)
+            if self.validator is not None:
+                validation = self.validator.validate(sql, record=False)
+                if not validation.ok:
+                    error = validation.render()
+                    continue
+            result = self.db_tool.execute(sql)
+            if result.ok:
+                self.record(rules, True)
+                return sql, result, rules
+            error = result.error
+        self.record(rules, False)
+        return sql, None, rules
+
+    def record(self, rules: List[str], fixed: bool):
+        """Outcome for one failed query: the rules that rewrote it (if any) and whether it then ran."""
+        with self._lock:
+            self.stats["failures"] += 1
+            self.stats["attempted"] += bool(rules)
+            if fixed:
+                self.stats["repaired"] += 1
+            for name in rules:
+                counts = self.stats["rules"].setdefault(name, {"applied": 0, "fixed": 0})
+                counts["applied"] += 1
+                counts["fixed"] += fixed
+
+    # --- Rules -------------------------------------------------------------------------
+
+    def _markdown(self, sql: str, error: str) -> Optional[str]:
+        """Fences, language tags, DSPy field markers, prose around the query, trailing statements."""
+        text = re.sub(r"\[\[ ## \w+ ## \]\]", " ", sql)
+        text = text.replace("```sql", " ").replace("```SQL", " ").replace("```", " ").replace("`", "")
+        start = re.search(r"\b(SELECT|WITH)\b", text, re.IGNORECASE)
+        if not start:
+            return None
+        text = text[start.start():]
+        # Everything after the first statement (a second query or an explanation)
+        masked = _masked(text)
+        end = masked.find(";")
+        if end != -1:
+            text = text[:end]
+        else:
+            # Prose after the query starts on its own line with a capital letter
+            prose = re.search(r"\n\s*\n\s*[A-Z][a-z]+\s", masked)
+            if prose:
+                text = text[:prose.start()]
+        return text.strip()
+
+    def _table_name(self, sql: str, error: str) -> Optional[str]:
+        """`Order Details` unquoted, OrderDetails, order_details, Category ... -> the real view names."""
+        if "no such table" not in error and "syntax" not in error and "unknown_table" not in error:
+            return None
+
+        def replace(match):
+            name = re.sub(r"\s+", " ", match.group(2)).strip("\"`[]")
+            if name.lower() in self.schema:
+                return match.group(0)
+            return f"{match.group(1)} {TABLE_NAMES.get(name.lower(), match.group(2))}"
+
+        names = "|".join(sorted((re.escape(n).replace(r"\ ", r"\s+") for n in TABLE_NAMES), key=len, reverse=True))
+        return re.sub(rf"\b(FROM|JOIN)\s+([\"`\[]?(?:{names})[\"`\]]?)(?=\s|$|,|\))", replace, sql, flags=re.IGNORECASE)
+
+    def _functions(self, sql: str, error: str) -> Optional[str]:
+        """YEAR(x)/MONTH(x)/DAY(x) -> strftime, ISNULL/LEN/GETDATE/NOW -> SQLite names."""
+        if "no such function" not in error:
+            return None
+        fixed = sql
+        for pattern, replacement in FUNCTIONS:
+            while True:
+                masked = _masked(fixed)
+                match = pattern.search(masked)
+                if not match:
+                    break
+                # Find the closing paren of the call and turn it into "...) AS INTEGER)"
+                depth, i = 1, match.end()
+                while depth and i < len(masked):
+                    depth += {"(": 1, ")": -1}.get(masked[i], 0)
+                    i += 1
+                if depth:
+                    return None
+                fixed = fixed[:match.start()] + replacement + fixed[match.end():i - 1] + ") AS INTEGER)" + fixed[i:]
+        for name, replacement in RENAMED_FUNCTIONS.items():
+            fixed = re.sub(rf"\b{name}\s*\(\s*\)" if name in ("getdate", "now") else rf"\b{name}\s*\(",
+                           f"{replacement}('now')" if name in ("getdate", "now") else f"{replacement}(",
+                           fixed, flags=re.IGNORECASE)
+        return fixed
+
+    def _top_n(self, sql: str, error: str) -> Optional[str]:
+        """SELECT TOP n ... -> SELECT ... LIMIT n."""
+        match = TOP_N.match(sql)
+        if not match or re.search(r"\bLIMIT\b", _masked(sql), re.IGNORECASE):
+            return None
+        return f"{match.group(1)}{sql[match.end():].rstrip().rstrip(';')} LIMIT {match.group(2)}"
+
+    def _dates(self, sql: str, error: str) -> Optional[str]:
+        """
+        DATE '...' / #...# literals -> plain strings; x BETWEEN a AND b -> x >= a AND x <= b
+        (the house style). Only for date or BETWEEN errors; NOT BETWEEN is left alone.
+        """
+        if not DATE_ERROR.search(error):
+            return None
+
+        def between(match):
+            if match.group(1).upper() == "NOT":
+                return match.group(0)
+            return f"{match.group(1)} >= {match.group(2)} AND {match.group(1)} <= {match.group(3)}"
+
+        fixed = DATE_LITERAL.sub(lambda m: m.group(1) or f"'{m.group(2)}'", sql)
+        return BETWEEN.sub(between, fixed)
+
+    def _column_table(self, sql: str, error: str) -> Optional[str]:
+        """
+        alias.Column where the alias's table has no such column: use the alias of the joined
+        table that has it (AMBIGUOUS_OWNERS decides between several, otherwise the column is
+        left alone), or join the table that has it (e.g. p.CategoryName -> join categories c
+        and read c.CategoryName).
+        """
+        if "column" not in error:
+            return None
+        aliases = {a: SAME_TABLES.get(t, t) for a, t in table_aliases(sql).items()}
+        fixed = sql
+        for alias, column in dict.fromkeys(QUALIFIED_COLUMN.findall(_masked(sql))):
+            table = aliases.get(alias.lower())
+            if table not in self.schema or column.lower() in (c.lower() for c in self.schema[table]):
+                continue
+            owners = [t for t, cols in self.schema.items() if column.lower() in (c.lower() for c in cols)]
+            joined = [a for a, t in aliases.items() if t in owners]
+            preferred = [a for a in joined if aliases[a] == AMBIGUOUS_OWNERS.get(column.lower())]
+            if preferred or len(joined) == 1:
+                target = (preferred or joined)[0]
+            elif joined:
+                # Several joined tables have it and none is the known owner: no safe guess
+                continue
+            else:
+                target = None
+                for owner in owners:
+                    if owner in JOIN_PATHS:
+                        fixed, target = self._add_join(fixed, aliases, owner)
+                        if target:
+                            aliases[target] = owner
+                            break
+                if not target:
+                    continue
+            fixed = re.sub(rf"(?<![\w.]){re.escape(alias)}\.{re.escape(column)}\b", f"{target}.{column}", fixed)
+        return fixed
+
+    def _add_join(self, sql: str, aliases: Dict[str, str], table: str) -> Tuple[str, Optional[str]]:
+        """Adds "JOIN table alias ON ..." after the FROM/JOIN list; returns (sql, alias) or (sql, None)."""
+        alias, parent, condition = JOIN_PATHS[table]
+        parents = [a for a, t in aliases.items() if t == parent]
+        if not parents or not _is_simple(sql):
+            return sql, None
+        while alias in aliases:
+            alias += "2"
+        join = f" JOIN {table} {alias} ON {condition.format(**{'from': parents[0], 'alias': alias})}"
+        end = FROM_END.search(_masked(sql))
+        position = end.start() if end else len(sql.rstrip().rstrip(";"))
+        return f"{sql[:position].rstrip()}{join} {sql[position:].lstrip()}".strip(), alias
+
+    def _ambiguous_column(self, sql: str, error: str) -> Optional[str]:
+        """
+        ambiguous column name: X -> qualify bare X with the table it unambiguously means
+        (AMBIGUOUS_OWNERS, or any owner of an inner-join key); other columns are left alone.
+        """
+        match = re.search(r"ambiguous column name: (?:\w+\.)?(\w+)", error)
+        if not match:
+            return None
+        column = match.group(1)
+        aliases = {a: SAME_TABLES.get(t, t) for a, t in table_aliases(sql).items()}
+        owners = [a for a, t in aliases.items() if column.lower() in (c.lower() for c in self.schema.get(t, []))]
+        preferred = AMBIGUOUS_OWNERS.get(column.lower())
+        if preferred is not None:
+            owner = next((a for a in owners if aliases[a] == preferred), None)
+        elif column.lower() in JOIN_KEYS and not OUTER_JOIN.search(_masked(sql)):
+            owner = owners[0] if owners else None
+        else:
+            owner = owners[0] if len(owners) == 1 else None
+        if owner is None:
+            return None
+        masked = _masked(sql)
+        # Bare occurrences: not qualified, not a qualifier, not an output alias ("AS OrderID")
+        pattern = re.compile(rf"(?<![\w.])(?<!AS )(?<!as ){re.escape(column)}\b(?!\s*\.)(?!\s*\()", re.IGNORECASE)
+        positions = [m.start() for m in pattern.finditer(masked)]
+        for position in reversed(positions):
+            sql = f"{sql[:position]}{owner}.{sql[position:]}"
+        return sql
+
+    def fix_rate(self) -> float:
+        return self.stats["repaired"] / self.stats["failures"] if self.stats["failures"] else 0.0
+
+    def summary(self) -> str:
+        s = self.stats
+        rules = ", ".join(f"{name} {c['fixed']}/{c['applied']}"
+                          for name, c in sorted(s["rules"].items(), key=lambda kv: -kv[1]["fixed"])) or "none"
+        return (f"repaired {s['repaired']}/{s['failures']} failures ({self.fix_rate():.0%}, "
+                f"{s['repaired']} LLM repair calls saved); rules fixed/applied: {rules}")
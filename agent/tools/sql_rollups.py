@@ -0,0 +1,643 @@
+"""
+Pre-aggregated rollups of the order lines at (month x category), (month x product) and
+(month x customer) grain, and a router that answers aggregate queries from them.
+
+Each rollup row holds one (Month, Segment, key) bucket. Month is strftime('%Y-%m', OrderDate);
+Segment splits the month at its last day L so that date bounds on the raw OrderDate
+strings stay exact even when OrderDate has a time of day:
+0 = OrderDate < L, 1 = OrderDate = L, 2 = later on L ('2017-06-30 10:00:00').
+
+The router only rewrites a query when every part of it maps onto rollup columns with the
+same result (see RollupRouter.rewrite); anything else runs against the base tables.
+"""
+import calendar
+import json
+import re
+import sqlite3
+from typing import List, Dict, Optional, Tuple
+
+from agent.tools.sql_cache import TOKEN_PATTERN
+
+MONTH_SQL = "strftime('%Y-%m', o.OrderDate)"
+LAST_DAY_SQL = "date(o.OrderDate, 'start of month', '+1 month', '-1 day')"
+SEGMENT_SQL = f"CASE WHEN o.OrderDate < {LAST_DAY_SQL} THEN 0 WHEN o.OrderDate = {LAST_DAY_SQL} THEN 1 ELSE 2 END"
+GROSS_SQL = "od.UnitPrice * od.Quantity"
+NET_SQL = "od.UnitPrice * od.Quantity * (1 - COALESCE(od.Discount, 0))"
+
+# Line measures: Orders counts distinct orders in the bucket, LineFreight is o.Freight
+# summed once per order line (what SUM(o.Freight) gives over the order_items join)
+LINE_MEASURES = f"""
+    SUM({GROSS_SQL}) AS Gross, SUM({NET_SQL}) AS Net, SUM(od.Quantity) AS Quantity,
+    COUNT(*) AS Lines, COUNT(DISTINCT o.OrderID) AS Orders, SUM(o.Freight) AS LineFreight
+"""
+ROLLUPS = {
+    "rollup_month_category": ("CategoryID", f"""
+        SELECT {MONTH_SQL} AS Month, {SEGMENT_SQL} AS Segment, p.CategoryID AS CategoryID, {LINE_MEASURES}
+        FROM "Order Details" od
+        JOIN Orders o ON o.OrderID = od.OrderID
+        JOIN Products p ON p.ProductID = od.ProductID
+        {{where}}
+        GROUP BY 1, 2, 3
+    """),
+    "rollup_month_product": ("ProductID", f"""
+        SELECT {MONTH_SQL} AS Month, {SEGMENT_SQL} AS Segment, od.ProductID AS ProductID, {LINE_MEASURES}
+        FROM "Order Details" od
+        JOIN Orders o ON o.OrderID = od.OrderID
+        {{where}}
+        GROUP BY 1, 2, 3
+    """),
+    # Built per order so it also covers orders without lines: AllOrders and Freight are
+    # per order (what COUNT/SUM(o.Freight) give over orders alone)
+    "rollup_month_customer": ("CustomerID", f"""
+        SELECT {MONTH_SQL} AS Month, {SEGMENT_SQL} AS Segment, o.CustomerID AS CustomerID,
+               SUM(l.Gross) AS Gross, SUM(l.Net) AS Net, SUM(l.Quantity) AS Quantity,
+               SUM(l.Lines) AS Lines, COUNT(l.Lines) AS Orders, SUM(o.Freight * l.Lines) AS LineFreight,
+               COUNT(*) AS AllOrders, SUM(o.Freight) AS Freight
+        FROM Orders o
+        LEFT JOIN (
+            SELECT od.OrderID, SUM({GROSS_SQL}) AS Gross, SUM({NET_SQL}) AS Net,
+                   SUM(od.Quantity) AS Quantity, COUNT(*) AS Lines
+            FROM "Order Details" od GROUP BY od.OrderID
+        ) l ON l.OrderID = o.OrderID
+        {{where}}
+        GROUP BY 1, 2, 3
+    """),
+}
+DIMENSION_TABLES = ["Categories", "Products", "Customers"]
+
+# Table (or view) name -> role in a query
+TABLE_ROLES = {
+    "order_items": "lines", "order details": "lines", "orders": "orders",
+    "products": "products", "categories": "categories", "customers": "customers",
+}
+# The only join conditions the rollups reproduce
+JOIN_EDGES = {
+    frozenset([("lines", "orderid"), ("orders", "orderid")]),
+    frozenset([("lines", "productid"), ("products", "productid")]),
+    frozenset([("products", "categoryid"), ("categories", "categoryid")]),
+    frozenset([("orders", "customerid"), ("customers", "customerid")]),
+}
+ROLE_ROLLUP = {"categories": "rollup_month_category", "products": "rollup_month_product",
+               "customers": "rollup_month_customer"}
+# Order/line columns that are rollup keys
+KEY_COLUMNS = {("lines", "productid"): "rollup_month_product", ("orders", "customerid"): "rollup_month_customer"}
+
+KEYWORDS = {
+    "distinct", "and", "or", "not", "in", "like", "glob", "is", "null", "between", "case", "when", "then", "else",
+    "end", "cast", "as", "escape", "collate", "nocase", "integer", "real", "text", "numeric",
+}
+SCALAR_FUNCTIONS = {"round", "abs", "coalesce", "ifnull", "nullif", "cast", "lower", "upper", "trim", "length"}
+# What strftime('%Y-%m' / '%Y', OrderDate) becomes over a rollup
+MONTH_REFS = ("r.Month", "substr(r.Month, 1, 4)")
+DATE_LITERAL = re.compile(r"^'(\d{4})-(\d{2})-(\d{2})'$")
+FLIPPED = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "=": "=", "==": "="}
+
+
+def _measure_patterns(discount_not_null: bool) -> Dict[Tuple[str, str], str]:
+    """(aggregate, canonical argument) -> measure; argument refs are written role.column."""
+    gross = ["lines.unitprice * lines.quantity", "lines.quantity * lines.unitprice"]
+    discounts = ["coalesce ( lines.discount , 0 )", "ifnull ( lines.discount , 0 )"]
+    if discount_not_null:
+        discounts.append("lines.discount")
+    net = [f"{g} * ( 1 - {d} )" for g in gross for d in discounts]
+    net += [f"( {g} ) * ( 1 - {d} )" for g in gross for d in discounts]
+    patterns = {("sum", g): "gross" for g in gross}
+    patterns.update({("sum", n): "net" for n in net})
+    patterns.update({
+        ("sum", "lines.quantity"): "quantity",
+        ("count", "*"): "rows",
+        ("count", "lines.orderid"): "rows",
+        ("count", "orders.orderid"): "rows",
+        ("count", "distinct orders.orderid"): "orders",
+        ("count", "distinct lines.orderid"): "orders",
+        ("sum", "orders.freight"): "freight",
+    })
+    return patterns
+
+
+def _bucket_months(conn: sqlite3.Connection, since_order_id: int):
+    """Months (NULL included) touched by orders newer than `since_order_id`."""
+    return [m for (m,) in conn.execute(
+        "SELECT DISTINCT strftime('%Y-%m', OrderDate) FROM Orders WHERE OrderID > ?", (since_order_id,))]
+
+
+def refresh_rollups(conn: sqlite3.Connection, since_order_id: Optional[int] = None):
+    """
+    (Re)computes the rollups from the base tables. With `since_order_id`, only the months
+    touched by newer orders are recomputed (their buckets are replaced, so rows added to
+    an old month are still exact).
+    """
+    where, params = "", ()
+    if since_order_id is not None:
+        months = _bucket_months(conn, since_order_id)
+        if not months:
+            return
+        where = ("WHERE COALESCE(strftime('%Y-%m', o.OrderDate), '') IN "
+                 f"({', '.join('?' * len(months))})")
+        params = tuple(m or "" for m in months)
+
+    for table, (key, select) in ROLLUPS.items():
+        sql = select.format(where=where)
+        if since_order_id is None:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE {table} AS {sql}", params)
+            conn.execute(f"CREATE INDEX idx_{table} ON {table} (Month, Segment, {key})")
+        else:
+            conn.execute(f"DELETE FROM {table} WHERE COALESCE(Month, '') IN ({', '.join('?' * len(params))})",
+                         params)
+            conn.execute(f"INSERT INTO {table} {sql}", params)
+
+    # Facts the router needs to prove a rewrite exact
+    dates_aligned = not conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM Orders WHERE OrderDate IS NOT NULL AND (typeof(OrderDate) != 'text' "
+        "OR strftime('%Y-%m', OrderDate) IS NULL OR substr(OrderDate, 1, 8) != strftime('%Y-%m', OrderDate) || '-'))"
+    ).fetchone()[0]
+    discount_not_null = not conn.execute(
+        'SELECT EXISTS (SELECT 1 FROM "Order Details" WHERE Discount IS NULL)').fetchone()[0]
+    unique_columns = {}
+    for table in DIMENSION_TABLES:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info('{table}')")]
+        unique_columns[table.lower()] = [
+            c.lower() for c in columns
+            if conn.execute(f'SELECT COUNT(DISTINCT "{c}") = COUNT(*) AND COUNT("{c}") = COUNT(*) FROM {table}'
+                            ).fetchone()[0]
+        ]
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT OR REPLACE INTO rollup_meta VALUES (?, ?)", [
+        ("dates_aligned", json.dumps(dates_aligned)),
+        ("discount_not_null", json.dumps(discount_not_null)),
+        ("unique_columns", json.dumps(unique_columns)),
+    ])
+
+
+class _NoRoute(Exception):
+    """The query (or part of it) has no exact rollup equivalent."""
+
+
+class _Token:
+    __slots__ = ("text", "value", "start", "end")
+
+    def __init__(self, match):
+        self.text = match.group()
+        self.value = self.text.lower() if _is_name(self.text) else self.text
+        self.start, self.end = match.span()
+
+
+def _is_name(text: str) -> bool:
+    return text[0].isalpha() or text[0] == "_"
+
+
+def _split(tokens: List[_Token], separator: str) -> List[List[_Token]]:
+    """Splits on `separator` at paren depth 0 (the AND of BETWEEN ... AND stays put)."""
+    parts, current, depth, between = [], [], 0, False
+    for t in tokens:
+        if t.value == "(":
+            depth += 1
+        elif t.value == ")":
+            depth -= 1
+        elif depth == 0 and t.value == "between":
+            between = True
+        elif depth == 0 and t.value == separator:
+            if separator == "and" and between:
+                between = False
+            else:
+                parts.append(current)
+                current = []
+                continue
+        current.append(t)
+    parts.append(current)
+    return parts
+
+
+def _closing(tokens: List[_Token], open_index: int) -> int:
+    depth = 0
+    for j in range(open_index, len(tokens)):
+        if tokens[j].value == "(":
+            depth += 1
+        elif tokens[j].value == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    raise _NoRoute("unbalanced parentheses")
+
+
+def _clauses(tokens: List[_Token]) -> Dict[str, List[_Token]]:
+    """Top-level SELECT/FROM/WHERE/GROUP BY/HAVING/ORDER BY/LIMIT token lists."""
+    order = ["select", "from", "where", "group", "having", "order", "limit"]
+    clauses, current, depth, i = {}, None, 0, 0
+    while i < len(tokens):
+        t = tokens[i]
+        if t.value == "(":
+            depth += 1
+        elif t.value == ")":
+            depth -= 1
+        elif depth == 0 and t.value in ("union", "except", "intersect", "window", "with", "distinct"):
+            raise _NoRoute(t.value)
+        elif depth == 0 and t.value in order:
+            if current and order.index(t.value) <= order.index(current):
+                raise _NoRoute("clause order")
+            current = t.value
+            clauses[current] = []
+            if t.value in ("group", "order"):
+                if i + 1 >= len(tokens) or tokens[i + 1].value != "by":
+                    raise _NoRoute(f"{t.value} without by")
+                i += 1
+            i += 1
+            continue
+        if current is None:
+            raise _NoRoute("not a SELECT")
+        clauses[current].append(t)
+        i += 1
+    if not clauses.get("select") or not clauses.get("from"):
+        raise _NoRoute("no SELECT ... FROM")
+    return clauses
+
+
+class RollupRouter:
+    """
+    Rewrites aggregate queries over order_items/orders (+ products, categories, customers)
+    onto the rollup tables. A query is routed only when:
+
+    - FROM is an inner-join tree over those tables on their keys;
+    - every aggregate is a stored measure (revenue, net revenue, quantity, line/order
+      counts, freight), and columns outside aggregates come from the dimension tables,
+      the rollup key or strftime('%Y-%m' / '%Y', OrderDate), and are grouped on;
+    - OrderDate is only compared with month boundaries ('YYYY-MM-01' with >= or <,
+      a month's last day with any comparison), which Month/Segment cover exactly;
+    - distinct order counts are only summed over buckets that cannot share an order.
+
+    Results equal the base-table query up to floating-point summation order.
+    """
+
+    def __init__(self, dates_aligned: bool, discount_not_null: bool, unique_columns: Dict[str, List[str]]):
+        self.dates_aligned = dates_aligned
+        self.measures = _measure_patterns(discount_not_null)
+        self.unique_columns = {table: set(columns) for table, columns in unique_columns.items()}
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> Optional["RollupRouter"]:
+        """The router for this DB, or None if it has no rollups (e.g. the raw source file)."""
+        try:
+            meta = {k: json.loads(v) for k, v in conn.execute("SELECT key, value FROM rollup_meta")}
+            for table in ROLLUPS:
+                conn.execute(f"SELECT 1 FROM {table} LIMIT 0").fetchall()
+        except sqlite3.Error:
+            return None
+        return cls(meta["dates_aligned"], meta["discount_not_null"], meta["unique_columns"])
+
+    def rewrite(self, sql_query: str) -> Optional[Tuple[str, str]]:
+        """(rewritten SQL, rollup table) when the query can be answered from a rollup, else None."""
+        try:
+            return _Rewrite(self, sql_query).run()
+        except _NoRoute:
+            return None
+
+
+class _Rewrite:
+    """Parses and rewrites one query; holds the per-query state."""
+
+    def __init__(self, router: RollupRouter, sql_query: str):
+        self.router = router
+        self.sql = sql_query
+        self.select_aliases = set()
+
+    def run(self) -> Tuple[str, str]:
+        tokens = [_Token(m) for m in TOKEN_PATTERN.finditer(self.sql.strip())]
+        if any(t.value.startswith(("--", "/*")) for t in tokens):
+            raise _NoRoute("comment")
+        while tokens and tokens[-1].value == ";":
+            tokens.pop()
+        clauses = _clauses(tokens)
+
+        self.tables = self._parse_from(clauses["from"])
+        self.aliases = {alias.lower(): role for role, (_, alias) in self.tables.items()}
+        if "orders" not in self.tables or "r" in self.aliases:
+            raise _NoRoute("needs orders")
+        self.shape = "lines" if "lines" in self.tables else "orders"
+
+        raw_items = [self._split_alias(item) for item in _split(clauses["select"], ",")]
+        self.select_aliases = {a.strip('"`[]').lower() for _, a in raw_items if a}
+        items = [(self._expression(tokens), alias, tokens) for tokens, alias in raw_items]
+        group_by = [self._group_item(e, items) for e in _split(clauses["group"], ",")] if "group" in clauses else []
+        where = [self._condition(c) for c in _split(clauses["where"], "and")] if "where" in clauses else []
+        having = self._expression(clauses["having"]) if "having" in clauses else None
+        order_by = [self._order_item(o) for o in _split(clauses["order"], ",")] if "order" in clauses else []
+
+        if not any(e["aggregates"] for e, _, _ in items):
+            raise _NoRoute("not an aggregate query")
+        grouped = {e["sql"] for e in group_by}
+        outputs = [e for e, _, _ in items] + ([having] if having else []) + [e for e, _ in order_by]
+        if any(ref not in grouped for e in outputs for ref in e["refs"]):
+            # SQLite would pick the value from an arbitrary row, which differs per table
+            raise _NoRoute("column neither grouped nor aggregated")
+
+        everything = outputs + group_by + where
+        rollup = self._choose_rollup(set().union(*(e["roles"] for e in everything)))
+        if "orders" in {m for e in outputs for m in e["aggregates"]}:
+            self._check_order_count(rollup, group_by, where)
+        return self._assemble(rollup, items, group_by, where, having, order_by, clauses.get("limit")), rollup
+
+    def _parse_from(self, tokens: List[_Token]) -> Dict[str, Tuple[_Token, str]]:
+        """role -> (table token, alias) for an inner-join tree joined on the usual keys."""
+        tables, aliases, i = {}, {}, 0
+        while i < len(tokens):
+            if tables:
+                if tokens[i].value == "inner":
+                    i += 1
+                if i >= len(tokens) or tokens[i].value != "join":
+                    raise _NoRoute("not an inner join")
+                i += 1
+            if i >= len(tokens):
+                raise _NoRoute("dangling join")
+            table = tokens[i]
+            name = table.value[1:-1].lower() if table.value[0] in "\"`[" else table.value
+            role = TABLE_ROLES.get(name)
+            if role is None or role in tables:
+                raise _NoRoute(f"table {name}")
+            i += 1
+            alias = table.text
+            if i < len(tokens) and tokens[i].value == "as":
+                i += 1
+            if i < len(tokens) and _is_name(tokens[i].value) and tokens[i].value not in ("join", "inner", "on"):
+                alias = tokens[i].text
+                i += 1
+            tables[role] = (table, alias)
+            aliases[alias.lower()] = role
+            if len(tables) == 1:
+                continue
+
+            on = tokens[i:i + 8]
+            if len(on) < 8 or on[0].value != "on" or [t.value for t in on[2::2]] != [".", "=", "."]:
+                raise _NoRoute("join condition")
+            sides = []
+            for alias_token, column_token in ((on[1], on[3]), (on[5], on[7])):
+                if alias_token.value not in aliases:
+                    raise _NoRoute("join alias")
+                sides.append((aliases[alias_token.value], column_token.value))
+            if frozenset(sides) not in JOIN_EDGES or role not in (sides[0][0], sides[1][0]):
+                raise _NoRoute("join condition")
+            i += 8
+        return tables
+
+    def _split_alias(self, tokens: List[_Token]):
+        """(expression tokens, alias text or None) for a select item."""
+        if len(tokens) > 2 and tokens[-2].value == "as":
+            return tokens[:-2], tokens[-1].text
+        if len(tokens) > 1 and (_is_name(tokens[-1].value) or tokens[-1].value[0] in "\"`[") \
+                and tokens[-1].value not in KEYWORDS and (tokens[-2].value == ")" or tokens[-2].value[0] == "'"
+                                                          or _is_name(tokens[-2].value)):
+            return tokens[:-1], tokens[-1].text
+        if len(tokens) == 1 and tokens[0].value == "*":
+            raise _NoRoute("SELECT *")
+        return tokens, None
+
+    def _column(self, tokens: List[_Token], i: int):
+        """(role, lowercased column, column text, next index) for a column reference at tokens[i]."""
+        t = tokens[i]
+        if i + 2 < len(tokens) and tokens[i + 1].value == "." and t.value in self.aliases:
+            column = tokens[i + 2]
+            return self.aliases[t.value], column.text.strip('"`[]').lower(), column.text, i + 3
+        following = tokens[i + 1].value if i + 1 < len(tokens) else None
+        if len(self.tables) == 1 and _is_name(t.value) and following not in ("(", ".") \
+                and t.value not in KEYWORDS and t.value not in self.select_aliases:
+            return next(iter(self.tables)), t.value, t.text, i + 1
+        return None
+
+    def _column_sql(self, role: str, column: str, text: str) -> Tuple[str, str]:
+        """(SQL over the rewritten FROM, role or rollup it needs) for a column outside aggregates."""
+        if role in ROLE_ROLLUP:
+            return f"{self.tables[role][1]}.{text}", role
+        if (role, column) in KEY_COLUMNS:
+            return f"r.{text}", KEY_COLUMNS[(role, column)]
+        raise _NoRoute(f"{role}.{column} outside an aggregate")
+
+    def _month(self, tokens: List[_Token], i: int):
+        """strftime('%Y-%m' | '%Y', OrderDate) at tokens[i] -> (rollup SQL, next index), or None."""
+        if tokens[i].value != "strftime" or i + 5 >= len(tokens) or tokens[i + 1].value != "(" \
+                or tokens[i + 3].value != ",":
+            return None
+        column = self._column(tokens, i + 4)
+        if not column or column[:2] != ("orders", "orderdate") or column[3] >= len(tokens) \
+                or tokens[column[3]].value != ")":
+            return None
+        if tokens[i + 2].text == "'%Y-%m'":
+            return MONTH_REFS[0], column[3] + 1
+        if tokens[i + 2].text == "'%Y'" and self.router.dates_aligned:
+            return MONTH_REFS[1], column[3] + 1
+        return None
+
+    def _expression(self, tokens: List[_Token], aggregates: bool = True) -> Dict:
+        """
+        Rewrites a scalar or aggregate expression. Aggregates become placeholders filled in
+        once the rollup is chosen; `refs` are the columns used outside aggregates.
+        """
+        if not tokens:
+            raise _NoRoute("empty expression")
+        out, measures, refs, roles, i = [], [], [], set(), 0
+        while i < len(tokens):
+            t = tokens[i]
+            following = tokens[i + 1].value if i + 1 < len(tokens) else None
+            month = self._month(tokens, i)
+            if month:
+                out.append(month[0])
+                refs.append(month[0])
+                i = month[1]
+                continue
+            if t.value in ("sum", "count") and following == "(":
+                if not aggregates:
+                    raise _NoRoute("aggregate outside SELECT/HAVING/ORDER BY")
+                end = _closing(tokens, i + 1)
+                measures.append(self._measure(t.value, tokens[i + 2:end]))
+                out.append(f"\x00{len(measures) - 1}\x00")
+                i = end + 1
+                continue
+            column = self._column(tokens, i)
+            if column:
+                sql, needs = self._column_sql(*column[:3])
+                out.append(sql)
+                refs.append(sql)
+                roles.add(needs)
+                i = column[3]
+                continue
+            if _is_name(t.value):
+                if following == "(" and t.value not in SCALAR_FUNCTIONS | KEYWORDS:
+                    raise _NoRoute(f"function {t.value}")
+                if following != "(" and t.value not in KEYWORDS and t.value not in self.select_aliases:
+                    raise _NoRoute(f"unresolved name {t.value}")
+            elif t.value[0] in "\"`[" and t.value[1:-1].lower() not in self.select_aliases:
+                raise _NoRoute(f"unresolved name {t.value}")
+            out.append(t.text)
+            i += 1
+        return {"sql": " ".join(out), "aggregates": measures, "refs": refs, "roles": roles, "pins": set()}
+
+    def _measure(self, function: str, argument: List[_Token]) -> str:
+        canonical, i = [], 0
+        while i < len(argument):
+            column = self._column(argument, i)
+            if column:
+                canonical.append(f"{column[0]}.{column[1]}")
+                i = column[3]
+            else:
+                canonical.append(argument[i].value)
+                i += 1
+        measure = self.router.measures.get((function, " ".join(canonical)))
+        if measure is None:
+            raise _NoRoute(f"{function}({' '.join(canonical)}) is not a stored measure")
+        if self.shape == "orders" and measure not in ("rows", "orders", "freight"):
+            raise _NoRoute("line measure without order lines")
+        return measure
+
+    def _group_item(self, tokens: List[_Token], items) -> Dict:
+        """A GROUP BY term; a select alias or ordinal stands for that select item's expression."""
+        if len(tokens) == 1:
+            name = tokens[0].value.strip('"`[]').lower()
+            for n, (expression, alias, _) in enumerate(items, 1):
+                if name == str(n) or (alias and name == alias.strip('"`[]').lower()):
+                    if expression["aggregates"]:
+                        raise _NoRoute("grouping on an aggregate")
+                    return expression
+        return self._expression(tokens, aggregates=False)
+
+    def _order_item(self, tokens: List[_Token]):
+        direction = ""
+        if tokens and tokens[-1].value in ("asc", "desc"):
+            direction, tokens = tokens[-1].text, tokens[:-1]
+        if len(tokens) == 1 and tokens[0].value.isdigit():
+            return {"sql": tokens[0].text, "aggregates": [], "refs": [], "roles": set(), "pins": set()}, direction
+        return self._expression(tokens), direction
+
+    def _condition(self, tokens: List[_Token]) -> Dict:
+        """A WHERE conjunct: an OrderDate/month bound (rewritten onto Month/Segment) or a dimension filter."""
+        bound = self._date_bound(tokens)
+        if bound:
+            return {"sql": bound, "aggregates": [], "refs": [], "roles": set(), "pins": set()}
+        condition = self._expression(tokens, aggregates=False)
+        column = self._column(tokens, 0)
+        if column and column[3] == len(tokens) - 2 and tokens[-2].value in ("=", "==") \
+                and tokens[-1].value[0] in "'0123456789":
+            # col = literal: at most one dimension row when col is unique
+            condition["pins"].add(condition["refs"][0].lower())
+        condition["refs"] = []
+        return condition
+
+    def _date_bound(self, tokens: List[_Token]) -> Optional[str]:
+        """OrderDate <op> 'YYYY-MM-DD' (either side), OrderDate BETWEEN, or month/year <op> literal."""
+        month = self._month(tokens, 0)
+        if month and month[1] == len(tokens) - 2 and tokens[-2].value in ("=", "==", "!=", "<>", "<", "<=", ">", ">=") \
+                and tokens[-1].value[0] == "'":
+            return f"{month[0]} {tokens[-2].text} {tokens[-1].text}"
+
+        column = self._column(tokens, 0)
+        if column and column[:2] == ("orders", "orderdate"):
+            rest = tokens[column[3]:]
+            if len(rest) == 2 and rest[0].value in FLIPPED:
+                return self._bound(rest[0].value, rest[1].text)
+            if len(rest) == 4 and rest[0].value == "between" and rest[2].value == "and":
+                return f"{self._bound('>=', rest[1].text)} AND {self._bound('<=', rest[3].text)}"
+            raise _NoRoute("OrderDate condition")
+        if len(tokens) >= 3 and tokens[1].value in FLIPPED:
+            column = self._column(tokens, 2)
+            if column and column[:2] == ("orders", "orderdate"):
+                if column[3] != len(tokens):
+                    raise _NoRoute("OrderDate condition")
+                return self._bound(FLIPPED[tokens[1].value], tokens[0].text)
+        return None
+
+    def _bound(self, op: str, literal: str) -> str:
+        """Month/Segment condition selecting exactly the rows where `OrderDate <op> literal`."""
+        match = DATE_LITERAL.match(literal)
+        if not match or not self.router.dates_aligned:
+            raise _NoRoute(f"date bound {literal}")
+        year, month, day = (int(g) for g in match.groups())
+        if not 1 <= month <= 12:
+            raise _NoRoute(f"date bound {literal}")
+        m = f"'{year:04d}-{month:02d}'"
+        if day == 1 and op in (">=", "<"):
+            return f"r.Month {op} {m}"
+        if day == calendar.monthrange(year, month)[1]:
+            segment = {"<": "< 1", "<=": "<= 1", "=": "= 1", "==": "= 1", ">=": ">= 1", ">": "> 1"}[op]
+            inside = f"(r.Month = {m} AND r.Segment {segment})"
+            if op in ("=", "=="):
+                return inside
+            return f"(r.Month {op[0]} {m} OR {inside})"
+        raise _NoRoute(f"{literal} is not a month boundary")
+
+    def _choose_rollup(self, touched: set) -> str:
+        needs = set()
+        if "customers" in self.tables or "rollup_month_customer" in touched:
+            needs.add("rollup_month_customer")
+        if "products" in self.tables or "rollup_month_product" in touched:
+            if "categories" in self.tables and not touched & {"products", "rollup_month_product"}:
+                # products only links order lines to categories
+                needs.add("rollup_month_category")
+            else:
+                needs.add("rollup_month_product")
+        if len(needs) > 1:
+            raise _NoRoute("no rollup has both dimensions")
+        return needs.pop() if needs else "rollup_month_customer"
+
+    def _check_order_count(self, rollup: str, group_by: List[Dict], where: List[Dict]):
+        """
+        An order has one customer and one month, so per-bucket distinct counts add up at
+        customer grain. At category/product grain they only add up within one category/product.
+        """
+        if rollup == "rollup_month_customer":
+            return
+        role = "categories" if rollup == "rollup_month_category" else "products"
+        alias = self.tables[role][1].lower()
+        unique = {f"{alias}.{c}" for c in self.router.unique_columns.get(role, ())}
+        if any(e["sql"].lower() in unique for e in group_by) or any(c["pins"] & unique for c in where):
+            return
+        raise _NoRoute("distinct order count across categories/products")
+
+    def _assemble(self, rollup, items, group_by, where, having, order_by, limit) -> str:
+        if self.shape == "orders":
+            measure_sql = {"rows": "COALESCE(SUM(r.AllOrders), 0)", "orders": "COALESCE(SUM(r.AllOrders), 0)",
+                           "freight": "SUM(r.Freight)"}
+        else:
+            measure_sql = {"gross": "SUM(r.Gross)", "net": "SUM(r.Net)", "quantity": "SUM(r.Quantity)",
+                           "rows": "COALESCE(SUM(r.Lines), 0)", "orders": "COALESCE(SUM(r.Orders), 0)",
+                           "freight": "SUM(r.LineFreight)"}
+
+        def render(expression):
+            sql = expression["sql"]
+            for n, measure in enumerate(expression["aggregates"]):
+                sql = sql.replace(f"\x00{n}\x00", measure_sql[measure])
+            return sql
+
+        select = []
+        for expression, alias, tokens in items:
+            plain_column = expression["refs"] == [expression["sql"]] and expression["sql"] not in MONTH_REFS
+            if alias is None and not plain_column:
+                # SQLite names an unaliased expression after its source text; keep that name
+                alias = '"' + self.sql[tokens[0].start:tokens[-1].end].replace('"', '""') + '"'
+            select.append(render(expression) + (f" AS {alias}" if alias else ""))
+
+        sql = f"SELECT {', '.join(select)} FROM {rollup} r"
+        joined = [role for role in ("products", "categories", "customers") if role in self.tables]
+        if rollup == "rollup_month_category":
+            joined = ["categories"]
+        for role in joined:
+            table, alias = self.tables[role]
+            if role == "categories" and rollup != "rollup_month_category":
+                left = f"{self.tables['products'][1]}.CategoryID"
+            else:
+                left = f"r.{ROLLUPS[ROLE_ROLLUP[role]][0]}"
+            key = {"products": "ProductID", "categories": "CategoryID", "customers": "CustomerID"}[role]
+            sql += f" JOIN {table.text} {alias} ON {left} = {alias}.{key}"
+
+        conditions = [render(c) for c in where]
+        if self.shape == "lines" and rollup == "rollup_month_customer":
+            # Buckets holding only orders without lines have no counterpart in the lines join
+            conditions.append("r.Lines IS NOT NULL")
+        if conditions:
+            sql += " WHERE " + " AND ".join(f"({c})" for c in conditions)
+        if group_by:
+            sql += " GROUP BY " + ", ".join(render(e) for e in group_by)
+        if having:
+            sql += f" HAVING {render(having)}"
+        if order_by:
+            sql += " ORDER BY " + ", ".join(f"{render(e)} {d}".rstrip() for e, d in order_by)
+        if limit:
+            sql += " LIMIT " + " ".join(t.text for t in limit)
+        return sql
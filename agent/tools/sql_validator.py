@@ -0,0 +1,193 @@
+import difflib
+import re
+import sqlite3
+import threading
+from typing import List, Dict
+
+from agent.tools.sql_cache import table_aliases
+
+SCHEMA_LINE = re.compile(r"^Table (\S+) has columns: (.*)$")
+QUALIFIED_COLUMN = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+# Plan steps that produce a named intermediate result rather than reading a table
+INTERMEDIATE_STEP = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) (.+)$")
+# ON/WHERE condition text, up to the next JOIN or clause
+CONDITION = re.compile(
+    r"\b(?:ON|WHERE)\b(.*?)(?=\bJOIN\b|\bWHERE\b|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|$)",
+    re.IGNORECASE | re.DOTALL)
+
+
+def parse_schema(schema_text: str) -> Dict[str, List[str]]:
+    """Table -> columns, from the 'Table X has columns: ...' lines of SQLiteTool.get_schema()."""
+    tables = {}
+    for line in schema_text.splitlines():
+        match = SCHEMA_LINE.match(line.strip())
+        if match:
+            tables[match.group(1).lower()] = [c.strip() for c in match.group(2).split(",")]
+    return tables
+
+
+class ValidationResult:
+    """Structured outcome of validating one query; `errors` block execution, `warnings` do not."""
+
+    def __init__(self, errors: List[Dict[str, str]] = None, warnings: List[Dict[str, str]] = None):
+        self.errors = errors or []
+        self.warnings = warnings or []
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def render(self) -> str:
+        """Error text for the repair prompt. Starts with 'SQL error' like executor errors."""
+        lines = ["SQL error occurred: query rejected before execution."]
+        lines.extend(f"- [{e['code']}] {e['message']}" for e in self.errors)
+        return "\n".join(lines)
+
+
+class SQLValidator:
+    """
+    Checks generated SQL without running it: column references against the cached
+    schema text, then a prepare via EXPLAIN QUERY PLAN (syntax, unknown tables/columns),
+    then the plan itself (cross joins are errors, full table scans are warnings).
+    """
+
+    def __init__(self, db_tool, schema_text: str):
+        self.db_tool = db_tool
+        self.schema = parse_schema(schema_text)
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "passed": 0, "rejected": 0, "full_scans": 0, "by_code": {}}
+
+    def validate(self, sql_query: str, record: bool = True) -> ValidationResult:
+        """`record=False` leaves `stats` alone (re-checks of rewritten SQL, e.g. by SQLRepairer)."""
+        errors = self._check_columns(sql_query)
+        warnings = []
+        if not errors:
+            plan, error = self._explain(sql_query)
+            if error:
+                errors.append(self._describe_error(error, sql_query))
+            else:
+                plan_errors, warnings = self._check_plan(plan, sql_query)
+                errors.extend(plan_errors)
+
+        result = ValidationResult(errors, warnings)
+        if not record:
+            return result
+        with self._lock:
+            self.stats["checked"] += 1
+            self.stats["passed" if result.ok else "rejected"] += 1
+            self.stats["full_scans"] += sum(w["code"] == "full_scan" for w in warnings)
+            for e in errors:
+                self.stats["by_code"][e["code"]] = self.stats["by_code"].get(e["code"], 0) + 1
+        return result
+
+    def _check_columns(self, sql_query: str) -> List[Dict[str, str]]:
+        """Every alias.column whose alias is a known schema table must name one of its columns."""
+        clean_sql = sql_query.lower().strip()
+        if not (clean_sql.startswith("select") or clean_sql.startswith("with")):
+            return [{"code": "not_select", "message": "Only a single SELECT (or WITH ... SELECT) query is allowed."}]
+
+        # String literals can contain dots ('e.g.'); blank them out first
+        code = re.sub(r"'(?:[^']|'')*'", "''", sql_query)
+        aliases = table_aliases(sql_query)
+        errors, seen = [], set()
+        for alias, column in QUALIFIED_COLUMN.findall(code):
+            table = aliases.get(alias.lower())
+            if table not in self.schema or (alias.lower(), column.lower()) in seen:
+                continue
+            seen.add((alias.lower(), column.lower()))
+            if column.lower() not in (c.lower() for c in self.schema[table]):
+                errors.append({"code": "unknown_column",
+                               "message": self._column_hint(f"{alias}.{column}", column, table)})
+        return errors
+
+    def _column_hint(self, reference: str, column: str, table: str = None) -> str:
+        owners = [t for t, cols in self.schema.items() if column.lower() in (c.lower() for c in cols)]
+        message = f"{reference}: " + (f"table {table} has no column {column}." if table else "no such column.")
+        if owners:
+            message += f" {column} is in: {', '.join(owners)} (join that table and use its alias)."
+        else:
+            candidates = [c for cols in self.schema.values() for c in cols]
+            close = difflib.get_close_matches(column, candidates, n=3)
+            if close:
+                message += f" Did you mean: {', '.join(dict.fromkeys(close))}?"
+        return message
+
+    def _explain(self, sql_query: str):
+        """Prepares the statement via EXPLAIN QUERY PLAN; returns (plan rows, error message)."""
+        try:
+            with self.db_tool.connection() as conn:
+                return conn.execute(f"EXPLAIN QUERY PLAN {sql_query}").fetchall(), None
+        except (sqlite3.Error, sqlite3.Warning) as e:
+            return None, str(e)
+
+    def _describe_error(self, error: str, sql_query: str) -> Dict[str, str]:
+        match = re.match(r"no such column: (?:(\w+)\.)?(\w+)", error)
+        if match:
+            alias, column = match.groups()
+            if alias and alias.lower() not in table_aliases(sql_query):
+                return {"code": "unknown_alias",
+                        "message": f"{alias}.{column}: alias {alias} is not defined in FROM/JOIN."}
+            table = table_aliases(sql_query).get(alias.lower()) if alias else None
+            reference = f"{alias}.{column}" if alias else column
+            return {"code": "unknown_column", "message": self._column_hint(reference, column, table)}
+
+        match = re.match(r"no such table: (.+)", error)
+        if match:
+            return {"code": "unknown_table",
+                    "message": f"no such table {match.group(1)}. Tables: {', '.join(self.schema)}."}
+        if error.startswith("ambiguous column name"):
+            return {"code": "ambiguous_column", "message": f"{error}. Prefix it with a table alias."}
+        return {"code": "syntax", "message": error}
+
+    def _check_plan(self, plan, sql_query: str):
+        """
+        Two or more full scans of base tables under the same plan node is a nested loop
+        that no index serves. Without a condition linking the tables (_linked) that is a
+        cartesian product; with one, e.g. ON lower(o.CustomerID) = lower(cu.CustomerID),
+        it is only slow and becomes a warning.
+        """
+        intermediate = {m.group(1) for _, _, _, detail in plan for m in [INTERMEDIATE_STEP.match(detail)] if m}
+        scans = {}
+        for _, parent, _, detail in plan:
+            # "SCAN oi" / "SCAN o USING COVERING INDEX ..." (an index scan still reads every row)
+            name = detail[5:].split(" USING ")[0]
+            if detail.startswith("SCAN ") and name not in intermediate and name != "CONSTANT ROW":
+                scans.setdefault(parent, []).append(name)
+
+        errors, warnings = [], []
+        for tables in scans.values():
+            if len(tables) > 1 and self._linked(tables, sql_query):
+                warnings.append({"code": "unindexed_join",
+                                 "message": f"{' x '.join(tables)} are joined on a condition no index serves."})
+            elif len(tables) > 1:
+                errors.append({"code": "cross_join",
+                               "message": f"{' x '.join(tables)} are joined without a join condition "
+                                          f"(cartesian product). Add ON conditions for every JOIN."})
+            warnings.extend({"code": "full_scan", "message": f"full scan of {t}"} for t in tables)
+        return errors, warnings
+
+    @staticmethod
+    def _linked(tables: List[str], sql_query: str) -> bool:
+        """
+        Whether the ON/WHERE conditions connect all `tables` (aliases from the plan), each
+        condition linking the aliases it qualifies columns with. USING and NATURAL joins
+        are taken as linked.
+        """
+        code = re.sub(r"'(?:[^']|'')*'", "''", sql_query)
+        if re.search(r"\b(?:USING|NATURAL)\b", code, re.IGNORECASE):
+            return True
+        groups = [{t.lower()} for t in tables]
+        for condition in CONDITION.findall(code):
+            named = {alias.lower() for alias, _ in QUALIFIED_COLUMN.findall(condition)}
+            touched = [g for g in groups if g & named]
+            if len(touched) > 1:
+                groups = [g for g in groups if g not in touched] + [set().union(*touched, named)]
+            elif touched:
+                touched[0].update(named)
+        return len(groups) == 1
+
+    def summary(self) -> str:
+        s = self.stats
+        codes = ", ".join(f"{k}={v}" for k, v in sorted(s["by_code"].items())) or "none"
+        return (f"checked={s['checked']} passed={s['passed']} rejected={s['rejected']} "
+                f"(executions avoided) errors: {codes} | full-scan warnings={s['full_scans']}")
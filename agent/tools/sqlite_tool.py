@@ -1,8 +1,48 @@
+import hashlib
+import os
+import queue
+import re
 import sqlite3
-import pandas as pd
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+from urllib.request import pathname2url
+
+from agent.snapshot import file_fingerprint
+from agent.tools.analytics_db import resolve_db_path
+from agent.tools.sql_cache import ResultCache, normalize_sql
+from agent.tools.sql_rollups import RollupRouter
 
 DB_PATH = "data/northwind.sqlite"
 
+POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "4"))
+MMAP_MB = int(os.environ.get("SQLITE_MMAP_MB", "256"))
+CACHE_MB = int(os.environ.get("SQLITE_CACHE_MB", "64"))
+# Prepared statements kept per connection (sqlite3's LRU statement cache)
+CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", "256"))
+# Where queries read from: "file" (the DB file), "memory" (one in-memory copy per process,
+# shared by all threads) or "shm" (a copy in /dev/shm, memory-mapped by every process)
+STORAGE = os.environ.get("SQLITE_STORAGE", "file")
+SHM_DIR = os.environ.get("SQLITE_SHM_DIR", "/dev/shm")
+
+# Caps on what one query may return; the rest is dropped and marked as truncated
+MAX_ROWS = int(os.environ.get("SQL_MAX_ROWS", "100"))
+MAX_BYTES = int(os.environ.get("SQL_MAX_BYTES", "8192"))
+FETCH_SIZE = 64
+
+# Per-query budgets: wall-clock and SQLite VM instructions (checked every PROGRESS_STEPS)
+TIMEOUT_MS = float(os.environ.get("SQL_TIMEOUT_MS", "10000"))
+MAX_VM_STEPS = int(os.environ.get("SQL_MAX_VM_STEPS", "200000000"))
+PROGRESS_STEPS = 10000
+
+# Cache results of identical (normalized) queries while the DB is unchanged
+RESULT_CACHE = os.environ.get("SQL_RESULT_CACHE", "1") not in ("0", "false")
+# Answer eligible aggregate queries from the pre-aggregated rollups (analytics copy only)
+ROLLUP_ROUTING = os.environ.get("SQL_ROLLUPS", "1") not in ("0", "false")
+
+NO_RESULTS = "Query executed successfully but returned no results."
+
 # Map of "Clean Name" -> "Raw SQL Definition"
 VIEWS = {
     "orders": 'SELECT * FROM Orders',
@@ -10,25 +50,185 @@ VIEWS = {
     "products": 'SELECT * FROM Products',
     "customers": 'SELECT * FROM Customers'
 }
-TARGET_TABLES = list(VIEWS.keys()) + ['Categories']
+TARGET_TABLES = list(VIEWS.keys()) + ['Categories', 'sales_fact']
+
+# Shown with the schema when the DB has the materialized sales_fact table (analytics copy)
+SALES_FACT_NOTE = (
+    "NOTE: sales_fact has one row per order line with its order, customer, product and category "
+    "already joined in. GrossRevenue = UnitPrice * Quantity, NetRevenue = UnitPrice * Quantity * (1 - Discount). "
+    "Prefer it for revenue and quantity questions: filter on OrderDate / CategoryName directly, no JOINs needed."
+)
+
+# Python type -> SQLite storage class, for column metadata
+STORAGE_CLASSES = {int: "INTEGER", float: "REAL", str: "TEXT", bytes: "BLOB"}
+
+# DB files whose views have been checked in this process
+_VIEWS_READY = set()
+_VIEWS_LOCK = threading.Lock()
+
+# In-memory copies loaded in this process: DB path -> (URI, connection keeping it alive)
+_MEMORY_DBS = {}
+_MEMORY_LOCK = threading.Lock()
+
+
+def _snapshot_name(db_path: str) -> str:
+    """Name for a copy of `db_path` that changes whenever the file does."""
+    key = f"{os.path.abspath(db_path)}:{file_fingerprint(db_path)}"
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{stem}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def load_memory_db(db_path: str) -> str:
+    """
+    Copies `db_path` into a shared-cache in-memory DB with the backup API (once per process)
+    and returns its URI. Every connection opened on that URI sees the same pages.
+    """
+    key = os.path.abspath(db_path)
+    with _MEMORY_LOCK:
+        if key not in _MEMORY_DBS:
+            uri = f"file:{_snapshot_name(db_path)}?mode=memory&cache=shared"
+            keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            source = sqlite3.connect(f"file:{pathname2url(key)}?mode=ro", uri=True)
+            try:
+                source.backup(keeper)
+            finally:
+                source.close()
+            _MEMORY_DBS[key] = (uri, keeper)
+        return _MEMORY_DBS[key][0]
+
+
+def shm_copy(db_path: str, shm_dir: str = SHM_DIR) -> str:
+    """
+    Path of a copy of `db_path` in `shm_dir` (tmpfs), made once per DB version and shared by
+    every process; the page cache holds it once, and each process memory-maps it.
+    """
+    target = os.path.join(shm_dir, f"{_snapshot_name(db_path)}.sqlite")
+    if not os.path.exists(target):
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        source = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
+        copy = sqlite3.connect(tmp_path)
+        try:
+            source.backup(copy)
+        finally:
+            copy.close()
+            source.close()
+        os.replace(tmp_path, target)
+    return target
+
+
+class QueryResult:
+    """
+    Rows of one query as native Python values, plus column metadata.
+    `truncated` is set when the row or byte cap cut the result short; `error` holds the
+    message (starting with "Error" or "SQL error") when the query did not run; `cached`
+    marks results served from the result cache. `vm_steps` is the (approximate) number of
+    SQLite VM instructions used and `over_budget` is set when a budget stopped the query.
+    `rollup` names the rollup table the query was answered from, if any.
+    """
+
+    def __init__(self, columns: List[Dict[str, Any]] = None, rows: List[tuple] = None,
+                 truncated: bool = False, error: Optional[str] = None, cached: bool = False,
+                 vm_steps: int = 0, over_budget: bool = False, rollup: Optional[str] = None):
+        self.columns = columns or []
+        self.rows = rows or []
+        self.truncated = truncated
+        self.error = error
+        self.cached = cached
+        self.vm_steps = vm_steps
+        self.over_budget = over_budget
+        self.rollup = rollup
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c["name"] for c in self.columns]
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, float):
+        return str(round(value, 4))
+    return str(value)
+
+
+def render_result(result: QueryResult) -> str:
+    """Compact text for prompts: a header line, then one ' | '-separated line per row."""
+    if result.error:
+        return result.error
+    if not result.rows:
+        return NO_RESULTS
+    lines = [" | ".join(result.column_names)]
+    lines.extend(" | ".join(_format_value(v) for v in row) for row in result.rows)
+    if result.truncated:
+        lines.append(f"... (truncated: showing the first {len(result.rows)} rows)")
+    return "\n".join(lines)
+
 
 class SQLiteTool:
-    def __init__(self):
-        # Initialize views once safely
-        self._init_views()
+    """
+    Read-only access to the Northwind DB through a thread-safe pool of long-lived connections.
+
+    Connections are opened with PRAGMA query_only (and mode=ro on files), keep their
+    prepared statements cached, and are shared by every caller; create one tool per process.
+    `storage` picks what they read: the DB file, an in-memory copy or a /dev/shm copy.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, pool_size: int = POOL_SIZE,
+                 cache: Optional[ResultCache] = None, use_cache: bool = RESULT_CACHE,
+                 timeout_ms: float = TIMEOUT_MS, max_vm_steps: int = MAX_VM_STEPS,
+                 use_rollups: bool = ROLLUP_ROUTING, storage: str = STORAGE):
+        # Default: the indexed analytics copy if it is built and current, else DB_PATH
+        self.db_path = db_path or resolve_db_path(DB_PATH)
+        self.pool_size = pool_size
+        self.timeout_ms = timeout_ms
+        self.max_vm_steps = max_vm_steps
+        self._running = set()
+        self.cache = cache or (ResultCache() if use_cache else None)
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._data_versions = {}
+        self._generation = 0
+        self.use_rollups = use_rollups
+        self._router = None
+        self._router_loaded = False
+        self.stats = {"queries": 0, "connections_opened": 0, "over_budget": 0, "cancelled": 0, "rollup_routed": 0}
+
+        # Initialize views once per process
+        with _VIEWS_LOCK:
+            if os.path.abspath(self.db_path) not in _VIEWS_READY:
+                self._init_views()
+                _VIEWS_READY.add(os.path.abspath(self.db_path))
+
+        # The DB is read as a snapshot: later changes to the file are not seen in memory/shm mode
+        if storage not in ("file", "memory", "shm"):
+            raise ValueError(f"Unknown SQLITE_STORAGE {storage!r} (expected file, memory or shm)")
+        if storage == "shm" and not os.path.isdir(SHM_DIR):
+            print(f"   [SQLite]: {SHM_DIR} not found, reading {self.db_path} directly")
+            storage = "file"
+        self.storage = storage
+        if storage == "memory":
+            self._uri = load_memory_db(self.db_path)
+        elif storage == "shm":
+            self._uri = f"file:{pathname2url(os.path.abspath(shm_copy(self.db_path)))}?mode=ro"
+        else:
+            self._uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
 
     def _init_views(self):
         """
         Safely ensures lowercase views exist. 
         Crucial: Does NOT drop existing objects to avoid 'use DROP TABLE' errors.
         """
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         for view_name, definition in VIEWS.items():
             try:
                 # 1. Check if it exists (Table or View)
-                cursor.execute(f"SELECT name FROM sqlite_master WHERE name='{view_name}'")
+                cursor.execute("SELECT name FROM sqlite_master WHERE name=?", (view_name,))
                 if cursor.fetchone():
                     continue
                 
@@ -40,20 +240,62 @@ class SQLiteTool:
         conn.commit()
         conn.close()
 
+    def _open(self) -> sqlite3.Connection:
+        # Pooled connections move between threads, but only one thread uses each at a time
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.execute(f"PRAGMA mmap_size = {MMAP_MB * 1024 * 1024}")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_MB * 1024}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA query_only = 1")
+        with self._lock:
+            self.stats["connections_opened"] += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrows a pooled read-only connection (opening one if none is idle)."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                self._data_versions.pop(id(conn), None)
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def cancel(self):
+        """Interrupts every query currently running on this tool (from any thread)."""
+        with self._lock:
+            running = list(self._running)
+        for conn in running:
+            conn.interrupt()
+
     def _get_date_range(self):
         """Helper to get the actual date range of orders to ground the agent."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            df = pd.read_sql_query("SELECT MIN(OrderDate) as mn, MAX(OrderDate) as mx FROM Orders", conn)
-            conn.close()
-            if not df.empty:
-                return f"{df.iloc[0]['mn']} to {df.iloc[0]['mx']}"
+            with self.connection() as conn:
+                row = conn.execute("SELECT MIN(OrderDate) as mn, MAX(OrderDate) as mx FROM Orders").fetchone()
+            if row:
+                return f"{row[0]} to {row[1]}"
         except:
             pass
         return "Unknown"
 
     def get_schema(self):
-        conn = sqlite3.connect(DB_PATH)
         lines = []
         
         # 1. Add Date Context
@@ -63,43 +305,182 @@ class SQLiteTool:
         lines.append("(e.g., 1997-06-01 in docs = 2017-06-01 in DB)\n")
 
         # 2. Add Table Schemas
-        for table in TARGET_TABLES:
-            try:
-                # PRAGMA table_info works for both Tables and Views
-                query = f"PRAGMA table_info('{table}');"
-                df = pd.read_sql_query(query, conn)
-                
-                # Manual override for order_items if introspection returns empty
-                if table == 'order_items' and df.empty:
-                    columns = "OrderID, ProductID, UnitPrice, Quantity, Discount"
-                elif df.empty:
+        with self.connection() as conn:
+            for table in TARGET_TABLES:
+                try:
+                    # PRAGMA table_info works for both Tables and Views
+                    query = f"PRAGMA table_info('{table}');"
+                    names = [row[1] for row in conn.execute(query)]
+                    
+                    # Manual override for order_items if introspection returns empty
+                    if table == 'order_items' and not names:
+                        columns = "OrderID, ProductID, UnitPrice, Quantity, Discount"
+                    elif not names:
+                        continue
+                    else:
+                        columns = ", ".join(names)
+                    lines.append(f"Table {table} has columns: {columns}")
+                    if table == 'sales_fact':
+                        lines.append(SALES_FACT_NOTE)
+                except:
                     continue
-                else:
-                    columns = ", ".join(df['name'].tolist())
-                lines.append(f"Table {table} has columns: {columns}")
-            except:
-                continue
-        conn.close()
         return "\n".join(lines)
     
-    def query(self, sql_query):
+    def _db_version(self, conn: sqlite3.Connection):
+        """
+        Changes whenever the DB content may have changed: file size/mtime (main file and
+        WAL), plus a generation bumped when a connection's PRAGMA data_version moves.
+        """
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        with self._lock:
+            last = self._data_versions.get(id(conn))
+            if last is not None and last != data_version:
+                self._generation += 1
+            self._data_versions[id(conn)] = data_version
+            generation = self._generation
+        return (file_fingerprint(self.db_path), file_fingerprint(f"{self.db_path}-wal"), generation)
+
+    def _column_names(self, conn: sqlite3.Connection, sql_query: str) -> List[str]:
+        """Output column names of a query without running it (LIMIT 0 stops before the first row)."""
+        inner = sql_query.strip().rstrip(";")
+        cursor = conn.execute(f"SELECT * FROM ({inner}) LIMIT 0")
+        try:
+            # Duplicate names come back suffixed (':1', ':2') through a subquery
+            return [re.sub(r":\d+$", "", d[0]) for d in cursor.description]
+        finally:
+            cursor.close()
+
+    def _route(self, conn: sqlite3.Connection, sql_query: str):
+        """(rewritten SQL, rollup table) if the query can be answered from a rollup, else None."""
+        if not self.use_rollups:
+            return None
+        with self._lock:
+            if not self._router_loaded:
+                # None when the DB has no rollups (the raw source file)
+                self._router = RollupRouter.load(conn)
+                self._router_loaded = True
+        return self._router.rewrite(sql_query) if self._router else None
+
+    def _from_cache(self, conn, entry, sql_query: str) -> Optional[QueryResult]:
+        columns = [dict(c) for c in entry["columns"]]
+        if entry["sql"] != sql_query:
+            # A variant of the cached query (whitespace, aliases, case) may name its columns differently
+            try:
+                names = self._column_names(conn, sql_query)
+            except sqlite3.Error:
+                return None
+            if len(names) != len(columns):
+                return None
+            for column, name in zip(columns, names):
+                column["name"] = name
+        return QueryResult(columns=columns, rows=list(entry["rows"]), truncated=entry["truncated"], cached=True)
+
+    def execute(self, sql_query: str, max_rows: int = MAX_ROWS, max_bytes: int = MAX_BYTES) -> QueryResult:
+        """
+        Streams the result with fetchmany and stops at `max_rows` rows or roughly
+        `max_bytes` of rendered values, so a runaway query never materializes in full.
+        Results are served from the result cache while the DB is unchanged.
+        """
         # Allow SELECT and WITH clauses
         clean_sql = sql_query.lower().strip()
         if not (clean_sql.startswith("select") or clean_sql.startswith("with")):
-            return "Error: Only SELECT queries are allowed."
+            return QueryResult(error="Error: Only SELECT queries are allowed.")
         
+        with self._lock:
+            self.stats["queries"] += 1
         try:
-            conn = sqlite3.connect(DB_PATH)
-            # We do NOT run _init_views here to avoid locking/performance issues
-            df = pd.read_sql_query(sql_query, conn)
-            conn.close()
-            
-            if df.empty:
-                return "Query executed successfully but returned no results."
-            
-            return df.to_string(index=False)
+            with self.connection() as conn:
+                if self.cache is not None:
+                    version = self._db_version(conn)
+                    key = (normalize_sql(sql_query), max_rows, max_bytes)
+                    entry = self.cache.get(key, version)
+                    if entry is not None:
+                        result = self._from_cache(conn, entry, sql_query)
+                        if result is not None:
+                            return result
+
+                run_sql, rollup = self._route(conn, sql_query) or (sql_query, None)
+
+                # Budgets: the progress handler runs every PROGRESS_STEPS VM instructions
+                # and aborts the statement once either budget is spent
+                budget = {"steps": 0, "over": None}
+                deadline = time.perf_counter() + self.timeout_ms / 1000
+
+                def check_budget():
+                    budget["steps"] += PROGRESS_STEPS
+                    if budget["steps"] > self.max_vm_steps:
+                        budget["over"] = f"{self.max_vm_steps} VM steps"
+                    elif time.perf_counter() > deadline:
+                        budget["over"] = f"{self.timeout_ms:.0f} ms"
+                    return 1 if budget["over"] else 0
+
+                conn.set_progress_handler(check_budget, PROGRESS_STEPS)
+                with self._lock:
+                    self._running.add(conn)
+                try:
+                    try:
+                        cursor = conn.execute(run_sql)
+                    except sqlite3.Error as e:
+                        if rollup is None or str(e) == "interrupted":
+                            raise
+                        # A rewrite that does not run falls back to the base tables
+                        rollup = None
+                        cursor = conn.execute(sql_query)
+                    try:
+                        rows, size, truncated = [], 0, False
+                        while not truncated:
+                            batch = cursor.fetchmany(FETCH_SIZE)
+                            if not batch:
+                                break
+                            for row in batch:
+                                size += sum(len(_format_value(v)) + 3 for v in row)
+                                if len(rows) >= max_rows or (size > max_bytes and rows):
+                                    truncated = True
+                                    break
+                                rows.append(row)
+                        names = [d[0] for d in cursor.description or []]
+                    finally:
+                        # Finalizes the statement; SQLite stops producing the remaining rows
+                        cursor.close()
+                except sqlite3.OperationalError as e:
+                    if str(e) != "interrupted":
+                        raise
+                    return self._interrupted(budget)
+                finally:
+                    with self._lock:
+                        self._running.discard(conn)
+                    conn.set_progress_handler(None, 0)
         except Exception as e:
-            return f"SQL error occurred: {str(e)}"
+            return QueryResult(error=f"SQL error occurred: {str(e)}")
+
+        columns = []
+        for i, name in enumerate(names):
+            value = next((row[i] for row in rows if row[i] is not None), None)
+            columns.append({"name": name, "type": STORAGE_CLASSES.get(type(value), "NULL")})
+
+        if rollup:
+            with self._lock:
+                self.stats["rollup_routed"] += 1
+        if self.cache is not None:
+            entry = {"sql": sql_query, "columns": columns, "rows": tuple(rows), "truncated": truncated}
+            self.cache.put(key, version, entry, size)
+        return QueryResult(columns=columns, rows=rows, truncated=truncated, vm_steps=budget["steps"], rollup=rollup)
+
+    def _interrupted(self, budget) -> QueryResult:
+        if not budget["over"]:
+            with self._lock:
+                self.stats["cancelled"] += 1
+            return QueryResult(error="SQL error occurred: query cancelled", vm_steps=budget["steps"])
+        with self._lock:
+            self.stats["over_budget"] += 1
+        # Starts with "SQL error" so the executor treats it as a failure and the repair loop retries
+        message = (f"SQL error occurred: query exceeded budget ({budget['over']}). Check that every "
+                   f"JOIN has an ON condition (a missing one multiplies the tables) and filter earlier.")
+        return QueryResult(error=message, vm_steps=budget["steps"], over_budget=True)
+
+    def query(self, sql_query):
+        """execute() rendered to text (error messages are returned as-is)."""
+        return render_result(self.execute(sql_query))
 
 if __name__ == "__main__":
     tool = SQLiteTool()
@@ -0,0 +1,187 @@
+import contextvars
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+
+# The question being traced and the graph node currently running. LangGraph runs
+# parallel branches in copies of the caller's context, so both are visible inside
+# node threads; span assignments stay local to each branch.
+_TRACE = contextvars.ContextVar("trace", default=None)
+_SPAN = contextvars.ContextVar("span", default=None)
+
+NS_PER_MS = 1_000_000
+
+
+class Trace:
+    """All spans recorded while answering one question."""
+
+    def __init__(self, question_id: str):
+        self.question_id = question_id
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.wall_ms = None
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def add(self, span: Dict[str, Any]):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.question_id,
+            "started": self.started,
+            "wall_ms": self.wall_ms,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+@contextmanager
+def trace_question(question_id: str):
+    """Collects spans for every traced node and LLM/SQL call made inside the block."""
+    trace = Trace(question_id)
+    token = _TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.wall_ms = trace.elapsed_ms()
+        _TRACE.reset(token)
+
+
+def traced(node_name: str):
+    """Decorator for graph nodes: records wall time plus whatever the node's calls report."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(state, *args, **kwargs):
+            trace = _TRACE.get()
+            if trace is None:
+                return fn(state, *args, **kwargs)
+
+            span = {
+                "node": node_name,
+                "attempt": state.get("attempt_count", 0),
+                "start_ms": trace.elapsed_ms(),
+                "llm_calls": [],
+            }
+            token = _SPAN.set(span)
+            start = time.perf_counter()
+            try:
+                return fn(state, *args, **kwargs)
+            finally:
+                span["wall_ms"] = (time.perf_counter() - start) * 1000
+                _SPAN.reset(token)
+                trace.add(span)
+        return wrapper
+    return decorator
+
+
+def record_llm(response: Dict[str, Any], wall_s: float, cached: bool = False):
+    """Attaches Ollama's token counts and server-side durations to the current span."""
+    span = _SPAN.get()
+    if span is None:
+        return
+    span["llm_calls"].append({
+        "wall_ms": wall_s * 1000,
+        "cached": cached,
+        "done_reason": response.get("done_reason"),
+        "prompt_eval_count": response.get("prompt_eval_count", 0),
+        "eval_count": response.get("eval_count", 0),
+        "load_ms": response.get("load_duration", 0) / NS_PER_MS,
+        "prompt_eval_ms": response.get("prompt_eval_duration", 0) / NS_PER_MS,
+        "eval_ms": response.get("eval_duration", 0) / NS_PER_MS,
+    })
+
+
+def record(**fields):
+    """Adds arbitrary measurements (SQL time, result size, ...) to the current span."""
+    span = _SPAN.get()
+    if span is not None:
+        span.update(fields)
+
+
+@contextmanager
+def detached_span():
+    """
+    Collects record()/LLM-call data of a concurrent sub-task (e.g. one SQL candidate) in
+    its own dict instead of the node's span; the node merges what it keeps with merge_llm_calls().
+    """
+    span = {"llm_calls": []}
+    token = _SPAN.set(span)
+    try:
+        yield span
+    finally:
+        _SPAN.reset(token)
+
+
+def merge_llm_calls(calls: List[Dict[str, Any]]):
+    """Adds LLM calls collected in a detached_span() to the current span."""
+    span = _SPAN.get()
+    if span is not None:
+        span["llm_calls"].extend(calls)
+
+
+def current_spans() -> List[Dict[str, Any]]:
+    """Spans finished so far for the question being traced (empty outside trace_question)."""
+    trace = _TRACE.get()
+    if trace is None:
+        return []
+    with trace._lock:
+        return list(trace.spans)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class TraceSummary:
+    """Accumulates finished traces; optionally appends each one to a JSONL file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._file = open(path, "w") if path else None
+        self._lock = threading.Lock()
+        self.node_wall: Dict[str, List[float]] = {}
+        self.node_tokens: Dict[str, List[int]] = {}
+        self.question_wall: List[float] = []
+
+    def add(self, trace: Trace):
+        data = trace.to_dict()
+        with self._lock:
+            self.question_wall.append(data["wall_ms"])
+            for span in data["spans"]:
+                self.node_wall.setdefault(span["node"], []).append(span["wall_ms"])
+                tokens = sum(c["prompt_eval_count"] + c["eval_count"] for c in span["llm_calls"])
+                self.node_tokens.setdefault(span["node"], []).append(tokens)
+            if self._file:
+                self._file.write(json.dumps(data, default=str) + "\n")
+                self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def report(self) -> str:
+        lines = [f"{'node':<12} {'calls':>6} {'p50 ms':>10} {'p95 ms':>10} {'tokens':>8}"]
+        for node, walls in self.node_wall.items():
+            lines.append(
+                f"{node:<12} {len(walls):>6} {percentile(walls, 50):>10.1f} "
+                f"{percentile(walls, 95):>10.1f} {sum(self.node_tokens[node]):>8}"
+            )
+        lines.append(
+            f"{'question':<12} {len(self.question_wall):>6} {percentile(self.question_wall, 50):>10.1f} "
+            f"{percentile(self.question_wall, 95):>10.1f}"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,78 @@
+"""
+Training-set SQL against the raw Northwind file vs. the indexed analytics copy.
+
+Builds the analytics copy of --source into a temp dir (the build only reads the source),
+checks that both files return the same rows, then times every training query
+on each file with the result cache off.
+
+    python benchmarks/bench_analytics_db.py --source data/northwind.sqlite --repeat 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.dspy_dataset import train_data
+from agent.tools.analytics_db import build_analytics_db
+from agent.tools.sqlite_tool import SQLiteTool, DB_PATH
+from agent.tracing import percentile
+
+
+def rounded(rows):
+    # Index order changes float summation order; compare to 9 significant digits
+    return [tuple(float(f"{v:.9g}") if isinstance(v, float) else v for v in row) for row in rows]
+
+
+def time_queries(tool, sqls, repeat):
+    per_query = {sql: [] for sql in sqls}
+    for _ in range(repeat):
+        for sql in sqls:
+            start = time.perf_counter()
+            tool.execute(sql)
+            per_query[sql].append((time.perf_counter() - start) * 1000)
+    return per_query
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raw vs. analytics DB on the training SQL")
+    parser.add_argument("--source", default=DB_PATH)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=5, help="Show the N queries that gained the most")
+    args = parser.parse_args()
+
+    sqls = [ex.sql_query for ex in train_data]
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, "analytics.sqlite")
+        start = time.perf_counter()
+        build_analytics_db(args.source, target)
+        print(f"Build: {(time.perf_counter() - start) * 1000:.0f} ms "
+              f"({os.path.getsize(args.source) / 1e6:.1f} MB -> {os.path.getsize(target) / 1e6:.1f} MB)")
+
+        raw = SQLiteTool(db_path=args.source, use_cache=False)
+        analytics = SQLiteTool(db_path=target, use_cache=False)
+        for sql in sqls:
+            a, b = raw.execute(sql), analytics.execute(sql)
+            assert (a.error, rounded(a.rows)) == (b.error, rounded(b.rows)), sql
+
+        results = {"raw": time_queries(raw, sqls, args.repeat),
+                   "analytics": time_queries(analytics, sqls, args.repeat)}
+        raw.close()
+        analytics.close()
+
+    print(f"\n=== {len(sqls)} training SQL x {args.repeat} ===")
+    print(f"{'db':<10} {'p50 ms':>9} {'p95 ms':>9} {'total ms':>10}")
+    for name, per_query in results.items():
+        flat = [t for times in per_query.values() for t in times]
+        print(f"{name:<10} {percentile(flat, 50):>9.3f} {percentile(flat, 95):>9.3f} {sum(flat):>10.1f}")
+
+    medians = {sql: (percentile(results["raw"][sql], 50), percentile(results["analytics"][sql], 50)) for sql in sqls}
+    print(f"\nLargest gains (median ms, raw -> analytics):")
+    for sql, (before, after) in sorted(medians.items(), key=lambda kv: kv[1][1] - kv[1][0])[:args.top]:
+        print(f"  {before:8.2f} -> {after:8.2f}  {sql[:90]}")
+
+
+if __name__ == "__main__":
+    main()
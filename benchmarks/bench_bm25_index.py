@@ -0,0 +1,96 @@
+"""
+Persisted BM25 index vs. rebuilding it at every start.
+
+Copies docs/ --scale times into a temp directory (renamed copies, so every chunk is
+distinct), then times: the in-memory rebuild a process used to do (read, chunk,
+tokenize, BM25Okapi), the first build of the persisted index, loading it again when
+nothing changed (memory-mapped), and the incremental rebuild after one doc is edited.
+Checks that the persisted index scores every query like BM25Okapi.
+
+    python benchmarks/bench_bm25_index.py --scale 200
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.rag.retrieval import Retriever
+
+QUERIES = [
+    "return window for unopened beverages",
+    "average order value definition",
+    "Summer Beverages 1997 campaign dates",
+    "gross margin cost of goods",
+    "winter classics marketing calendar",
+    "beverages beverages policy days",
+]
+
+
+def timed(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persisted BM25 index vs. in-memory rebuild")
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--scale", type=int, default=200, help="Copies of every doc")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        docs = os.path.join(tmp, "docs")
+        os.makedirs(docs)
+        for path in glob.glob(os.path.join(args.docs, "*.md")):
+            name = os.path.basename(path)[:-3]
+            for i in range(args.scale):
+                shutil.copy(path, os.path.join(docs, f"{name}_{i}.md"))
+        index_dir = os.path.join(tmp, "index")
+
+        rebuild_ms, old = timed(lambda: Retriever(docs), args.repeat)
+
+        def cold():
+            shutil.rmtree(index_dir, ignore_errors=True)
+            return Retriever(docs, index_dir=index_dir)
+        cold_ms, _ = timed(cold, args.repeat)
+        warm_ms, new = timed(lambda: Retriever(docs, index_dir=index_dir), args.repeat)
+
+        edited = sorted(glob.glob(os.path.join(docs, "*.md")))[0]
+        with open(edited, "a", encoding="utf-8") as f:
+            f.write("\n## Appendix\nSeasonal beverages ship within five days.\n")
+        incremental_ms, changed = timed(lambda: Retriever(docs, index_dir=index_dir), 1)
+        stats = dict(changed.index_stats)
+
+        same_scores = all(np.allclose(old.bm25.get_scores(old._tokenize(q)), new.index.get_scores(new._tokenize(q)),
+                                      rtol=1e-12, atol=1e-12) for q in QUERIES)
+        same_top = all(old.search(q, top_k=5) == new.search(q, top_k=5) for q in QUERIES)
+        query_old = [timed(lambda: old.search(q, top_k=5), 20)[0] for q in QUERIES]
+        query_new = [timed(lambda: new.search(q, top_k=5), 20)[0] for q in QUERIES]
+        chunks, files = len(new.chunks), len(glob.glob(os.path.join(docs, "*.md")))
+
+    print(f"Corpus: {files} docs, {chunks} chunks (scale {args.scale})")
+    print(f"Same scores as BM25Okapi: {same_scores}, same top-5: {same_top}")
+    print(f"{'':<34} {'ms':>10}")
+    print(f"{'rebuild in memory (before)':<34} {rebuild_ms:>10.1f}")
+    print(f"{'persisted index, first build':<34} {cold_ms:>10.1f}")
+    print(f"{'persisted index, unchanged docs':<34} {warm_ms:>10.1f}")
+    print(f"{'persisted index, 1 doc edited':<34} {incremental_ms:>10.1f}"
+          f"   ({stats.get('tokenized')} tokenized, {stats.get('reused')} reused)")
+    print(f"{'search, BM25Okapi (mean)':<34} {sum(query_old) / len(query_old):>10.3f}")
+    print(f"{'search, persisted index (mean)':<34} {sum(query_new) / len(query_new):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+End-to-end benchmark of the compiled graph against the mock Ollama server.
+
+Drives `app` over the sample eval set and/or synthetic question sets and reports
+throughput, per-node latency (p50/p95) and memory, plus component timings for
+SQLiteTool and Retriever. Everything runs on a plain CPU box; model latency is
+simulated with --latency / --token-latency.
+
+    python benchmarks/bench_e2e.py --synthetic 200 --workers 1,4,8 --latency 0.05
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_ollama import MockOllamaServer, RecordedResponder, canned_responder
+
+SAMPLE_PATH = "sample_questions_hybrid_eval.jsonl"
+
+CATEGORIES = ["Beverages", "Condiments", "Confections", "Dairy Products",
+              "Grains/Cereals", "Meat/Poultry", "Produce", "Seafood"]
+TEMPLATES = [
+    ("Total revenue from {category} in {year}?", "float"),
+    ("Top {n} products by revenue in {year}.", "list[{{product:str, revenue:float}}]"),
+    ("Which customer had the highest revenue in {year}?", "{{customer:str, revenue:float}}"),
+    ("How many units of {category} were sold during 'Summer Beverages {year}'?", "int"),
+    ("What was the Average Order Value in {year}?", "float"),
+    ("Top {n} categories by quantity sold all-time.", "list[{{category:str, quantity:int}}]"),
+    ("According to the product policy, what is the return window for {category}?", "int"),
+]
+
+
+def synthetic_questions(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    questions = []
+    for i in range(count):
+        template, hint = rng.choice(TEMPLATES)
+        questions.append({
+            "id": f"synthetic_{i}",
+            "question": template.format(category=rng.choice(CATEGORIES), year=rng.choice([1996, 1997, 1998]),
+                                        n=rng.randint(1, 5)),
+            "format_hint": hint.format(),
+        })
+    return questions
+
+
+def load_questions(path: str):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_components(repeat: int):
+    """Isolated timings for the non-LLM building blocks."""
+    from agent.tools.sqlite_tool import SQLiteTool
+    from agent.rag.retrieval import Retriever
+    from agent.dspy_dataset import train_data
+
+    start = time.perf_counter()
+    retriever = Retriever(docs_path="docs")
+    build_ms = (time.perf_counter() - start) * 1000
+
+    queries = [ex.question for ex in train_data]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            retriever.search(q, top_k=3)
+    search_ms = (time.perf_counter() - start) * 1000 / (repeat * len(queries))
+
+    tool = SQLiteTool()
+    sqls = [ex.sql_query for ex in train_data]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sql in sqls:
+            tool.query(sql)
+    sql_ms = (time.perf_counter() - start) * 1000 / (repeat * len(sqls))
+
+    print("=== Components ===")
+    print(f"Retriever build:        {build_ms:8.2f} ms")
+    print(f"Retriever.search:       {search_ms:8.3f} ms/query ({len(queries)} queries x {repeat})")
+    print(f"SQLiteTool.query:       {sql_ms:8.3f} ms/query ({len(sqls)} training SQL x {repeat})")
+
+
+def run_set(name, questions, workers, trace_memory):
+    from agent.graph_hybrid import build_app
+    from agent.tracing import trace_question, TraceSummary
+
+    app = build_app()
+    summary = TraceSummary()
+
+    def run_one(item):
+        inputs = {
+            "question": item["question"],
+            "format_hint": item["format_hint"],
+            "attempt_count": 0,
+            "sql_valid": False,
+            "retrieved_docs": [],
+            "classification": "hybrid"
+        }
+        with trace_question(item["id"]) as trace:
+            state = app.invoke(inputs)
+        summary.add(trace)
+        return state
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    # The nodes print progress; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        if workers <= 1:
+            states = [run_one(q) for q in questions]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                states = list(executor.map(run_one, questions))
+    elapsed = time.perf_counter() - start
+    heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    valid = sum(1 for s in states if s.get("sql_valid"))
+    print(f"\n=== {name}: {len(questions)} questions, {workers} worker(s) ===")
+    print(f"Wall time:   {elapsed:.2f}s")
+    print(f"Throughput:  {len(questions) / elapsed:.2f} questions/s")
+    print(f"SQL valid:   {valid}/{len(questions)}")
+    print(f"Peak RSS:    {rss_mb():.1f} MB" + (f" | Python heap peak: {heap_peak:.1f} MB" if heap_peak else ""))
+    print(summary.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end agent benchmark against a mock Ollama")
+    parser.add_argument("--sample", default=SAMPLE_PATH, help="Question JSONL to run ('' to skip)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Also run N synthetic questions")
+    parser.add_argument("--workers", default="1", help="Comma-separated worker counts, e.g. 1,4,8")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per LLM request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Simulated seconds per output token")
+    parser.add_argument("--recorded", help="Replay responses from this LLM cache file")
+    parser.add_argument("--use-cache", action="store_true", help="Keep the on-disk LLM cache enabled")
+    parser.add_argument("--memory", action="store_true", help="Track Python heap peak with tracemalloc (slower)")
+    parser.add_argument("--component-repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    responder = RecordedResponder(args.recorded) if args.recorded else canned_responder
+    with MockOllamaServer(latency=args.latency, token_latency=args.token_latency, responder=responder) as server:
+        from agent.tools.llm_client import configure_client
+        worker_counts = [int(w) for w in args.workers.split(",")]
+        client_kwargs = {"base_url": server.url, "pool_size": max(worker_counts + [4])}
+        if not args.use_cache:
+            client_kwargs["cache"] = None
+        configure_client(**client_kwargs)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            from agent.graph_hybrid import build_app, get_resources
+            build_app()
+            get_resources().warm()  # startup cost is part of the picture
+        print(f"Graph build/startup: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        bench_components(args.component_repeat)
+
+        sets = []
+        if args.sample:
+            sets.append(("sample", load_questions(args.sample)))
+        if args.synthetic:
+            sets.append((f"synthetic-{args.synthetic}", synthetic_questions(args.synthetic)))
+
+        for name, questions in sets:
+            for workers in worker_counts:
+                run_set(name, questions, workers, args.memory)
+
+        print(f"\nMock server handled {server.requests} LLM requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Executor latency: a fresh SQLiteTool per call (view checks + a new connection per
+query + pandas rendering, as the executor used to do) vs. the shared pooled tool
+with cursor-based execution used by executor_node, without and with the result cache.
+
+Runs the training SQL from agent/dspy_dataset.py, single-threaded and with N threads.
+
+    python benchmarks/bench_executor.py --repeat 20 --threads 4
+"""
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from agent.tools.sqlite_tool import DB_PATH, VIEWS
+from agent.tracing import percentile
+
+
+def legacy_execute(sql: str) -> str:
+    """The pre-pool executor path: view setup + connect + query + close on every call."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    for view_name, definition in VIEWS.items():
+        try:
+            cursor.execute(f"SELECT name FROM sqlite_master WHERE name='{view_name}'")
+            if not cursor.fetchone():
+                cursor.execute(f"CREATE VIEW {view_name} AS {definition}")
+        except Exception:
+            pass
+    conn.commit()
+    conn.close()
+
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        df = pd.read_sql_query(sql, conn)
+        conn.close()
+        if df.empty:
+            return "Query executed successfully but returned no results."
+        return df.to_string(index=False)
+    except Exception as e:
+        return f"SQL error occurred: {str(e)}"
+
+
+def pooled_execute(sql: str) -> str:
+    from agent.graph_hybrid import executor_node
+    state = {"sql_query": sql, "attempt_count": 0}
+    return executor_node(state)["sql_result"]
+
+
+@contextlib.contextmanager
+def result_cache(enabled: bool):
+    """Runs the shared executor tool with or without its result cache."""
+    from agent.graph_hybrid import get_resources
+    tool = get_resources().db_tool
+    saved = tool.cache
+    if enabled:
+        saved.clear()
+    else:
+        tool.cache = None
+    try:
+        yield
+    finally:
+        tool.cache = saved
+
+
+def run(name, fn, sqls, repeat, threads):
+    work = [sql for _ in range(repeat) for sql in sqls]
+
+    def timed(sql):
+        start = time.perf_counter()
+        fn(sql)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if threads <= 1:
+            latencies = [timed(sql) for sql in work]
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                latencies = list(executor.map(timed, work))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {threads:>7} {percentile(latencies, 50):>9.3f} {percentile(latencies, 95):>9.3f} "
+          f"{len(work) / elapsed:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Executor latency before/after the connection pool and result cache")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    from agent.dspy_dataset import train_data
+    from agent.graph_hybrid import get_resources
+
+    sqls = [ex.sql_query for ex in train_data]
+    # Same rows either way (only the text rendering differs)
+    for sql in sqls:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            expected = len(conn.execute(sql).fetchall())
+        except sqlite3.Error:
+            expected = 0
+        conn.close()
+        assert expected == len(get_resources().db_tool.execute(sql).rows), sql
+
+    print(f"=== Executor: {len(sqls)} training SQL x {args.repeat} ===")
+    print(f"{'mode':<10} {'threads':>7} {'p50 ms':>9} {'p95 ms':>9} {'queries/s':>10}")
+    for threads in sorted({1, args.threads}):
+        run("legacy", legacy_execute, sqls, args.repeat, threads)
+        with result_cache(False):
+            run("pooled", pooled_execute, sqls, args.repeat, threads)
+        with result_cache(True):
+            run("cached", pooled_execute, sqls, args.repeat, threads)
+    # A query that returns far more rows than the synthesizer can use
+    sql = "SELECT * FROM order_items oi JOIN orders o ON oi.OrderID = o.OrderID"
+    print(f"\n=== Unbounded result: {sql} ===")
+    for name, fn in (("legacy", legacy_execute), ("pooled", pooled_execute)):
+        get_resources().db_tool.cache.clear()
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            text = fn(sql)
+        elapsed = (time.perf_counter() - start) * 1000
+        peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+        print(f"{name:<10} {elapsed:>9.1f} ms  {len(text):>9} chars  heap peak {peak:.1f} MB")
+    print(f"Pool: {get_resources().db_tool.stats}")
+    print(f"Result cache: {get_resources().db_tool.cache.summary()}")
+
+
+if __name__ == "__main__":
+    main()
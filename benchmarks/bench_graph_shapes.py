@@ -0,0 +1,109 @@
+"""
+Concurrent vs. sequential router/retriever: same final states, lower latency.
+
+Builds the graph twice, with the retriever fanned out next to the router (the default)
+and chained after it (build_workflow(parallel_retrieval=False)). Both run the sample
+questions, synthetic ones and a few that need the LLM router against the mock Ollama
+server, with the retriever's search() slowed down by --retrieval-latency. Asserts that
+every question ends in the same final state in both shapes, and reports the latency of
+each; the overlap only pays off where the router calls the LLM.
+
+    python benchmarks/bench_graph_shapes.py --latency 0.05 --retrieval-latency 0.02
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_ollama import MockOllamaServer, canned_responder
+from benchmarks.bench_e2e import SAMPLE_PATH, load_questions, synthetic_questions
+
+# Too vague for agent/router_rules.py, so the router's LLM call overlaps with retrieval
+LLM_ROUTED = [
+    {"question": "Tell me about Beverages", "format_hint": "str"},
+    {"question": "Anything notable about Chai?", "format_hint": "str"},
+    {"question": "How did Seafood do?", "format_hint": "float"},
+]
+
+# Both shapes must see the same inputs: no question cache, LLM cache or SQL candidates
+CONFIG = {"question_cache": False, "sql_candidates": 1}
+
+
+class SlowRetriever:
+    """The real retriever with a fixed delay per search, like a remote or larger index."""
+
+    def __init__(self, retriever, latency: float):
+        self.retriever = retriever
+        self.latency = latency
+
+    def search(self, query, top_k=3):
+        time.sleep(self.latency)
+        return self.retriever.search(query, top_k=top_k)
+
+
+def run_shape(app, questions):
+    states, seconds = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for item in questions:
+            start = time.perf_counter()
+            states.append(app.invoke({
+                "question": item["question"],
+                "format_hint": item["format_hint"],
+                "attempt_count": 0,
+                "sql_valid": False,
+                "retrieved_docs": [],
+                "classification": "hybrid",
+            }))
+            seconds.append(time.perf_counter() - start)
+    return states, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent vs. sequential router/retriever graph")
+    parser.add_argument("--sample", default=SAMPLE_PATH)
+    parser.add_argument("--synthetic", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per LLM request")
+    parser.add_argument("--retrieval-latency", type=float, default=0.02, help="Added seconds per retriever search")
+    args = parser.parse_args()
+
+    questions = (load_questions(args.sample) if args.sample else []) + synthetic_questions(args.synthetic)
+    questions += LLM_ROUTED
+    with MockOllamaServer(latency=args.latency, responder=canned_responder) as server:
+        from agent.tools.llm_client import configure_client
+        configure_client(base_url=server.url, cache=None)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            import agent.graph_hybrid as graph
+            load_retriever = graph.Resources._load_retriever
+            graph.Resources._load_retriever = lambda self: SlowRetriever(load_retriever(self), args.retrieval_latency)
+            graph.build_app(CONFIG)
+            graph.get_resources().warm()
+
+        shapes = {"concurrent": graph.build_workflow(parallel_retrieval=True).compile(),
+                  "sequential": graph.build_workflow(parallel_retrieval=False).compile()}
+        results = {name: run_shape(app, questions) for name, app in shapes.items()}
+
+    concurrent, sequential = results["concurrent"][0], results["sequential"][0]
+    differ = [item["question"] for item, a, b in zip(questions, concurrent, sequential)
+              if json.dumps(a, sort_keys=True, default=str) != json.dumps(b, sort_keys=True, default=str)]
+
+    print(f"=== {len(questions)} questions, LLM {args.latency * 1000:.0f} ms, "
+          f"retrieval +{args.retrieval_latency * 1000:.0f} ms ===")
+    print(f"{'':<12} {'total s':>8} {'ms/question':>12} {'LLM-routed ms/question':>24}")
+    for name, (_, seconds) in results.items():
+        routed = seconds[-len(LLM_ROUTED):]
+        print(f"{name:<12} {sum(seconds):>8.2f} {sum(seconds) / len(seconds) * 1000:>12.1f} "
+              f"{sum(routed) / len(routed) * 1000:>24.1f}")
+    print(f"Same final state: {len(questions) - len(differ)}/{len(questions)}")
+    for question in differ:
+        print(f"  differs   {question}")
+    assert not differ, "concurrent and sequential graphs ended in different states"
+
+
+if __name__ == "__main__":
+    main()
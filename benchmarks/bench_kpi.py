@@ -0,0 +1,128 @@
+"""
+KPI engine vs. SQL for the registered KPIs.
+
+Builds the order-line arrays for --db (optionally a --scale x copy of the DB), then
+evaluates every KPI for a set of date ranges, category filters and top-N groupings both
+with the engine and with the equivalent SQL, and checks that the numbers agree. Reports
+array build and load time, and per-evaluation p50/p95 for both.
+
+    python benchmarks/bench_kpi.py --scale 40
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.kpi import KPIEngine, load_registry, build_arrays
+from agent.tools.sqlite_tool import DB_PATH
+from agent.tracing import percentile
+
+RANGES = [("2016-07-01", "2016-12-31"), ("2017-06-01", "2017-06-30"), ("2017-12-01", "2017-12-31"),
+          ("2017-01-01", "2017-12-31"), (None, None)]
+GROUP_COLUMNS = {"category": "c.CategoryName", "product": "p.ProductName", "customer": "cu.CompanyName"}
+
+# CostOfGoods as the engine estimates it without a cost column: COST_RATIO x category average list price
+COST_SQL = """
+(SELECT ratio * AVG(p2.UnitPrice) FROM Products p2 WHERE p2.CategoryID = p.CategoryID)
+"""
+
+
+def sql_for(kpi, start, end, category, group_by, top_n, ratio):
+    expr = kpi.formula
+    for column in ("UnitPrice", "Quantity", "Discount", "OrderID"):
+        expr = expr.replace(column, f"od.{column}")
+    expr = expr.replace("CostOfGoods", COST_SQL.strip().replace("ratio", str(ratio)))
+    where = []
+    if start:
+        where.append(f"substr(o.OrderDate, 1, 10) >= '{start}'")
+    if end:
+        where.append(f"substr(o.OrderDate, 1, 10) <= '{end}'")
+    if category:
+        where.append(f"c.CategoryName = '{category}'")
+    sql = (f'SELECT {GROUP_COLUMNS[group_by] + ", " if group_by else ""}{expr} AS Val '
+           f'FROM "Order Details" od JOIN Orders o ON o.OrderID = od.OrderID '
+           f"LEFT JOIN Products p ON p.ProductID = od.ProductID "
+           f"LEFT JOIN Categories c ON c.CategoryID = p.CategoryID "
+           f"LEFT JOIN Customers cu ON cu.CustomerID = o.CustomerID")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if group_by:
+        sql += f" GROUP BY 1 HAVING {GROUP_COLUMNS[group_by]} IS NOT NULL ORDER BY Val DESC LIMIT {top_n}"
+    return sql
+
+
+def close(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= 1e-6 * max(1.0, abs(a), abs(b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KPI engine vs. SQL")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--scale", type=int, default=1, help="Run on a copy with every order repeated this many times")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from agent.kpi import COST_RATIO
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = args.db
+        if args.scale > 1:
+            from benchmarks.bench_rollups import scaled_copy
+            db = os.path.join(tmp, "scaled.sqlite")
+            scaled_copy(args.db, db, args.scale)
+        array_dir = os.path.join(tmp, "arrays")
+
+        start = time.perf_counter()
+        build_arrays(db, array_dir)
+        build_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        engine = KPIEngine(db, registry=load_registry(), base_dir=array_dir)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        conn = sqlite3.connect(db)
+        category = conn.execute("SELECT CategoryName FROM Categories ORDER BY CategoryID").fetchone()[0]
+        cases = [(kpi, start, end, cat, group_by)
+                 for kpi in {k.name: k for k in engine.registry.values()}.values()
+                 for start, end in RANGES for cat in (None, category) for group_by in (None, "customer", "category")]
+
+        engine_ms, sql_ms, agree, disagree = [], [], 0, []
+        for kpi, start_date, end_date, cat, group_by in cases:
+            filters = {"category": [cat]} if cat else {}
+            sql = sql_for(kpi, start_date, end_date, cat, group_by, 3, COST_RATIO)
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                value = engine.evaluate(kpi, start_date, end_date, filters, group_by=group_by, top_n=3)
+                engine_ms.append((time.perf_counter() - t) * 1000)
+                t = time.perf_counter()
+                rows = conn.execute(sql).fetchall()
+                sql_ms.append((time.perf_counter() - t) * 1000)
+            if group_by:
+                same = (len(value) == len(rows) and
+                        all(n == r[0] and close(v, r[1]) for (n, v), r in zip(value, rows)))
+            else:
+                same = close(value, rows[0][0])
+            if same:
+                agree += 1
+            else:
+                disagree.append((kpi.name, start_date, end_date, cat, group_by, value, rows))
+        conn.close()
+        lines = len(engine.arrays["order_id"])
+
+    print(f"DB: {lines} order lines (scale {args.scale})")
+    print(f"Arrays: build {build_ms:.0f} ms (once per DB version), load {load_ms:.1f} ms (memory-mapped)")
+    print(f"Same numbers as SQL: {agree}/{len(cases)}")
+    for case in disagree:
+        print(f"  differs   {case}")
+    print(f"{'':<8} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'engine':<8} {percentile(engine_ms, 50):>8.3f} {percentile(engine_ms, 95):>8.3f}")
+    print(f"{'sql':<8} {percentile(sql_ms, 50):>8.3f} {percentile(sql_ms, 95):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
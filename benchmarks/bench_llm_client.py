@@ -0,0 +1,57 @@
+"""
+Micro-benchmark: per-call overhead of a fresh urllib connection per request
+(the old query_ollama) vs. the pooled keep-alive LLMClient.
+
+    python benchmarks/bench_llm_client.py --calls 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.tools.llm_client import LLMClient
+from benchmarks.mock_ollama import MockOllamaServer
+
+MESSAGES = [{"role": "user", "content": "Question: Revenue in 1997?"}]
+
+
+def call_urllib(url: str):
+    payload = {"model": "mock", "messages": MESSAGES, "stream": False, "options": {"temperature": 0.0}}
+    req = urllib.request.Request(f"{url}/api/chat", data=json.dumps(payload).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read().decode("utf-8"))["message"]["content"]
+
+
+def timed(fn, calls: int) -> float:
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM client connection overhead benchmark")
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+
+    with MockOllamaServer() as server:
+        client = LLMClient(base_url=server.url, pool_size=1)
+
+        fresh = timed(lambda: call_urllib(server.url), args.calls)
+        pooled = timed(lambda: client.chat(MESSAGES, model="mock", options={"temperature": 0.0}), args.calls)
+
+        print(f"=== LLM Client Overhead ({args.calls} calls, zero model latency) ===")
+        print(f"urllib (new connection/call): {fresh * 1000:.3f} ms/call")
+        print(f"LLMClient (keep-alive pool):  {pooled * 1000:.3f} ms/call")
+        print(f"Saved per call:               {(fresh - pooled) * 1000:.3f} ms ({fresh / pooled:.1f}x)")
+        print(f"Connections opened by pool:   {client.stats['connections_opened']}")
+
+
+if __name__ == "__main__":
+    main()
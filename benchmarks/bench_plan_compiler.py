@@ -0,0 +1,140 @@
+"""
+Plan compiler coverage and agreement on the training set.
+
+For every example in agent/dspy_dataset.py, builds the plan a correct planner would
+write (the example's plan_constraints plus METRIC_FORMULA taken from its gold SQL),
+compiles it, and compares the compiled query's rows with the gold query's rows on
+--db (with the gold's end day made inclusive), plus a few plans whose end day has orders. Reports how many plans compile, how many of those agree with gold, why the rest
+fall back to the LLM, and the compile time.
+
+    python benchmarks/bench_plan_compiler.py --db data/northwind.sqlite
+"""
+import argparse
+import datetime
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.dspy_dataset import train_data
+from agent.plan_compiler import PlanCompiler, load_known_values
+from agent.tools.sqlite_tool import SQLiteTool, DB_PATH
+from agent.tracing import percentile
+
+
+def gold_metric(sql: str) -> str:
+    """The last SELECT item of the gold query, without its alias and table prefixes."""
+    select = re.match(r"(?is)^\s*select\s+(.*?)\s+from\s", sql).group(1)
+    depth, start, items = 0, 0, []
+    for i, ch in enumerate(select):
+        depth += ch == "("
+        depth -= ch == ")"
+        if ch == "," and depth == 0:
+            items.append(select[start:i])
+            start = i + 1
+    items.append(select[start:])
+    metric = re.sub(r"(?i)\s+as\s+\w+\s*$", "", items[-1].strip())
+    return re.sub(r"\b[a-z]+\.", "", metric)
+
+
+def inclusive_dates(sql: str) -> str:
+    """
+    The gold query with its bare end-date bounds made to include the whole end day
+    (OrderDate has a time of day), matching the compiler's inclusive-date contract.
+    """
+    def after(day):
+        return (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+    sql = re.sub(r"o\.OrderDate = '(\d{4}-\d{2}-\d{2})'",
+                 lambda m: f"o.OrderDate >= '{m.group(1)}' AND o.OrderDate < '{after(m.group(1))}'", sql)
+    return re.sub(r"o\.OrderDate <= '(\d{4}-\d{2}-\d{2})'", lambda m: f"o.OrderDate < '{after(m.group(1))}'", sql)
+
+
+# Plans whose end day has orders (the training set's ranges mostly end on days without any),
+# checked against SQL that compares calendar days
+EDGE_CASES = [
+    ("TIME_SCOPE: 2016-07-04, RANKING_INTENT: None, FILTERS: None, "
+     "METRIC_FORMULA: SUM(UnitPrice * Quantity * (1 - Discount))",
+     "SELECT SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount)) FROM order_items oi "
+     "JOIN orders o ON oi.OrderID = o.OrderID WHERE date(o.OrderDate) = '2016-07-04'"),
+    ("TIME_SCOPE: 2017-01, RANKING_INTENT: None, FILTERS: None, "
+     "METRIC_FORMULA: SUM(UnitPrice * Quantity * (1 - Discount)) / COUNT(DISTINCT OrderID)",
+     "SELECT SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount)) / COUNT(DISTINCT o.OrderID) FROM order_items oi "
+     "JOIN orders o ON oi.OrderID = o.OrderID WHERE date(o.OrderDate) BETWEEN '2017-01-01' AND '2017-01-31'"),
+    ("TIME_SCOPE: 2016-07-04 to 2016-07-31, RANKING_INTENT: top 3 customers, FILTERS: None, "
+     "METRIC_FORMULA: COUNT(DISTINCT OrderID)",
+     "SELECT cust.CompanyName, COUNT(DISTINCT o.OrderID) as Val FROM orders o "
+     "JOIN customers cust ON o.CustomerID = cust.CustomerID "
+     "WHERE date(o.OrderDate) BETWEEN '2016-07-04' AND '2016-07-31' "
+     "GROUP BY cust.CompanyName ORDER BY Val DESC LIMIT 3"),
+]
+
+# Pass ISO_DATE but name no real day; the compiler must fall back, not raise
+IMPOSSIBLE_DATES = [
+    "TIME_SCOPE: 2017-06-31, RANKING_INTENT: None, FILTERS: None, METRIC_FORMULA: COUNT(DISTINCT OrderID)",
+    "START_DATE: 2017-02-01, END_DATE: 2017-02-30, RANKING_INTENT: None, FILTERS: None, "
+    "METRIC_FORMULA: SUM(Quantity)",
+]
+
+
+def rounded(rows):
+    return [tuple(round(v, 4) if isinstance(v, float) else v for v in row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan compiler coverage on the training set")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--repeat", type=int, default=100, help="Compile every plan this many times for timing")
+    args = parser.parse_args()
+
+    tool = SQLiteTool(db_path=args.db, use_cache=False)
+    compiler = PlanCompiler(known_values=load_known_values(args.db))
+    agree, disagree = 0, []
+    for ex in train_data:
+        plan = f"{ex.plan_constraints}, METRIC_FORMULA: {gold_metric(ex.sql_query)}"
+        sql, reason = compiler.compile(plan)
+        if sql is None:
+            print(f"  fallback  {ex.question[:60]:<60}  ({reason})")
+            continue
+        gold, compiled = tool.execute(inclusive_dates(ex.sql_query)), tool.execute(sql)
+        if (gold.error, rounded(gold.rows)) == (compiled.error, rounded(compiled.rows)):
+            agree += 1
+        else:
+            disagree.append((ex.question, sql))
+
+    edge_agree, edge_compiler = 0, PlanCompiler(known_values=compiler.known_values)
+    for plan, reference in EDGE_CASES:
+        sql, reason = edge_compiler.compile(plan)
+        expected = tool.execute(reference)
+        compiled = tool.execute(sql) if sql else None
+        if compiled is not None and expected.rows and expected.rows[0][0] is not None and \
+                (compiled.error, rounded(compiled.rows)) == (expected.error, rounded(expected.rows)):
+            edge_agree += 1
+        else:
+            disagree.append((plan, sql or reason))
+
+    fallbacks = sum(edge_compiler.compile(plan)[0] is None for plan in IMPOSSIBLE_DATES)
+
+    timings = []
+    timing_compiler = PlanCompiler(known_values=compiler.known_values)
+    plans = [f"{ex.plan_constraints}, METRIC_FORMULA: {gold_metric(ex.sql_query)}" for ex in train_data]
+    for _ in range(args.repeat):
+        for plan in plans:
+            start = time.perf_counter()
+            timing_compiler.compile(plan)
+            timings.append((time.perf_counter() - start) * 1e6)
+    tool.close()
+
+    print(f"\n=== {len(train_data)} training plans ===")
+    print(f"Compiler: {compiler.summary()}")
+    print(f"Same rows as the gold SQL (end day included): {agree}/{compiler.stats['compiled']}")
+    print(f"End-day edge cases: {edge_agree}/{len(EDGE_CASES)}")
+    print(f"Impossible dates falling back: {fallbacks}/{len(IMPOSSIBLE_DATES)}")
+    for question, sql in disagree:
+        print(f"  differs   {question[:60]}\n            {sql}")
+    print(f"Compile time: p50 {percentile(timings, 50):.0f} us, p95 {percentile(timings, 95):.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Question cache: paraphrases that must share SQL, near-misses that must not.
+
+Stores the first question of each pair alone in a temp cache (with the DB's entity
+names) and looks the second one up. Paraphrases have to hit; pairs whose SQL differs (an
+aggregate, a direction, a date, a name) have to miss, whatever their similarity.
+Asserts both and reports the lookup time.
+
+    python benchmarks/bench_question_cache.py --repeat 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.tools.question_cache import QuestionCache, entity_names
+from agent.tools.sqlite_tool import DB_PATH
+from benchmarks.bench_executor import percentile
+
+HITS = [
+    ("Top 3 products by revenue in 1997?", "Best three products by sales in 1997?"),
+    ("What was the total revenue from Beverages in June 1997?", "Total revenue from Beverages in June 1997"),
+    ("How many orders did we get in 1997?", "Number of orders in 1997?"),
+    ("What was the maximum freight in 1997?", "What was the max freight in 1997?"),
+]
+MISSES = [
+    ("What was the maximum freight in 1997?", "What was the minimum freight in 1997?"),
+    ("How many orders shipped late in 1997?", "How many orders shipped on time in 1997?"),
+    ("Who was the first customer in 1997?", "Who was the last customer in 1997?"),
+    ("Total revenue from Beverages in June 1997", "Average revenue from Beverages in June 1997"),
+    ("Orders shipped from France to Germany in 1997", "Orders shipped from Germany to France in 1997"),
+    ("Revenue from Beverages in 1997", "Revenue from Beverages before 1997"),
+    ("Top 3 products by revenue in 1997?", "Top 3 products by revenue in 1998?"),
+    ("Top customer by revenue in 1997", "Top customer by revenue in 1997 excluding Beverages"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Question cache hits and near-misses")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--repeat", type=int, default=200, help="Lookups per pair for timing")
+    args = parser.parse_args()
+
+    names = entity_names(args.db)
+    wrong, timings = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = QuestionCache(path=os.path.join(tmp, "cache.sqlite"), names=names)
+        for expected, pairs in ((True, HITS), (False, MISSES)):
+            for stored, asked in pairs:
+                # One entry at a time, so a pair can only hit its own stored question
+                cache.clear()
+                cache.store(stored, "float", "plan", f"-- {stored}")
+                entry, similarity = cache.lookup(asked, "float")
+                if (entry is not None) != expected:
+                    wrong.append((stored, asked, similarity))
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    cache.lookup(asked, "float")
+                    timings.append((time.perf_counter() - start) * 1e6)
+
+    print(f"=== {len(HITS)} paraphrases, {len(MISSES)} near-misses, {len(names)} entity names ===")
+    print(f"Correct: {len(HITS) + len(MISSES) - len(wrong)}/{len(HITS) + len(MISSES)}")
+    for stored, asked, similarity in wrong:
+        print(f"  wrong     {stored!r} vs {asked!r} (similarity {similarity:.2f})")
+    print(f"Lookup time: p50 {percentile(timings, 50):.0f} us, p95 {percentile(timings, 95):.0f} us")
+    assert not wrong, "question cache hit or missed the wrong pairs"
+
+
+if __name__ == "__main__":
+    main()
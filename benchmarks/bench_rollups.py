@@ -0,0 +1,105 @@
+"""
+Training-set SQL on the analytics copy with and without rollup routing.
+
+Makes a scaled-up copy of --source in a temp dir (every order repeated --scale times
+under new OrderIDs, same dates), builds the analytics copy of it, checks that routed
+queries return the same rows as the base tables, then times both.
+
+    python benchmarks/bench_rollups.py --scale 40 --repeat 10
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.dspy_dataset import train_data
+from agent.tools.analytics_db import build_analytics_db
+from agent.tools.sqlite_tool import SQLiteTool, DB_PATH
+from agent.tracing import percentile
+
+
+def scaled_copy(source, target, scale):
+    """Copies `source` to `target` with every order (and its lines) repeated `scale` times."""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    src.backup(dst)
+    src.close()
+    span = dst.execute("SELECT MAX(OrderID) - MIN(OrderID) + 1 FROM Orders").fetchone()[0]
+    last = dst.execute("SELECT MAX(OrderID) FROM Orders").fetchone()[0]
+    for table in ("Orders", "Order Details"):
+        columns = [row[1] for row in dst.execute(f"PRAGMA table_info('{table}')")]
+        others = ", ".join(f'"{c}"' for c in columns if c != "OrderID")
+        for k in range(1, scale):
+            dst.execute(f'INSERT INTO "{table}" (OrderID, {others}) '
+                        f'SELECT OrderID + ?, {others} FROM "{table}" WHERE OrderID <= ?', (k * span, last))
+    dst.commit()
+    dst.close()
+
+
+def same_rows(a, b):
+    # Rollups add partial sums in a different order; floats match to a relative 1e-9
+    return len(a) == len(b) and all(
+        len(x) == len(y) and all(math.isclose(u, v, rel_tol=1e-9) if isinstance(u, float) and isinstance(v, float)
+                                 else u == v for u, v in zip(x, y))
+        for x, y in zip(a, b))
+
+
+def time_queries(tool, sqls, repeat):
+    per_query = {sql: [] for sql in sqls}
+    for _ in range(repeat):
+        for sql in sqls:
+            start = time.perf_counter()
+            tool.execute(sql)
+            per_query[sql].append((time.perf_counter() - start) * 1000)
+    return per_query
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Base tables vs. rollup routing on the training SQL")
+    parser.add_argument("--source", default=DB_PATH)
+    parser.add_argument("--scale", type=int, default=40, help="Repeat every order this many times")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    sqls = [ex.sql_query for ex in train_data]
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "scaled.sqlite")
+        target = os.path.join(tmp, "analytics.sqlite")
+        scaled_copy(args.source, source, args.scale)
+        start = time.perf_counter()
+        build_analytics_db(source, target)
+        with sqlite3.connect(source) as conn:
+            lines = conn.execute('SELECT COUNT(*) FROM "Order Details"').fetchone()[0]
+        print(f"Scaled copy: x{args.scale}, {lines} order lines; analytics build "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+        base = SQLiteTool(db_path=target, use_cache=False, use_rollups=False)
+        routed = SQLiteTool(db_path=target, use_cache=False, use_rollups=True)
+        eligible = []
+        for sql in sqls:
+            a, b = base.execute(sql), routed.execute(sql)
+            assert (a.error, a.column_names) == (b.error, b.column_names) and same_rows(a.rows, b.rows), sql
+            if b.rollup:
+                eligible.append(sql)
+
+        results = {"base": time_queries(base, sqls, args.repeat),
+                   "rollups": time_queries(routed, sqls, args.repeat)}
+        base.close()
+        routed.close()
+
+    print(f"\n=== {len(sqls)} training SQL x {args.repeat}: {len(eligible)} answered from rollups ===")
+    print(f"{'mode':<10} {'p50 ms':>9} {'p95 ms':>9} {'routed p50':>11} {'total ms':>10}")
+    for name, per_query in results.items():
+        flat = [t for times in per_query.values() for t in times]
+        routed_flat = [t for sql in eligible for t in per_query[sql]]
+        print(f"{name:<10} {percentile(flat, 50):>9.3f} {percentile(flat, 95):>9.3f} "
+              f"{percentile(routed_flat, 50):>11.3f} {sum(flat):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Startup benchmark for agent.graph_hybrid.
+
+Each measurement runs in a fresh interpreter so nothing is already imported. Reports
+the bare module import, build_app() (DSPy/LangGraph imports + graph compile) and
+Resources.warm() (LM, optimized SQL module, schema, BM25 index), first with no warm
+snapshot or persisted BM25 index and then with the ones written by the cold run.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import contextlib, io, json, time
+t0 = time.perf_counter()
+import agent.graph_hybrid as graph
+t1 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    graph.build_app()
+    t2 = time.perf_counter()
+    graph.get_resources().warm()
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "build": t2 - t1, "warm": t3 - t2, "total": t3 - t0}))
+"""
+
+
+def probe(snapshot_path: str, index_dir: str):
+    env = dict(os.environ, AGENT_SNAPSHOT_PATH=snapshot_path, BM25_INDEX_DIR=index_dir)
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def report(name, runs):
+    print(f"{name:<16}" + "".join(
+        f" {min(r[k] for r in runs) * 1000:>10.0f}" for k in ("import", "build", "warm", "total")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold vs warm-snapshot startup of the agent graph")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "warm_snapshot.json")
+        index_dir = os.path.join(tmp, "bm25_index")
+        cold, warm = [], []
+        for _ in range(args.repeat):
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+            shutil.rmtree(index_dir, ignore_errors=True)
+            cold.append(probe(snapshot_path, index_dir))
+            warm.append(probe(snapshot_path, index_dir))
+
+    print(f"=== Startup, best of {args.repeat} (ms) ===")
+    print(f"{'':<16} {'import':>10} {'build_app':>10} {'warm':>10} {'total':>10}")
+    report("no snapshot", cold)
+    report("warm snapshot", warm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+SQLiteTool storage modes: the DB file, an in-memory copy (backup API + shared cache) and
+a /dev/shm copy memory-mapped by every process.
+
+Each mode runs in fresh interpreters: --processes of them at once, each running the
+training SQL --repeat times on --threads threads (result cache and rollups off, so every
+query reads the tables). Reports setup time, latency and memory per process: RSS, and PSS
+(shared pages split between the processes that map them), from /proc.
+
+    python benchmarks/bench_storage.py --scale 40 --processes 4 --threads 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ["file", "memory", "shm"]
+
+
+def memory_kb():
+    """(RSS, PSS) of this process in kB; PSS is 0 where /proc/self/smaps_rollup is missing."""
+    values = {}
+    for path in ("/proc/self/status", "/proc/self/smaps_rollup"):
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, rest = line.partition(":")
+                    if key in ("VmRSS", "Pss"):
+                        values[key] = int(rest.split()[0])
+        except OSError:
+            pass
+    return values.get("VmRSS", 0), values.get("Pss", 0)
+
+
+def child(args):
+    from agent.dspy_dataset import train_data
+    from agent.tools.sqlite_tool import SQLiteTool
+    from agent.tracing import percentile
+
+    sqls = [ex.sql_query for ex in train_data]
+    rss_before, _ = memory_kb()
+    start = time.perf_counter()
+    tool = SQLiteTool(db_path=args.db, use_cache=False, use_rollups=False, storage=args.child)
+    tool.execute(sqls[0])
+    setup_ms = (time.perf_counter() - start) * 1000
+
+    def timed(sql):
+        start = time.perf_counter()
+        tool.execute(sql)
+        return (time.perf_counter() - start) * 1000
+
+    work = [sql for _ in range(args.repeat) for sql in sqls]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = list(executor.map(timed, work))
+    elapsed = time.perf_counter() - start
+    rss, pss = memory_kb()
+    print(json.dumps({"setup_ms": setup_ms, "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                      "qps": len(work) / elapsed, "rss_mb": rss / 1024, "rss_delta_mb": (rss - rss_before) / 1024,
+                      "pss_mb": pss / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File vs. in-memory vs. /dev/shm SQLiteTool storage")
+    parser.add_argument("--source", default=None, help="DB to query (default: the tool's default DB)")
+    parser.add_argument("--scale", type=int, default=1, help="Build a scaled-up analytics copy first")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    from agent.tools.analytics_db import build_analytics_db, resolve_db_path
+    from agent.tools.sqlite_tool import DB_PATH
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = args.source or resolve_db_path(DB_PATH)
+        if args.scale > 1:
+            from benchmarks.bench_rollups import scaled_copy
+            scaled = os.path.join(tmp, "scaled.sqlite")
+            scaled_copy(args.source or DB_PATH, scaled, args.scale)
+            db = os.path.join(tmp, "analytics.sqlite")
+            build_analytics_db(scaled, db)
+        print(f"DB: {db} ({os.path.getsize(db) / 1e6:.1f} MB), {args.processes} process(es) x "
+              f"{args.threads} thread(s)")
+
+        print(f"\n{'mode':<8} {'setup ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'queries/s':>10} "
+              f"{'RSS MB':>8} {'+RSS MB':>8} {'PSS MB':>8}")
+        shm_files = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+        for mode in MODES:
+            command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--db", db,
+                       "--threads", str(args.threads), "--repeat", str(args.repeat)]
+            children = [subprocess.Popen(command, stdout=subprocess.PIPE, text=True) for _ in range(args.processes)]
+            results = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in children]
+            mean = {k: sum(r[k] for r in results) / len(results) for k in results[0]}
+            print(f"{mode:<8} {mean['setup_ms']:>9.1f} {mean['p50']:>8.3f} {mean['p95']:>8.3f} "
+                  f"{sum(r['qps'] for r in results):>10.0f} {mean['rss_mb']:>8.1f} {mean['rss_delta_mb']:>8.1f} "
+                  f"{mean['pss_mb']:>8.1f}")
+        # Remove the /dev/shm copies this run made
+        if os.path.isdir("/dev/shm"):
+            for name in set(os.listdir("/dev/shm")) - shm_files:
+                os.remove(os.path.join("/dev/shm", name))
+
+
+if __name__ == "__main__":
+    main()
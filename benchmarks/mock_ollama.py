@@ -0,0 +1,283 @@
+"""
+Local stand-in for Ollama, for benchmarking the agent without a GPU-backed model.
+
+Serves /api/chat (blocking and NDJSON streaming) and the OpenAI-compatible
+/v1/chat/completions that a stock dspy.LM would call. Responses are canned
+(shaped like what each graph node expects) or replayed from an LLM cache file.
+
+    python benchmarks/mock_ollama.py --port 11434 --latency 0.2 --token-latency 0.01
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.tools.llm_cache import make_key
+
+TOKEN_PATTERN = re.compile(r"\s*\S+")
+
+
+def _tokens(text: str):
+    return TOKEN_PATTERN.findall(text) or [""]
+
+
+def _last_user(messages) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content", "")
+    return ""
+
+
+def _plan_dates(question: str):
+    year = re.search(r"\b(199\d|20[12]\d)\b", question)
+    if not year:
+        return "ALL_TIME", "None", "None"
+    y = int(year.group(1))
+    y = y + 20 if y < 2000 else y
+    if "summer" in question.lower():
+        return "RANGE", f"{y}-06-01", f"{y}-06-30"
+    if "winter" in question.lower():
+        return "RANGE", f"{y}-12-01", f"{y}-12-31"
+    return "RANGE", f"{y}-01-01", f"{y}-12-31"
+
+
+def _sql_for_plan(plan: str) -> str:
+    start = re.search(r"START_DATE:\s*(\d{4}-\d{2}-\d{2})", plan)
+    end = re.search(r"END_DATE:\s*(\d{4}-\d{2}-\d{2})", plan)
+    where = ""
+    if start and end:
+        where = f" WHERE o.OrderDate >= '{start.group(1)}' AND o.OrderDate <= '{end.group(1)}'"
+    ranking = re.search(r"RANKING_INTENT:\s*\"?Top (\d+) (\w+)", plan)
+    if ranking:
+        n, entity = ranking.groups()
+        if entity.lower().startswith("product"):
+            return (f"SELECT p.ProductName, SUM(oi.UnitPrice * oi.Quantity) AS Revenue FROM order_items oi "
+                    f"JOIN orders o ON oi.OrderID = o.OrderID JOIN products p ON oi.ProductID = p.ProductID"
+                    f"{where} GROUP BY p.ProductName ORDER BY Revenue DESC LIMIT {n}")
+        if entity.lower().startswith("categor"):
+            return (f"SELECT c.CategoryName, SUM(oi.Quantity) AS Quantity FROM order_items oi "
+                    f"JOIN orders o ON oi.OrderID = o.OrderID JOIN products p ON oi.ProductID = p.ProductID "
+                    f"JOIN categories c ON p.CategoryID = c.CategoryID"
+                    f"{where} GROUP BY c.CategoryName ORDER BY Quantity DESC LIMIT {n}")
+        return (f"SELECT cust.CompanyName, SUM(oi.UnitPrice * oi.Quantity) AS Revenue FROM order_items oi "
+                f"JOIN orders o ON oi.OrderID = o.OrderID JOIN customers cust ON o.CustomerID = cust.CustomerID"
+                f"{where} GROUP BY cust.CompanyName ORDER BY Revenue DESC LIMIT {n}")
+    return f"SELECT SUM(oi.UnitPrice * oi.Quantity) FROM order_items oi JOIN orders o ON oi.OrderID = o.OrderID{where}"
+
+
+def canned_responder(payload) -> str:
+    """Returns a plausible answer for whichever graph node sent the prompt."""
+    messages = payload.get("messages", [])
+    system = messages[0].get("content", "") if messages else ""
+    user = _last_user(messages)
+
+    if "Query Router" in system:
+        is_rag = re.search(r"polic|return window", user, re.IGNORECASE)
+        return json.dumps({"classification": "rag" if is_rag else "hybrid"})
+
+    if "Query Parameter Extractor" in system:
+        question = user.split("USER QUESTION:", 1)[-1].split("\n", 2)[0]
+        scope, start, end = _plan_dates(question)
+        top = re.search(r"\btop (\d+) (products?|customers?|categor\w*)", question, re.IGNORECASE)
+        ranking = f'"Top {top.group(1)} {top.group(2).title()}"' if top else '"None"'
+        return (f"TIME_SCOPE: {scope}\nSTART_DATE: {start}\nEND_DATE: {end}\n"
+                f"RANKING_INTENT: {ranking}\nMETRIC_FORMULA: SUM(UnitPrice * Quantity)")
+
+    if "[[ ## sql_query ## ]]" in system:
+        plan = user.split("[[ ## plan_constraints ## ]]", 1)[-1]
+        return f"[[ ## sql_query ## ]]\n{_sql_for_plan(plan)}\n\n[[ ## completed ## ]]"
+
+    if "SQLite Expert" in system:
+        return _sql_for_plan(user)
+
+    if "JSON Bot" in system:
+        answer = {"final_answer": 14, "explanation": "Mock answer.", "citations": ["product_policy"]}
+        # Small models often keep talking after the JSON; exercises the early stop
+        prose = "This answer was derived from the data above. " * 3
+        return "```json\n" + json.dumps(answer) + "\n```\n" + prose
+
+    return "OK"
+
+
+class RecordedResponder:
+    """
+    Replays responses from an LLM cache file (agent/tools/llm_cache.py) recorded during a
+    real run, so benchmarks see the exact text the model produced. Unknown prompts fall back.
+    """
+
+    def __init__(self, cache_path: str, fallback=canned_responder):
+        conn = sqlite3.connect(cache_path)
+        self.responses = {
+            key: json.loads(response)["message"]["content"]
+            for key, response in conn.execute("SELECT key, response FROM responses")
+        }
+        conn.close()
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, payload) -> str:
+        key = make_key(payload.get("model"), payload.get("messages", []), payload.get("options") or {})
+        if key in self.responses:
+            self.hits += 1
+            return self.responses[key]
+        self.misses += 1
+        return self.fallback(payload)
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for Ollama's /api/chat with HTTP/1.1 keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Like Ollama's Go server: no Nagle delay between header and body writes
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count_request()
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        content = self.server.responder(payload)
+        prompt_tokens = sum(len(_tokens(m.get("content", ""))) for m in payload.get("messages", []))
+        if payload.get("stream"):
+            self._stream(payload, content, prompt_tokens)
+            return
+
+        tokens = _tokens(content)
+        if self.server.token_latency:
+            time.sleep(self.server.token_latency * len(tokens))
+
+        if self.path.startswith("/v1/"):
+            body = {
+                "id": "mock",
+                "object": "chat.completion",
+                "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)},
+            }
+        else:
+            body = {
+                "model": payload.get("model", "mock"),
+                "message": {"role": "assistant", "content": content},
+                "done": True,
+                "done_reason": "stop",
+                "prompt_eval_count": prompt_tokens,
+                "eval_count": len(tokens),
+            }
+        self._send_json(body)
+
+    def _send_json(self, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _stream(self, payload, content, prompt_tokens):
+        """NDJSON token stream with Transfer-Encoding: chunked, like Ollama's stream=true."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        tokens = _tokens(content)
+        try:
+            for token in tokens:
+                if self.server.token_latency:
+                    time.sleep(self.server.token_latency)
+                self._write_chunk(json.dumps({
+                    "model": payload.get("model", "mock"),
+                    "message": {"role": "assistant", "content": token},
+                    "done": False,
+                }).encode("utf-8") + b"\n")
+                self.server.tokens_sent += 1
+            self._write_chunk(json.dumps({
+                "model": payload.get("model", "mock"),
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "done_reason": "stop",
+                "prompt_eval_count": prompt_tokens,
+                "eval_count": len(tokens),
+            }).encode("utf-8") + b"\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client hung up mid-generation (early stop)
+            self.close_connection = True
+
+
+class MockOllamaServer(ThreadingHTTPServer):
+    """
+    Threaded mock server. `latency` is added to every request (time to first token);
+    `token_latency` per generated token, for both blocking and streamed responses.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, responder=None, token_latency: float = 0.0):
+        super().__init__(("127.0.0.1", port), MockOllamaHandler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.tokens_sent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.responder = responder or canned_responder
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose (early-stopped streams, pool shutdown)
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Ollama server")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per generated token")
+    parser.add_argument("--recorded", help="LLM cache file to replay responses from")
+    args = parser.parse_args()
+
+    responder = RecordedResponder(args.recorded) if args.recorded else canned_responder
+    server = MockOllamaServer(port=args.port, latency=args.latency, token_latency=args.token_latency,
+                              responder=responder)
+    print(f"Mock Ollama listening on {server.url}")
+    server.serve_forever()
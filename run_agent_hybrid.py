@@ -3,134 +3,302 @@ import json
 import sys
 import os
 import time  # Import time for tracking
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Ensure the agent module can be imported
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from agent.graph_hybrid import app
+from agent.graph_hybrid import build_app, get_resources, RULE_ROUTER
+from agent.tools.llm_client import get_client, configure_client, POOL_SIZE
+from agent.tracing import trace_question, TraceSummary
 
-def process_batch(input_file, output_file):
+def open_checkpointer(path):
+    """SQLite-backed LangGraph checkpointer (optional dependency: langgraph-checkpoint-sqlite)."""
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError:
+        print("Error: --checkpoint requires the 'langgraph-checkpoint-sqlite' package "
+              "(pip install langgraph-checkpoint-sqlite).")
+        sys.exit(1)
+    import sqlite3
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def load_completed(output_file):
+    """
+    Reads an existing output file for --resume.
+    Returns (kept_lines, completed_ids). Truncated lines (from a crash mid-write) and
+    System Error results are dropped so those questions run again.
+    """
+    kept, completed = [], set()
+    with open(output_file, "r") as f:
+        for line in f:
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if str(obj.get("explanation", "")).startswith("System Error:"):
+                continue
+            kept.append(json.dumps(obj) + "\n")
+            completed.add(obj["id"])
+    return kept, completed
+
+
+def invoke_graph(graph, inputs, q_id, checkpointer=None):
+    """
+    Invokes the graph. With a checkpointer every node's output is saved under
+    thread_id=<question id>, and a question interrupted mid-graph continues from its
+    last completed node instead of starting again at the router.
+    """
+    if checkpointer is None:
+        return graph.invoke(inputs)
+
+    config = {"configurable": {"thread_id": q_id}}
+    snapshot = graph.get_state(config)
+    if snapshot.next:
+        print(f"   [Resume]: continuing at {', '.join(snapshot.next)}")
+        return graph.invoke(None, config)
+    if snapshot.values:
+        # Finished before the crash, but the result never reached the output file
+        print("   [Resume]: already finished, reusing checkpointed state")
+        return snapshot.values
+    return graph.invoke(inputs, config)
+
+
+def run_question(data, position, total, graph=None, checkpointer=None):
+    """
+    Runs one question through the graph.
+    Returns (output_obj, duration, trace) and never raises; failures become error objects.
+    """
+    q_id = data["id"]
+    question = data["question"]
+    format_hint = data["format_hint"]
+    graph = graph or build_app()
+    
+    print(f"\n[{position}/{total}] ID: {q_id}")
+    print(f"Question: {question[:60]}...")
+    
+    # 1. Initialize Input State
+    inputs = {
+        "question": question,
+        "format_hint": format_hint,
+        # Default values for safety
+        "attempt_count": 0,
+        "sql_valid": False,
+        "retrieved_docs": [],
+        "classification": "hybrid" 
+    }
+    
+    # Track Individual Question Time
+    q_start_time = time.time()
+    
+    try:
+        # 2. Invoke the Graph (every node, LLM and SQL call is recorded in the trace)
+        # stream=False waits for the entire graph to finish
+        with trace_question(q_id) as trace:
+            final_state = invoke_graph(graph, inputs, q_id, checkpointer)
+        
+        # 3. Extract Results from State
+        final_answer = final_state.get("final_answer")
+        explanation = final_state.get("explanation") or "No explanation provided."
+        citations = final_state.get("citations") or []
+        
+        # Determine SQL field (Only populate if it was a Hybrid/SQL path)
+        sql_used = ""
+        if final_state.get("classification") == "hybrid":
+            sql_used = final_state.get("sql_query", "")
+        
+        # Heuristic Confidence Calculation
+        confidence = 0.0
+        if final_state.get("sql_valid"):
+            confidence = 1.0
+        elif final_state.get("classification") == "rag":
+            confidence = 0.8
+        
+        if final_answer is None:
+            confidence = 0.0
+        
+        # 4. Construct Output Object (Strict Contract)
+        output_obj = {
+            "id": q_id,
+            "final_answer": final_answer,
+            "sql": sql_used,
+            "confidence": confidence,
+            "explanation": explanation,
+            "citations": list(set(citations)) # Deduplicate citations
+        }
+        
+        # Calculate Duration
+        duration = time.time() - q_start_time
+        
+        # Log success and time
+        print(f"   -> [{q_id}] Answer: {str(final_answer)[:50]}")
+        print(f"   -> [{q_id}] SQL Valid: {final_state.get('sql_valid')}")
+        candidates = final_state.get("sql_candidates") or []
+        if candidates:
+            ok = sum(c["status"] == "ok" for c in candidates)
+            print(f"   -> [{q_id}] SQL Candidates: {ok}/{len(candidates)} finished ran "
+                  f"({sum(c['index'] == 0 for c in candidates)} wave(s))")
+        print(f"   -> [{q_id}] Time: {duration:.2f}s")
+        
+        return output_obj, duration, trace
+        
+    except Exception as e:
+        duration = time.time() - q_start_time
+        print(f"   [CRITICAL FAILURE] [{q_id}]: {e}")
+        print(f"   -> [{q_id}] Time (Failed): {duration:.2f}s")
+        
+        # Fallback error object
+        err_obj = {
+            "id": q_id,
+            "final_answer": None,
+            "sql": "",
+            "confidence": 0.0,
+            "explanation": f"System Error: {str(e)}",
+            "citations": []
+        }
+        return err_obj, duration, None
+
+
+def process_batch(input_file, output_file, workers=1, order="input", trace_file=None,
+                  resume=False, checkpoint_path=None):
+    """
+    Runs every question in input_file and writes one JSON line per question.
+
+    workers > 1 keeps that many questions in flight through the graph at once.
+    order="input" writes results in input order (buffering finished questions until
+    their predecessors are done); order="completion" writes each one as soon as it finishes.
+    trace_file, if given, receives one JSON line of per-node spans per question.
+    resume=True keeps the results already in output_file and only runs the missing ids;
+    checkpoint_path adds per-node LangGraph checkpoints so half-finished questions resume mid-graph.
+    """
     print(f"=== Starting Batch Processing ===")
     print(f"Input: {input_file}")
     print(f"Output: {output_file}")
+    print(f"Workers: {workers} (output order: {order})")
     
     # Track Total Time
     batch_start_time = time.time()
     
     # Read all lines first
     with open(input_file, "r") as f:
-        lines = f.readlines()
+        items = [json.loads(line) for line in f if line.strip()]
+
+    kept_lines = []
+    if resume and os.path.exists(output_file):
+        kept_lines, completed = load_completed(output_file)
+        items = [data for data in items if data["id"] not in completed]
+        print(f"Resume: {len(completed)} already completed, {len(items)} remaining")
 
-    processed_count = 0
+    startup_start = time.time()
+    checkpointer = open_checkpointer(checkpoint_path) if checkpoint_path else None
+    graph = build_app(checkpointer=checkpointer)
+    # Load the model wrapper, schema and BM25 index before the clock starts per question
+    get_resources().warm()
+    print(f"Startup: {time.time() - startup_start:.2f}s")
+    print(f"Database: {get_resources().db_tool.db_path}")
+    if checkpoint_path:
+        print(f"Checkpoints: {checkpoint_path}")
+
+    durations = []
+    traces = TraceSummary(trace_file)
     
     # Open output file for writing results line-by-line
     with open(output_file, "w") as f_out:
-        for line in lines:
-            if not line.strip():
-                continue
-            
-            data = json.loads(line)
-            q_id = data["id"]
-            question = data["question"]
-            format_hint = data["format_hint"]
-            
-            print(f"\n[{processed_count+1}/{len(lines)}] ID: {q_id}")
-            print(f"Question: {question[:60]}...")
-            
-            # 1. Initialize Input State
-            inputs = {
-                "question": question,
-                "format_hint": format_hint,
-                # Default values for safety
-                "attempt_count": 0,
-                "sql_valid": False,
-                "retrieved_docs": [],
-                "classification": "hybrid" 
-            }
-            
-            # Track Individual Question Time
-            q_start_time = time.time()
-            
-            try:
-                # 2. Invoke the Graph
-                # stream=False waits for the entire graph to finish
-                final_state = app.invoke(inputs)
-                
-                # 3. Extract Results from State
-                final_answer = final_state.get("final_answer")
-                explanation = final_state.get("explanation") or "No explanation provided."
-                citations = final_state.get("citations") or []
-                
-                # Determine SQL field (Only populate if it was a Hybrid/SQL path)
-                sql_used = ""
-                if final_state.get("classification") == "hybrid":
-                    sql_used = final_state.get("sql_query", "")
-                
-                # Heuristic Confidence Calculation
-                confidence = 0.0
-                if final_state.get("sql_valid"):
-                    confidence = 1.0
-                elif final_state.get("classification") == "rag":
-                    confidence = 0.8
-                
-                if final_answer is None:
-                    confidence = 0.0
-                
-                # 4. Construct Output Object (Strict Contract)
-                output_obj = {
-                    "id": q_id,
-                    "final_answer": final_answer,
-                    "sql": sql_used,
-                    "confidence": confidence,
-                    "explanation": explanation,
-                    "citations": list(set(citations)) # Deduplicate citations
-                }
-                
-                # Calculate Duration
-                q_end_time = time.time()
-                duration = q_end_time - q_start_time
-                
-                # Log success and time
-                print(f"   -> Answer: {str(final_answer)[:50]}")
-                print(f"   -> SQL Valid: {final_state.get('sql_valid')}")
-                print(f"   -> Time: {duration:.2f}s")
-                
-                # 5. Write to file
-                f_out.write(json.dumps(output_obj) + "\n")
-                f_out.flush() # Ensure it writes immediately
-                
-            except Exception as e:
-                q_end_time = time.time()
-                duration = q_end_time - q_start_time
-                print(f"   [CRITICAL FAILURE]: {e}")
-                print(f"   -> Time (Failed): {duration:.2f}s")
-                
-                # Fallback error object
-                err_obj = {
-                    "id": q_id,
-                    "final_answer": None,
-                    "sql": "",
-                    "confidence": 0.0,
-                    "explanation": f"System Error: {str(e)}",
-                    "citations": []
+        f_out.writelines(kept_lines)
+
+        def record_result(duration, trace):
+            durations.append(duration)
+            if trace is not None:
+                traces.add(trace)
+
+        def write_result(output_obj):
+            f_out.write(json.dumps(output_obj) + "\n")
+            f_out.flush() # Ensure it writes immediately
+            # The result is durable now; its checkpoints are no longer needed
+            if checkpointer is not None and hasattr(checkpointer, "delete_thread"):
+                checkpointer.delete_thread(output_obj["id"])
+
+        # Enough pooled LLM connections for every in-flight question and its SQL candidates
+        in_flight = workers * max(1, get_resources().config["sql_candidates"])
+        if in_flight > POOL_SIZE:
+            configure_client(pool_size=in_flight)
+
+        if workers <= 1:
+            for i, data in enumerate(items):
+                output_obj, duration, trace = run_question(data, i + 1, len(items), graph, checkpointer)
+                record_result(duration, trace)
+                write_result(output_obj)
+        else:
+            pending = {}   # input index -> finished output waiting for its predecessors
+            next_index = 0
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(run_question, data, i + 1, len(items), graph, checkpointer): i
+                    for i, data in enumerate(items)
                 }
-                f_out.write(json.dumps(err_obj) + "\n")
-            
-            processed_count += 1
+                for future in as_completed(futures):
+                    output_obj, duration, trace = future.result()
+                    record_result(duration, trace)
+                    if order == "completion":
+                        write_result(output_obj)
+                        continue
+                    pending[futures[future]] = output_obj
+                    while next_index in pending:
+                        write_result(pending.pop(next_index))
+                        next_index += 1
 
+    traces.close()
+    processed_count = len(durations)
     batch_end_time = time.time()
     total_duration = batch_end_time - batch_start_time
-    avg_duration = total_duration / processed_count if processed_count > 0 else 0
+    avg_duration = sum(durations) / processed_count if processed_count > 0 else 0
+    throughput = processed_count / total_duration if total_duration > 0 else 0
 
     print(f"\n=== Batch Processing Complete ===")
     print(f"Results saved to: {output_file}")
     print(f"Total Time: {total_duration:.2f}s")
     print(f"Average Time per Question: {avg_duration:.2f}s")
+    print(f"Throughput: {throughput:.3f} questions/s ({workers} worker(s))")
+    print(f"Router: {RULE_ROUTER.summary()}")
+    print(f"\n=== Per-Node Latency ===")
+    print(traces.report())
+    if trace_file:
+        print(f"Traces saved to: {trace_file}")
+    cache = get_client().cache
+    if cache is not None:
+        print(f"LLM Cache: {cache.summary()}")
+    print(f"SQL Validator: {get_resources().validator.summary()}")
+    repairer = get_resources().sql_repairer
+    if repairer is not None:
+        print(f"SQL Auto-Repair: {repairer.summary()}")
+    sql_cache = get_resources().db_tool.cache
+    if sql_cache is not None:
+        print(f"SQL Result Cache: {sql_cache.summary()}")
+    plan_compiler = get_resources().plan_compiler
+    if plan_compiler is not None:
+        print(f"Plan Compiler: {plan_compiler.summary()}")
+    kpi_engine = get_resources().kpi_engine
+    if kpi_engine is not None:
+        print(f"KPI Engine: {kpi_engine.summary()}")
+    question_cache = get_resources().question_cache
+    if question_cache is not None:
+        print(f"Question Cache: {question_cache.summary()}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the Retail Analytics Copilot")
     parser.add_argument("--batch", required=True, help="Path to input JSONL file")
     parser.add_argument("--out", required=True, help="Path to output JSONL file")
+    parser.add_argument("--workers", type=int, default=1, help="Number of questions kept in flight concurrently")
+    parser.add_argument("--order", choices=["input", "completion"], default="input",
+                        help="Write results in input order or as soon as each question completes")
+    parser.add_argument("--trace", help="Optional path for a per-question JSONL trace of node timings and LLM token counts")
+    parser.add_argument("--resume", action="store_true",
+                        help="Keep results already in --out and only run questions whose id is missing")
+    parser.add_argument("--checkpoint",
+                        help="SQLite file for per-node LangGraph checkpoints (needs langgraph-checkpoint-sqlite)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass LLM and question cache lookups (fresh entries are still written back)")
     
     args = parser.parse_args()
     
@@ -138,5 +306,11 @@ if __name__ == "__main__":
     if not os.path.exists(args.batch):
         print(f"Error: Input file '{args.batch}' not found.")
         sys.exit(1)
+
+    if args.no_cache and get_client().cache is not None:
+        get_client().cache.bypass = True
+    if args.no_cache and get_resources().question_cache is not None:
+        get_resources().question_cache.bypass = True
         
-    process_batch(args.batch, args.out)
\ No newline at end of file
+    process_batch(args.batch, args.out, workers=args.workers, order=args.order, trace_file=args.trace,
+                  resume=args.resume, checkpoint_path=args.checkpoint)
\ No newline at end of file